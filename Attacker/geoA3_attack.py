@@ -6,29 +6,32 @@ import os
 import sys
 import time
 
-import ipdb
 import numpy as np
-import open3d as o3d
-from pytorch3d.ops import knn_points, knn_gather
 import scipy.io as sio
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.autograd import Variable
-from torch.autograd.gradcheck import zero_gradients
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = BASE_DIR + '/../'
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
 
-from utility import estimate_perpendicular, _compare, farthest_points_sample, pad_larger_tensor_with_index_batch
-from loss_utils import norm_l2_loss, chamfer_loss, pseudo_chamfer_loss, hausdorff_loss, curvature_loss, uniform_loss, _get_kappa_ori, _get_kappa_adv
+from utility import estimate_perpendicular, _compare, add_with_index_batch, get_rng_state, set_rng_state
+from fps import farthest_points_index
+from knn import knn_points, knn_gather
+from stage_profiler import profiler
+from device_policy import get_device_policy
+from spatial_index import Ori_cloud_index, Ori_nn_tracker
+from geo_cache import Geometry_cache
+from loss_utils import Knn_context, Patch_context, norm_l2_loss, chamfer_loss, pseudo_chamfer_loss, hausdorff_loss, curvature_loss, uniform_loss, _get_kappa_ori, _get_kappa_adv
 
 def resample_reconstruct_from_pc(cfg, output_file_name, pc, normal=None, reconstruct_type='PRS'):
     assert pc.size() == 2
     assert pc.size(2) == 3
     assert normal.size() == pc.size()
+    import open3d as o3d
 
     pcd = o3d.geometry.PointCloud()
     pcd.points = o3d.utility.Vector3dVector(pc)
@@ -56,13 +59,18 @@ def resample_reconstruct_from_pc(cfg, output_file_name, pc, normal=None, reconst
 
     return o3d.geometry.TriangleMesh.sample_points_uniformly(output_mesh, number_of_points=cfg.npoint)
 
-def offset_proj(offset, ori_pc, ori_normal, project='dir'):
+def offset_proj(offset, ori_pc, ori_normal, project='dir', ori_index=None):
     # offset: shape [b, 3, n], perturbation offset of each point
     # normal: shape [b, 3, n], normal vector of the object
+    # ori_index: optional Ori_cloud_index over ori_pc
 
-    condition_inner = torch.zeros(offset.shape).cuda().byte()
+    condition_inner = torch.zeros(offset.shape, dtype=torch.bool, device=offset.device)
+    profiler.count('knn_query')
 
-    intra_KNN = knn_points(offset.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    if ori_index is None:
+        intra_KNN = knn_points(offset.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    else:
+        intra_KNN = ori_index.knn(offset, K=1)
     normal = knn_gather(ori_normal.permute(0,2,1), intra_KNN.idx).permute(0,3,1,2).squeeze(3).contiguous() # [b, 3, n]
 
     normal_len = (normal**2).sum(1, keepdim=True).sqrt()
@@ -76,8 +84,14 @@ def offset_proj(offset, ori_pc, ori_normal, project='dir'):
 
     return offset
 
-def find_offset(ori_pc, adv_pc):
-    intra_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+def find_offset(ori_pc, adv_pc, ori_index=None, nn_tracker=None):
+    profiler.count('knn_query')
+    if nn_tracker is not None:
+        intra_KNN = nn_tracker.query(adv_pc)
+    elif ori_index is None:
+        intra_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    else:
+        intra_KNN = ori_index.knn(adv_pc, K=1)
     knn_pc = knn_gather(ori_pc.permute(0,2,1), intra_KNN.idx).permute(0,3,1,2).squeeze(3).contiguous() # [b, 3, n]
 
     real_offset =  adv_pc - knn_pc
@@ -97,13 +111,62 @@ def lp_clip(offset, cc_linf):
 
     return offset
 
-def _forward_step(net, pc_ori, input_curr_iter, normal_ori, ori_kappa, target, scale_const, cfg, targeted):
+def _is_bound_converged(lower_bound, upper_bound, tol):
+    # the bounds on scale_const have closed once their relative gap is below tol
+    return (upper_bound < 1e9) & ((upper_bound - lower_bound) <= tol * upper_bound)
+
+def _init_const_grid(b, initial_const, num_const, decades):
+    # log-spaced candidates of scale_const around initial_const, [b, num_const]
+    if num_const == 1:
+        const_grid = torch.ones(1) * initial_const
+    else:
+        const_grid = initial_const * torch.logspace(-decades, decades, num_const)
+    return const_grid.unsqueeze(0).repeat(b, 1)
+
+def _refine_const_grid(const_grid, is_success, lower_bound, upper_bound, decades):
+    # const_grid, is_success: [b, num_const]; lower_bound, upper_bound: [b]
+    # like the binary search, lower_bound is the largest constant that succeeded and upper_bound the smallest one that failed above it
+    num_const = const_grid.size(1)
+    lower_bound = torch.max(lower_bound, torch.where(is_success, const_grid, torch.zeros_like(const_grid)).max(1)[0])
+    is_fail_above = (~is_success) & (const_grid > lower_bound.unsqueeze(1))
+    upper_bound = torch.min(upper_bound, torch.where(is_fail_above, const_grid, torch.ones_like(const_grid) * 1e10).min(1)[0])
+
+    # the next grid lies strictly inside the bounds, or extends past the open side
+    ratio = torch.arange(1, num_const+1).float().unsqueeze(0) / (num_const+1)
+    lower = lower_bound.unsqueeze(1)
+    upper = upper_bound.unsqueeze(1)
+    between_grid = lower * (upper / lower.clamp(min=1e-10)) ** ratio
+    below_grid = upper * 10 ** (-2 * decades * ratio)
+    above_grid = lower * 10 ** (2 * decades * ratio)
+
+    is_closed = (upper < 1e9) & (lower > 0)
+    const_grid = torch.where(is_closed, between_grid, torch.where(upper < 1e9, below_grid, above_grid))
+
+    return lower_bound, upper_bound, const_grid
+
+def _eval_subsampled(net, input_all, npoint, eval_num, max_batch):
+    # predicted labels of eval_num farthest point samples of every cloud, [w, eval_num]
+    # input_all: [w, 3, n], all the samples go through the network in chunks of max_batch clouds
+    w,_,n = input_all.size()
+    all_pc = input_all.repeat_interleave(eval_num, 0) # [w*eval_num, 3, n]
+    with profiler.stage('fps'):
+        fps_idx = farthest_points_index(all_pc, npoint).to(all_pc.device)
+    all_pc = torch.gather(all_pc, 2, fps_idx.unsqueeze(1).expand(w*eval_num, 3, npoint))
+
+    with profiler.stage('model_forward'):
+        labels = torch.cat([torch.max(net(all_pc[s:s+max_batch]), 1)[1] for s in range(0, w*eval_num, max_batch)])
+    profiler.count('model_forward', (w*eval_num + max_batch - 1) // max_batch)
+    return labels.view(w, eval_num)
+
+def _forward_step(net, pc_ori, input_curr_iter, normal_ori, ori_kappa, target, scale_const, cfg, targeted, ori_index=None, nn_tracker=None, patch_ctx=None):
     #needed cfg:[arch, classes, cls_loss_type, confidence, dis_loss_type, is_cd_single_side, dis_loss_weight, hd_loss_weight, curv_loss_weight, curv_loss_knn]
     b,_,n=input_curr_iter.size()
-    output_curr_iter = net(input_curr_iter)
+    with profiler.stage('model_forward'):
+        output_curr_iter = net(input_curr_iter)
+    profiler.count('model_forward')
 
     if cfg.cls_loss_type == 'Margin':
-        target_onehot = torch.zeros(target.size() + (cfg.classes,)).cuda()
+        target_onehot = torch.zeros(target.size() + (cfg.classes,), dtype=output_curr_iter.dtype, device=output_curr_iter.device)
         target_onehot.scatter_(1, target.unsqueeze(1), 1.)
 
         fake = (target_onehot * output_curr_iter).sum(1)
@@ -118,73 +181,94 @@ def _forward_step(net, pc_ori, input_curr_iter, normal_ori, ori_kappa, target, s
 
     elif cfg.cls_loss_type == 'CE':
         if targeted:
-            cls_loss = nn.CrossEntropyLoss(reduction='none').cuda()(output_curr_iter, Variable(target, requires_grad=False))
+            cls_loss = nn.CrossEntropyLoss(reduction='none')(output_curr_iter, Variable(target, requires_grad=False))
         else:
-            cls_loss = - nn.CrossEntropyLoss(reduction='none').cuda()(output_curr_iter, Variable(target, requires_grad=False))
+            cls_loss = - nn.CrossEntropyLoss(reduction='none')(output_curr_iter, Variable(target, requires_grad=False))
     elif cfg.cls_loss_type == 'None':
-        cls_loss = torch.FloatTensor(b).zero_().cuda()
+        cls_loss = torch.zeros(b, dtype=input_curr_iter.dtype, device=input_curr_iter.device)
     else:
         assert False, 'Not support such clssification loss'
 
     info = 'cls_loss: {0:6.4f}\t'.format(cls_loss.mean().item())
 
-    if cfg.dis_loss_type == 'CD':
-        if cfg.is_cd_single_side:
-            dis_loss = pseudo_chamfer_loss(input_curr_iter, pc_ori)
+    # the neighbour queries shared by the geometric losses of this step
+    ctx = Knn_context(input_curr_iter, pc_ori, ori_index, nn_tracker)
+    # in the patch-local mode, the static points come from the cache of the patch
+    if patch_ctx is not None:
+        patch_ctx.update(input_curr_iter)
+
+    with profiler.stage('dis_loss'):
+        if cfg.dis_loss_type == 'CD':
+            if patch_ctx is not None:
+                dis_loss = patch_ctx.pseudo_chamfer_loss() if cfg.is_cd_single_side else patch_ctx.chamfer_loss()
+            elif cfg.is_cd_single_side:
+                dis_loss = pseudo_chamfer_loss(input_curr_iter, pc_ori, ctx=ctx)
+            else:
+                dis_loss = chamfer_loss(input_curr_iter, pc_ori, ctx=ctx)
+
+            constrain_loss = cfg.dis_loss_weight * dis_loss
+            info = info + 'cd_loss: {0:6.4f}\t'.format(dis_loss.mean().item())
+        elif cfg.dis_loss_type == 'L2':
+            assert cfg.hd_loss_weight ==0
+            dis_loss = norm_l2_loss(input_curr_iter, pc_ori) if patch_ctx is None else patch_ctx.norm_l2_loss()
+            constrain_loss = cfg.dis_loss_weight * dis_loss
+            info = info + 'l2_loss: {0:6.4f}\t'.format(dis_loss.mean().item())
+        elif cfg.dis_loss_type == 'None':
+            dis_loss = 0
+            constrain_loss = 0
         else:
-            dis_loss = chamfer_loss(input_curr_iter, pc_ori)
-
-        constrain_loss = cfg.dis_loss_weight * dis_loss
-        info = info + 'cd_loss: {0:6.4f}\t'.format(dis_loss.mean().item())
-    elif cfg.dis_loss_type == 'L2':
-        assert cfg.hd_loss_weight ==0
-        dis_loss = norm_l2_loss(input_curr_iter, pc_ori)
-        constrain_loss = cfg.dis_loss_weight * dis_loss
-        info = info + 'l2_loss: {0:6.4f}\t'.format(dis_loss.mean().item())
-    elif cfg.dis_loss_type == 'None':
-        dis_loss = 0
-        constrain_loss = 0
-    else:
-        assert False, 'Not support such distance loss'
+            assert False, 'Not support such distance loss'
 
     # hd_loss
     if cfg.hd_loss_weight !=0:
-        hd_loss = hausdorff_loss(input_curr_iter, pc_ori)
-        constrain_loss = constrain_loss + cfg.hd_loss_weight * hd_loss
-        info = info+'hd_loss : {0:6.4f}\t'.format(hd_loss.mean().item())
+        with profiler.stage('hd_loss'):
+            hd_loss = hausdorff_loss(input_curr_iter, pc_ori, ctx=ctx) if patch_ctx is None else patch_ctx.hausdorff_loss()
+            constrain_loss = constrain_loss + cfg.hd_loss_weight * hd_loss
+            info = info+'hd_loss : {0:6.4f}\t'.format(hd_loss.mean().item())
     else:
         hd_loss = 0
 
     # nor loss
     if cfg.curv_loss_weight !=0:
-        adv_kappa, normal_curr_iter = _get_kappa_adv(input_curr_iter, pc_ori, normal_ori, cfg.curv_loss_knn)
-        curv_loss = curvature_loss(input_curr_iter, pc_ori, adv_kappa, ori_kappa)
-        constrain_loss = constrain_loss + cfg.curv_loss_weight * curv_loss
-        info = info+'curv_loss : {0:6.4f}\t'.format(curv_loss.mean().item())
+        with profiler.stage('curv_loss'):
+            if patch_ctx is not None:
+                curv_loss = patch_ctx.curvature_loss()
+                normal_curr_iter = patch_ctx.normal()
+            else:
+                adv_kappa, normal_curr_iter = _get_kappa_adv(input_curr_iter, pc_ori, normal_ori, cfg.curv_loss_knn, ctx=ctx)
+                curv_loss = curvature_loss(input_curr_iter, pc_ori, adv_kappa, ori_kappa, ctx=ctx)
+            constrain_loss = constrain_loss + cfg.curv_loss_weight * curv_loss
+            info = info+'curv_loss : {0:6.4f}\t'.format(curv_loss.mean().item())
     else:
-        normal_curr_iter = torch.zeros(b, 3, n).cuda()
+        normal_curr_iter = torch.zeros_like(input_curr_iter)
         curv_loss = 0
 
     # uniform loss
     if cfg.uniform_loss_weight !=0:
-        uniform = uniform_loss(input_curr_iter)
-        constrain_loss = constrain_loss + cfg.uniform_loss_weight * uniform
-        info = info+'uniform : {0:6.4f}\t'.format(uniform.mean().item())
+        with profiler.stage('uniform_loss'):
+            uniform = uniform_loss(input_curr_iter)
+            constrain_loss = constrain_loss + cfg.uniform_loss_weight * uniform
+            info = info+'uniform : {0:6.4f}\t'.format(uniform.mean().item())
     else:
         uniform = 0
 
-    scale_const = scale_const.float().cuda()
+    scale_const = scale_const.to(input_curr_iter)
     loss_n = cls_loss + scale_const * constrain_loss
     loss = loss_n.mean()
 
     return output_curr_iter, normal_curr_iter, loss, loss_n, cls_loss, dis_loss, hd_loss, curv_loss, constrain_loss, info
 
-def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
+def attack(net, input_data, cfg, i, loader_len, saved_dir=None, resume_state=None, ckpt_fn=None, policy=None):
     #needed cfg:[arch, classes, attack_label, initial_const, lr, optim, binary_max_steps, iter_max_steps, metric,
     #  cls_loss_type, confidence, dis_loss_type, is_cd_single_side, dis_loss_weight, hd_loss_weight, curv_loss_weight, curv_loss_knn,
     #  is_pre_jitter_input, calculate_project_jitter_noise_iter, jitter_k, jitter_sigma, jitter_clip,
     #  is_save_normal,
     #  ]
+    # resume_state: the state passed to ckpt_fn at the end of a search step, to continue the attack from there
+    # policy: Device_policy of the run, from cfg by default
+    if policy is None:
+        policy = get_device_policy(cfg)
+    device, dtype = policy.device, policy.dtype
 
     if cfg.attack_label == 'Untarget':
         targeted = False
@@ -204,46 +288,127 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
     bs, l, _, n = pc.size()
     b = bs*l
 
-    pc_ori = pc.view(b, 3, n).cuda()
-    normal_ori = normal.view(b, 3, n).cuda()
-    gt_target = gt_labels.view(-1)
+    pc_ori = policy.to(pc.view(b, 3, n))
+    normal_ori = policy.to(normal.view(b, 3, n))
+    gt_target = gt_labels.view(-1).to(device)
 
     if cfg.attack_label == 'Untarget':
-        target = gt_target.cuda()
+        target = gt_target
     else:
-        target = input_data[3].view(-1).cuda()
+        target = input_data[3].view(-1).to(device)
+
+    # the l copies of an instance (one per target label) share the same original cloud,
+    # so the geometry of the original clouds is computed once per instance
+    ins_idx = torch.arange(bs, device=device).repeat_interleave(l) # [b]
 
     if cfg.curv_loss_weight !=0:
-        kappa_ori = _get_kappa_ori(pc_ori, normal_ori, cfg.curv_loss_knn)
+        pc_ins, normal_ins = pc_ori[::l], normal_ori[::l]
+        if cfg.geo_cache_dir is not None:
+            geo_cache = Geometry_cache(cfg.geo_cache_dir)
+            kappa_ins = geo_cache.get_batch('kappa_ori', [pc_ins.cpu().numpy(), normal_ins.cpu().numpy()], {'k': cfg.curv_loss_knn},
+                lambda rows: _get_kappa_ori(pc_ins[rows], normal_ins[rows], cfg.curv_loss_knn).cpu().numpy())
+            kappa_ins = policy.to(torch.from_numpy(kappa_ins))
+        else:
+            kappa_ins = _get_kappa_ori(pc_ins, normal_ins, cfg.curv_loss_knn) # [bs, n]
+    else:
+        kappa_ins = None
+
+    # the original clouds never change, so their kd-trees are built once for all the search steps
+    if cfg.is_ori_kdtree:
+        ori_index = Ori_cloud_index(pc_ori, ins_idx=ins_idx)
     else:
-        kappa_ori = None
+        ori_index = None
+
+    is_subsample_opt = (n > cfg.npoint) and (not cfg.is_partial_var) and cfg.is_subsample_opt
+    # the patch cache assumes the losses see input_all itself, which the jitter breaks
+    is_patch_local = cfg.is_partial_var and cfg.is_patch_local
+    if is_patch_local:
+        assert not cfg.is_pre_jitter_input, 'The patch-local losses do not support the jittered input.'
 
     lower_bound = torch.ones(b) * 0
     scale_const = torch.ones(b) * cfg.initial_const
     upper_bound = torch.ones(b) * 1e10
+    is_done = torch.zeros(b).bool()
+    if cfg.num_parallel_const > 0:
+        const_grid = _init_const_grid(b, cfg.initial_const, cfg.num_parallel_const, cfg.parallel_const_decades)
+
+    best_loss = torch.ones(b, dtype=dtype, device=device) * 1e10
+    best_attack = torch.ones(b, 3, n, dtype=dtype, device=device)
+    best_attack_step = -torch.ones(b, dtype=torch.long, device=device)
+    best_attack_BS_idx = -torch.ones(b, dtype=torch.long, device=device)
+    all_loss = -torch.ones(cfg.iter_max_steps, b, dtype=dtype, device=device)
+    start_search_step = 0
+
+    if resume_state is not None:
+        start_search_step = resume_state['search_step']
+        lower_bound, upper_bound, scale_const, is_done = resume_state['lower_bound'], resume_state['upper_bound'], resume_state['scale_const'], resume_state['is_done']
+        if cfg.num_parallel_const > 0:
+            const_grid = resume_state['const_grid']
+        best_loss = policy.to(resume_state['best_loss'])
+        best_attack = policy.to(resume_state['best_attack'])
+        best_attack_step = policy.to(resume_state['best_attack_step'])
+        best_attack_BS_idx = policy.to(resume_state['best_attack_BS_idx'])
+        all_loss = policy.to(resume_state['all_loss'])
+        set_rng_state(resume_state['rng'])
+
+    for search_step in range(start_search_step, cfg.binary_max_steps):
+        # working set of this search step, as indices into the b samples
+        if cfg.is_active_set:
+            is_done = is_done | _is_bound_converged(lower_bound, upper_bound, cfg.active_set_tol)
+            work_idx = torch.nonzero(~is_done).view(-1)
+            if work_idx.size(0) == 0:
+                break
+        else:
+            work_idx = torch.arange(b)
 
-    best_loss = [1e10] * b
-    best_attack = torch.ones(b, 3, n).cuda()
-    best_attack_step = [-1] * b
-    best_attack_BS_idx = [-1] * b
-    all_loss_list = [[-1] * b] * cfg.iter_max_steps
-    for search_step in range(cfg.binary_max_steps):
-        iter_best_loss = [1e10] * b
-        iter_best_score = [-1] * b
-        constrain_loss = torch.ones(b) * 1e10
-        attack_success = torch.zeros(b).cuda()
+        if cfg.num_parallel_const > 0:
+            # every sample is replicated over the candidate constants of its grid
+            sample_idx = work_idx
+            w_scale_const = const_grid[sample_idx].view(-1)
+            work_idx = sample_idx.repeat_interleave(cfg.num_parallel_const)
+        else:
+            w_scale_const = scale_const[work_idx]
+        work_idx_list = work_idx.tolist()
+        w = len(work_idx_list)
+        work_idx = work_idx.to(device)
+
+        w_pc_ori = pc_ori[work_idx]
+        w_normal_ori = normal_ori[work_idx]
+        w_ins_idx = ins_idx[work_idx]
+        w_kappa_ori = kappa_ins[w_ins_idx] if kappa_ins is not None else None
+        w_target = target[work_idx]
+        w_gt_target = gt_target[work_idx]
+        w_ori_index = ori_index.subset(work_idx) if ori_index is not None else None
+        # the tracker needs the same points at every step, which the subsampled optimization breaks
+        if cfg.is_nn_tracker and not is_subsample_opt:
+            nn_tracker = Ori_nn_tracker(w_pc_ori, w_ori_index, ins_idx=w_ins_idx)
+        else:
+            nn_tracker = None
+
+        iter_best_loss = torch.ones(w, dtype=dtype, device=device) * 1e10
+        iter_best_score = -torch.ones(w, dtype=torch.long, device=device)
+        constrain_loss = torch.ones(w) * 1e10
+        attack_success = torch.zeros(w, dtype=dtype, device=device)
 
         input_all = None
+        patch_ctx = None
+        fps_idx = None
 
         for step in range(cfg.iter_max_steps):
             if cfg.is_partial_var:
                 if step%50 == 0:
-                    with torch.no_grad():
+                    with torch.no_grad(), profiler.stage('patch_init'):
                         #FIXME: how about using the critical points?
                         init_point_idx = np.random.randint(n)
 
-                        intra_KNN = knn_points(pc_ori[:, :, init_point_idx].unsqueeze(2).permute(0,2,1), pc_ori.permute(0,2,1), K=cfg.knn_range+1) #[dists:[b,n,cfg.knn_range+1], idx:[b,n,cfg.knn_range+1]]
-                    part_offset = torch.zeros(b, 3, cfg.knn_range).cuda()
+                        if w_ori_index is None:
+                            intra_KNN = knn_points(w_pc_ori[:, :, init_point_idx].unsqueeze(2).permute(0,2,1), w_pc_ori.permute(0,2,1), K=cfg.knn_range+1) #[dists:[w,n,cfg.knn_range+1], idx:[w,n,cfg.knn_range+1]]
+                        else:
+                            intra_KNN = w_ori_index.knn(w_pc_ori[:, :, init_point_idx].unsqueeze(2), K=cfg.knn_range+1)
+                        # the moving points, without the seed point itself
+                        patch_idx = intra_KNN.idx[:, 0, 1:] # [w, knn_range]
+                        profiler.count('knn_query')
+                    part_offset = torch.zeros(w, 3, cfg.knn_range, dtype=dtype, device=device)
                     nn.init.normal_(part_offset, mean=0, std=1e-3)
                     part_offset.requires_grad_()
 
@@ -259,10 +424,13 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
                     try:
                         periodical_pc = input_all.detach().clone()
                     except:
-                        periodical_pc = pc_ori.clone()
+                        periodical_pc = w_pc_ori.clone()
+
+                    if is_patch_local:
+                        patch_ctx = Patch_context(periodical_pc, patch_idx, w_pc_ori, w_normal_ori, w_kappa_ori, cfg.curv_loss_knn, w_ori_index)
             else:
                 if step == 0:
-                    offset = torch.zeros(b, 3, n).cuda()
+                    offset = torch.zeros(w, 3, n, dtype=dtype, device=device)
                     nn.init.normal_(offset, mean=0, std=1e-3)
                     offset.requires_grad_()
 
@@ -274,59 +442,107 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
                         assert False, 'Not support such optimizer.'
                     lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer, gamma=0.9990, last_epoch=-1)
 
-                    periodical_pc = pc_ori.clone()
+                    periodical_pc = w_pc_ori.clone()
 
             if cfg.is_partial_var:
-                offset = pad_larger_tensor_with_index_batch(part_offset, intra_KNN.idx.tolist(), n)
-            input_all = periodical_pc + offset
-
-            if (input_all.size(2) > cfg.npoint) and (not cfg.is_partial_var) and cfg.is_subsample_opt:
-                input_curr_iter = farthest_points_sample(input_all, cfg.npoint)
+                input_all = add_with_index_batch(periodical_pc, part_offset, patch_idx)
+            else:
+                input_all = periodical_pc + offset
+
+            if is_subsample_opt:
+                # the sampled indices are kept between the refreshes, the points are gathered again from input_all
+                with torch.no_grad(), profiler.stage('fps'):
+                    if fps_idx is None or step % cfg.fps_refresh_freq == 0:
+                        fps_idx = farthest_points_index(input_all, cfg.npoint).to(input_all.device) # [w, npoint]
+                        fps_ref_pc = input_all.detach().clone()
+                    elif cfg.fps_refresh_drift > 0:
+                        drift = ((input_all - fps_ref_pc)**2).sum(1).sqrt().max(1)[0] # [w]
+                        refresh_idx = torch.nonzero(drift > cfg.fps_refresh_drift).view(-1)
+                        if refresh_idx.size(0) > 0:
+                            fps_idx[refresh_idx] = farthest_points_index(input_all[refresh_idx], cfg.npoint).to(input_all.device)
+                            fps_ref_pc[refresh_idx] = input_all[refresh_idx].detach()
+                input_curr_iter = torch.gather(input_all, 2, fps_idx.unsqueeze(1).expand(w, 3, cfg.npoint))
             else:
                 input_curr_iter = input_all
 
-            with torch.no_grad():
-                for k in range(b):
+            # the logits of _forward_step can be reused only if the network sees exactly input_all
+            is_batch_eval = cfg.is_reuse_step_logits and (input_curr_iter.size(2) == input_all.size(2)) and (not cfg.is_pre_jitter_input)
+
+            with torch.no_grad(), profiler.stage('success_check'):
+                if not is_batch_eval and input_curr_iter.size(2) < input_all.size(2):
+                    # the majority vote over eval_num samples of every cloud, in batched forwards
+                    eval_labels = _eval_subsampled(net, input_all, cfg.npoint, cfg.eval_num, cfg.eval_max_batch) # [w, eval_num]
+                    eval_success = _compare(eval_labels, w_target.unsqueeze(1), w_gt_target.unsqueeze(1), targeted).sum(1) > 0.5 * cfg.eval_num
+                    eval_label = eval_labels.mode(1).values
+                for k in range(0 if is_batch_eval else w):
+                    kk = work_idx_list[k]
                     if input_curr_iter.size(2) < input_all.size(2):
-                        #batch_k_pc = torch.cat([input_curr_iter[k].unsqueeze(0)]*cfg.eval_num)
-                        batch_k_pc = farthest_points_sample(torch.cat([input_all[k].unsqueeze(0)]*cfg.eval_num), cfg.npoint)
-                        batch_k_adv_output = net(batch_k_pc)
-                        attack_success[k] = _compare(torch.max(batch_k_adv_output,1)[1].data, target[k], gt_target[k], targeted).sum() > 0.5 * cfg.eval_num
-                        output_label = torch.max(batch_k_adv_output,1)[1].mode().values.item()
+                        attack_success[k] = eval_success[k]
+                        output_label = eval_label[k].item()
                     else:
                         adv_output = net(input_curr_iter[k].unsqueeze(0))
+                        profiler.count('model_forward')
                         output_label = torch.argmax(adv_output).item()
-                        attack_success[k] = _compare(output_label, target[k], gt_target[k].cuda(), targeted).item()
+                        attack_success[k] = _compare(output_label, w_target[k], w_gt_target[k], targeted).item()
 
                     metric = constrain_loss[k].item()
 
-                    if attack_success[k] and (metric <best_loss[k]):
-                        best_loss[k] = metric
-                        best_attack[k] = input_all.data[k].clone()
-                        best_attack_BS_idx[k] = search_step
-                        best_attack_step[k] = step
+                    if attack_success[k] and (metric <best_loss[kk]):
+                        best_loss[kk] = metric
+                        best_attack[kk] = input_all.data[k].clone()
+                        best_attack_BS_idx[kk] = search_step
+                        best_attack_step[kk] = step
                     if attack_success[k] and (metric <iter_best_loss[k]):
                         iter_best_loss[k] = metric
                         iter_best_score[k] = output_label
 
             if cfg.is_pre_jitter_input:
                 if step % cfg.calculate_project_jitter_noise_iter == 0:
-                    project_jitter_noise = estimate_perpendicular(input_curr_iter, cfg.jitter_k, sigma=cfg.jitter_sigma, clip=cfg.jitter_clip)
+                    with profiler.stage('jitter'):
+                        project_jitter_noise = estimate_perpendicular(input_curr_iter, cfg.jitter_k, sigma=cfg.jitter_sigma, clip=cfg.jitter_clip)
                 else:
                     project_jitter_noise = project_jitter_noise.clone()
                 input_curr_iter.data  = input_curr_iter.data  + project_jitter_noise
 
-            _, normal_curr_iter, loss, loss_n, cls_loss, dis_loss, hd_loss, nor_loss, constrain_loss, info = _forward_step(net, pc_ori, input_curr_iter, normal_ori, kappa_ori, target, scale_const, cfg, targeted)
+            with profiler.stage('forward_step'):
+                output_curr_iter, normal_curr_iter, loss, loss_n, cls_loss, dis_loss, hd_loss, nor_loss, constrain_loss, info = _forward_step(net, w_pc_ori, input_curr_iter, w_normal_ori, w_kappa_ori, w_target, w_scale_const, cfg, targeted, w_ori_index, nn_tracker, patch_ctx)
+
+            if is_batch_eval:
+                with torch.no_grad(), profiler.stage('success_check'):
+                    output_label = torch.max(output_curr_iter, 1)[1]
+                    attack_success = _compare(output_label, w_target, w_gt_target, targeted)
+                    metric = constrain_loss.detach()
+
+                    is_better = attack_success & (metric < best_loss[work_idx])
+                    # a sample may own several rows of the working set, keep the best one
+                    cand_loss = torch.where(is_better, metric, torch.ones_like(metric) * 1e10)
+                    sample_best_loss = best_loss.clone().scatter_reduce_(0, work_idx, cand_loss, reduce='amin')
+                    is_better = is_better & (cand_loss == sample_best_loss[work_idx])
+                    better_idx = work_idx[is_better]
+                    best_loss[better_idx] = metric[is_better]
+                    best_attack[better_idx] = input_all.data[is_better].clone()
+                    best_attack_BS_idx[better_idx] = search_step
+                    best_attack_step[better_idx] = step
 
-            all_loss_list[step] = loss_n.detach().tolist()
+                    is_better = attack_success & (metric < iter_best_loss)
+                    iter_best_loss = torch.where(is_better, metric, iter_best_loss)
+                    iter_best_score = torch.where(is_better, output_label, iter_best_score)
+
+                    # as in the per-sample loop, report the label of the last sample
+                    output_label = output_label[-1]
+
+            all_loss[step, work_idx] = loss_n.detach()
 
             optimizer.zero_grad()
             if cfg.is_pre_jitter_input:
                 input_curr_iter.retain_grad()
-            loss.backward()
+            with profiler.stage('backward'):
+                loss.backward()
+            profiler.count('model_backward')
             if cfg.is_pre_jitter_input:
                 input_all.grad = input_curr_iter.grad
-            optimizer.step()
+            with profiler.stage('optimizer_step'):
+                optimizer.step()
             if cfg.is_use_lr_scheduler:
                 lr_scheduler.step()
 
@@ -338,16 +554,17 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
                     fout.write('%f %f %f %f %f %f\n' % (input_curr_iter[k, 0, m], input_curr_iter[k, 1, m], input_curr_iter[k, 2, m], normal_curr_iter[k, 0, m], normal_curr_iter[k, 1, m], normal_curr_iter[k, 2, m]))
                 fout.close()
 
-            if cfg.is_pro_grad:
-                with torch.no_grad():
+            # in the partial mode there is no dense offset to project, only part_offset is optimized
+            if cfg.is_pro_grad and not cfg.is_partial_var:
+                with torch.no_grad(), profiler.stage('offset_proj'):
                     if cfg.is_real_offset:
-                        offset.data = find_offset(pc_ori, periodical_pc + offset).data
+                        offset.data = find_offset(w_pc_ori, periodical_pc + offset, w_ori_index, nn_tracker).data
 
-                    proj_offset = offset_proj(offset, pc_ori, normal_ori)
+                    proj_offset = offset_proj(offset, w_pc_ori, w_normal_ori, ori_index=w_ori_index)
                     offset.data = proj_offset.data
 
-            if cfg.cc_linf != 0:
-                with torch.no_grad():
+            if cfg.cc_linf != 0 and not cfg.is_partial_var:
+                with torch.no_grad(), profiler.stage('lp_clip'):
                     proj_offset = lp_clip(offset, cfg.cc_linf)
                     offset.data = proj_offset.data
 
@@ -355,8 +572,9 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
             if (step%50 == 0) and cfg.is_debug:
                 fout = open(os.path.join(saved_dir, 'Obj', str(step)+'af.xyz'), 'w')
                 k=-1
-                for m in range((periodical_pc + offset).shape[2]):
-                    fout.write('%f %f %f %f %f %f\n' % ((periodical_pc + offset)[k, 0, m], (periodical_pc + offset)[k, 1, m], (periodical_pc + offset)[k, 2, m], normal_ori[k, 0, m], normal_ori[k, 1, m], normal_ori[k, 2, m]))
+                af_pc = input_all.detach() if cfg.is_partial_var else periodical_pc + offset
+                for m in range(af_pc.shape[2]):
+                    fout.write('%f %f %f %f %f %f\n' % (af_pc[k, 0, m], af_pc[k, 1, m], af_pc[k, 2, m], w_normal_ori[k, 0, m], w_normal_ori[k, 1, m], w_normal_ori[k, 2, m]))
                 fout.close()
 
             if cfg.is_debug:
@@ -368,22 +586,45 @@ def attack(net, input_data, cfg, i, loader_len, saved_dir=None):
                 print(info)
 
         if cfg.is_debug:
+            import ipdb
             ipdb.set_trace()
 
         # adjust the scale constants
-        for k in range(b):
-            if _compare(output_label, target[k], gt_target[k].cuda(), targeted).item() and iter_best_score[k] != -1:
-                lower_bound[k] = max(lower_bound[k], scale_const[k])
-                if upper_bound[k] < 1e9:
-                    scale_const[k] = (lower_bound[k] + upper_bound[k]) * 0.5
+        if cfg.num_parallel_const > 0:
+            is_success = (iter_best_score != -1).cpu().view(-1, cfg.num_parallel_const)
+            lower_bound[sample_idx], upper_bound[sample_idx], const_grid[sample_idx] = _refine_const_grid(const_grid[sample_idx], is_success, lower_bound[sample_idx], upper_bound[sample_idx], cfg.parallel_const_decades)
+        else:
+            for k in range(w):
+                kk = work_idx_list[k]
+                if iter_best_score[k] != -1 and _compare(iter_best_score[k], w_target[k], w_gt_target[k], targeted).item():
+                    lower_bound[kk] = max(lower_bound[kk], scale_const[kk])
+                    if upper_bound[kk] < 1e9:
+                        scale_const[kk] = (lower_bound[kk] + upper_bound[kk]) * 0.5
+                    else:
+                        scale_const[kk] *= 2
                 else:
-                    scale_const[k] *= 2
-            else:
-                upper_bound[k] = min(upper_bound[k], scale_const[k])
-                if upper_bound[k] < 1e9:
-                    scale_const[k] = (lower_bound[k] + upper_bound[k]) * 0.5
-
-    return best_attack, target, (np.array(best_loss)<1e10), best_attack_step, all_loss_list  #best_attack:[b, 3, n], target: [b], best_loss:[b], best_attack_step:[b], all_loss_list:[iter_max_steps, b]
+                    upper_bound[kk] = min(upper_bound[kk], scale_const[kk])
+                    if upper_bound[kk] < 1e9:
+                        scale_const[kk] = (lower_bound[kk] + upper_bound[kk]) * 0.5
+
+        # the offsets and optimizers are re-initialized at every search step, so this is all the state
+        if ckpt_fn is not None:
+            ckpt_fn({
+                'search_step': search_step + 1,
+                'lower_bound': lower_bound,
+                'upper_bound': upper_bound,
+                'scale_const': scale_const,
+                'is_done': is_done,
+                'const_grid': const_grid if cfg.num_parallel_const > 0 else None,
+                'best_loss': best_loss.cpu(),
+                'best_attack': best_attack.cpu(),
+                'best_attack_step': best_attack_step.cpu(),
+                'best_attack_BS_idx': best_attack_BS_idx.cpu(),
+                'all_loss': all_loss.cpu(),
+                'rng': get_rng_state(),
+            })
+
+    return best_attack, target, (best_loss<1e10).cpu().numpy(), best_attack_step.tolist(), all_loss.tolist(), best_loss.cpu().numpy()  #best_attack:[b, 3, n], target: [b], best_loss<1e10:[b], best_attack_step:[b], all_loss_list:[iter_max_steps, b], best_loss:[b]
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='GEOA3 Point Cloud Attacking')
@@ -429,25 +670,27 @@ if __name__ == '__main__':
 
     sys.path.append(os.path.join(ROOT_DIR, 'Model'))
     sys.path.append(os.path.join(ROOT_DIR, 'Provider'))
+    policy = get_device_policy(cfg)
+    policy.setup()
 
     #data
     from modelnet10_instance250 import ModelNet40
     test_dataset = ModelNet40(data_mat_file=cfg.data_dir_file, attack_label=cfg.attack_label, resample_num=-1)
-    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=True)
+    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=policy.pin_memory)
     test_size = test_dataset.__len__()
     if cfg.dense_data_dir_file != '':
         from modelnet_pure import ModelNet_pure
         dense_test_dataset = ModelNet_pure(data_mat_file=cfg.dense_data_dir_file)
-        dense_test_loader = torch.utils.data.DataLoader(dense_test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=True)
+        dense_test_loader = torch.utils.data.DataLoader(dense_test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=policy.pin_memory)
     else:
         dense_test_loader = None
 
     #model
     from PointNet import PointNet
-    net = PointNet(cfg.classes, npoint=cfg.npoint).cuda()
+    net = policy.model(PointNet(cfg.classes, npoint=cfg.npoint))
     model_path = os.path.join('../Pretrained', 'pointnet_'+str(cfg.npoint)+'.pth.tar')
     log_state_key = 'state_dict'
-    checkpoint = torch.load(model_path)
+    checkpoint = torch.load(model_path, map_location='cpu')
     net.load_state_dict(checkpoint[log_state_key])
     net.eval()
     print('\nSuccessfully load pretrained-model from {}\n'.format(model_path))
@@ -463,7 +706,7 @@ if __name__ == '__main__':
 
     for i, input_data in enumerate(test_loader):
         print('[{0}/{1}]:'.format(i, test_loader.__len__()))
-        adv_pc, targeted_label, attack_success_indicator = attack(net, input_data, cfg, i, len(test_loader))
+        adv_pc, targeted_label, attack_success_indicator = attack(net, input_data, cfg, i, len(test_loader), policy=policy)
         print(adv_pc.shape)
         break
     print('\n Finish! \n')
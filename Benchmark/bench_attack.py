@@ -0,0 +1,192 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import scipy.io as sio
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+
+import main_attack
+from Model.PointNet import PointNet
+# by its bare name, as main_attack imports it
+from stage_profiler import profiler
+
+# the attack settings of the benchmark; a reduced budget of the paper settings
+ATTACK_ARGS = ['--attack', 'GeoA3', '--attack_label', 'Untarget', '--arch', 'PointNet', '--id', '0',
+    '--binary_max_steps', '2', '--iter_max_steps', '20', '--num_workers', '0',
+    '--cls_loss_type', 'CE', '--dis_loss_type', 'CD', '--dis_loss_weight', '1.0', '--hd_loss_weight', '0.1',
+    '--curv_loss_weight', '1.0', '--curv_loss_knn', '16', '--lr', '0.01']
+ten_label_indexes = [17, 9, 36, 20, 3, 16, 34, 38, 23, 15]
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='End-to-End Attack Benchmark')
+    parser.add_argument('--num_ins', type=int, default=8, help='number of synthetic instances')
+    parser.add_argument('--npoint', type=int, default=1024, help='')
+    parser.add_argument('-b', '--batch_size', default=2, type=int, help='')
+    parser.add_argument('--classes', default=40, type=int, help='')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data and of the model weights')
+    parser.add_argument('--attack_args', default='', type=str, help='extra main_attack arguments, e.g. "--iter_max_steps 50 --is_ori_kdtree"')
+    parser.add_argument('--device', default='cpu', type=str, help='device of the attack, cpu | cuda | cuda:k')
+    parser.add_argument('--num_threads', type=int, default=0, help='torch intra-op threads, 0 for the torch default')
+    parser.add_argument('--work_dir', default='Exps/Benchmark', type=str, help='dir of the synthetic data, the random model and the attack outputs')
+    parser.add_argument('--out', default=None, type=str, help='output JSON, Records/bench_attack.json of work_dir by default')
+    parser.add_argument('--baseline', default=None, type=str, help='JSON of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown against the baseline reported as a regression')
+    parser.add_argument('--min_stage_time', type=float, default=0.05, help='stages taking less seconds in the baseline are not compared')
+    parser.add_argument('--is_update_baseline', action='store_true', default=False, help='write the result to --baseline, after the comparison')
+    return parser
+
+def make_data(fpath, num_ins, npoint, seed):
+    # seeded noisy unit spheres with the radial normals, in the layout of Provider/gen_data_mat.py
+    rng = np.random.RandomState(seed)
+    normal = rng.randn(num_ins, 3, npoint)
+    normal = normal / np.linalg.norm(normal, axis=1, keepdims=True)
+    data = normal * (1 + 0.05 * rng.rand(num_ins, 1, npoint))
+    label = np.array([[ten_label_indexes[i % len(ten_label_indexes)]] for i in range(num_ins)])
+    sio.savemat(fpath, {'data': data.astype(np.float32), 'normal': normal.astype(np.float32), 'label': label})
+
+def make_model(fpath, classes, npoint, seed):
+    # a randomly initialized PointNet in the layout main_attack.load_model reads
+    torch.manual_seed(seed)
+    net = PointNet(classes, npoint=npoint)
+    torch.save({'state_dict': net.state_dict()}, fpath)
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def run(cfg):
+    data_file = os.path.join('Data', 'bench_{0}x{1}.mat'.format(cfg.num_ins, cfg.npoint))
+    model_dir = os.path.join('Pretrained', 'PointNet', str(cfg.npoint))
+    for d in ['Data', model_dir]:
+        if not os.path.exists(d):
+            os.makedirs(d)
+    make_data(data_file, cfg.num_ins, cfg.npoint, cfg.seed)
+    make_model(os.path.join(model_dir, 'model_best.pth.tar'), cfg.classes, cfg.npoint, cfg.seed)
+    # a clean output dir, so that no earlier result is resumed or appended to
+    if os.path.exists(os.path.join('Exps', 'PointNet_npoint' + str(cfg.npoint))):
+        shutil.rmtree(os.path.join('Exps', 'PointNet_npoint' + str(cfg.npoint)))
+
+    attack_args = ATTACK_ARGS + ['--data_dir_file', data_file, '--npoint', str(cfg.npoint), '--batch_size', str(cfg.batch_size),
+        '--classes', str(cfg.classes), '--device', cfg.device, '--num_threads', str(cfg.num_threads), '--is_profile'] + cfg.attack_args.split()
+    attack_cfg = main_attack.get_parser().parse_args(attack_args)
+
+    profiler.reset()
+    since = time.perf_counter()
+    main_attack.main(attack_cfg)
+    total = time.perf_counter() - since
+    profile = profiler.state_dict()
+
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'num_threads': torch.get_num_threads(),
+            'num_ins': cfg.num_ins,
+            'npoint': cfg.npoint,
+            'batch_size': cfg.batch_size,
+            'seed': cfg.seed,
+            'attack_args': attack_args,
+        },
+        'total_time': total,
+        'time_per_ins': total / cfg.num_ins,
+        'ins_per_hour': cfg.num_ins / total * 3600,
+        'stages': profile['stages'],
+        'counters': profile['counters'],
+        'batches': profile['batches'],
+    }
+
+def compare(result, baseline, tolerance, min_stage_time):
+    # return: list of the regressions, as printable lines
+    if baseline['meta']['attack_args'] != result['meta']['attack_args']:
+        print('==>Warning: the baseline was run with other settings, {}'.format(baseline['meta']['attack_args']))
+    if baseline['meta']['platform'] != result['meta']['platform'] or baseline['meta']['num_threads'] != result['meta']['num_threads']:
+        print('==>Warning: the baseline was run on another machine or thread count')
+
+    regressions = []
+    def _check(name, new, old):
+        ratio = new / old if old > 0 else float('inf')
+        is_regression = ratio > 1 + tolerance
+        print('{0:<24s} {1:10.3f}s {2:10.3f}s {3:7.2f}x{4}'.format(name, old, new, ratio, '  REGRESSION' if is_regression else ''))
+        if is_regression:
+            regressions.append('{0}: {1:.3f}s -> {2:.3f}s ({3:.2f}x)'.format(name, old, new, ratio))
+
+    print('==>Compared with the baseline of commit {}'.format(baseline['meta']['commit']))
+    print('{0:<24s} {1:>11s} {2:>11s} {3:>8s}'.format('', 'baseline', 'current', 'ratio'))
+    _check('time_per_ins', result['time_per_ins'], baseline['time_per_ins'])
+    # the stages per instance, so that runs with other num_ins stay comparable
+    for name in sorted(baseline['stages']):
+        old = baseline['stages'][name]['time'] / baseline['meta']['num_ins']
+        if name not in result['stages'] or baseline['stages'][name]['time'] < min_stage_time:
+            continue
+        _check(name, result['stages'][name]['time'] / result['meta']['num_ins'], old)
+
+    return regressions
+
+def main(cfg):
+    out = os.path.abspath(cfg.out) if cfg.out is not None else None
+    baseline_file = os.path.abspath(cfg.baseline) if cfg.baseline is not None else None
+    if not os.path.exists(cfg.work_dir):
+        os.makedirs(cfg.work_dir)
+    # main_attack reads and writes relative to the working dir
+    cwd = os.getcwd()
+    os.chdir(cfg.work_dir)
+    try:
+        result = run(cfg)
+        if out is None:
+            out = os.path.abspath(os.path.join('Records', 'bench_attack.json'))
+    finally:
+        os.chdir(cwd)
+
+    print('==>{0} instances in {1:.2f}s, {2:.2f}s per instance, {3:.1f} instances per hour'.format(
+        cfg.num_ins, result['total_time'], result['time_per_ins'], result['ins_per_hour']))
+    out_dir = os.path.dirname(out)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('==>Results written to {}'.format(out))
+
+    regressions = []
+    if baseline_file is not None and os.path.isfile(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, cfg.tolerance, cfg.min_stage_time)
+        if len(regressions) > 0:
+            print('==>{0} regressions beyond {1:.0f}%:\n{2}'.format(len(regressions), cfg.tolerance*100, '\n'.join(regressions)))
+        else:
+            print('==>No regression beyond {0:.0f}%'.format(cfg.tolerance*100))
+    elif baseline_file is not None:
+        print('==>No baseline at {}'.format(baseline_file))
+
+    if cfg.is_update_baseline and baseline_file is not None:
+        with open(baseline_file, 'w') as f:
+            json.dump(result, f, indent=2)
+        print('==>Baseline written to {}'.format(baseline_file))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    cfg = get_parser().parse_args()
+    print(cfg)
+    regressions = main(cfg)
+    sys.exit(1 if len(regressions) > 0 else 0)
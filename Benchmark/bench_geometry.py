@@ -0,0 +1,223 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+sys.path.append(os.path.join(ROOT_DIR, 'Attacker'))
+
+import fps
+from knn import set_knn_backend, get_knn_backend
+from utility import _normalize, estimate_normal, estimate_perpendicular, farthest_points_sample
+from loss_utils import Knn_context, chamfer_loss, pseudo_chamfer_loss, hausdorff_loss, curvature_loss, uniform_loss, _get_kappa_ori, _get_kappa_adv
+
+KERNELS = ['chamfer_loss', 'pseudo_chamfer_loss', 'hausdorff_loss', '_get_kappa_ori', '_get_kappa_adv', 'curvature_loss', 'uniform_loss',
+    'estimate_normal', 'estimate_perpendicular', 'farthest_points_sample', 'offset_proj', 'lp_clip']
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Geometry Kernel Benchmark')
+    parser.add_argument('--kernels', nargs='+', default=KERNELS, choices=KERNELS, help='kernels to time')
+    parser.add_argument('--npoints', nargs='+', type=int, default=[1024, 2048, 5000, 10000], help='number of points per cloud')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 4, 8], help='number of clouds per call')
+    parser.add_argument('--k', type=int, default=16, help='neighbourhood size of the curvature and normal kernels')
+    parser.add_argument('--fps_npoint', type=int, default=1024, help='number of points kept by farthest_points_sample (at most n/2)')
+    parser.add_argument('--cc_linf', type=float, default=0.1, help='bound of lp_clip')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed calls before timing')
+    parser.add_argument('--repeat', type=int, default=5, help='timed calls per case')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic clouds')
+    parser.add_argument('--device', default='cpu', type=str, choices=['cpu', 'cuda'], help='')
+    parser.add_argument('--num_threads', type=int, default=0, help='torch intra-op threads, 0 for the torch default')
+    parser.add_argument('--knn_backend', default='auto', type=str, choices=['auto', 'torch', 'pytorch3d'], help='nearest neighbour search of the kernels')
+    parser.add_argument('--knn_mem_budget', type=float, default=256, help='MB of the distance tiles of the torch knn backend')
+    parser.add_argument('--is_no_isolate', action='store_true', default=False, help='run the cases in this process; the peak memory is then a running high-water mark')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds before an isolated case is abandoned')
+    parser.add_argument('--out', default='Records/bench_geometry.json', type=str, help='output JSON')
+    return parser
+
+def make_clouds(b, n, seed, device):
+    # seeded noisy unit spheres with the radial normals, and a slightly perturbed copy as the adversarial cloud
+    g = torch.Generator().manual_seed(seed * 1000003 + b * 100003 + n)
+    normal = _normalize(torch.randn(b, 3, n, generator=g)) # [b, 3, n]
+    ori_pc = normal * (1 + 0.05 * torch.rand(b, 1, n, generator=g))
+    adv_pc = ori_pc + 0.01 * torch.randn(b, 3, n, generator=g)
+    return ori_pc.to(device), adv_pc.to(device), normal.to(device)
+
+def make_kernel(name, ori_pc, normal, cfg):
+    # return: (fn, is_grad), fn maps the adversarial cloud to the output tensor
+    k = cfg.k
+    if name == 'chamfer_loss':
+        return lambda adv_pc: chamfer_loss(adv_pc, ori_pc), True
+    if name == 'pseudo_chamfer_loss':
+        return lambda adv_pc: pseudo_chamfer_loss(adv_pc, ori_pc), True
+    if name == 'hausdorff_loss':
+        return lambda adv_pc: hausdorff_loss(adv_pc, ori_pc), True
+    if name == '_get_kappa_ori':
+        return lambda adv_pc: _get_kappa_ori(adv_pc, normal, k), False
+    if name == '_get_kappa_adv':
+        return lambda adv_pc: _get_kappa_adv(adv_pc, ori_pc, normal, k)[0], True
+    if name == 'curvature_loss':
+        # as in the attack: the adversarial curvature and the loss share one kNN context
+        ori_kappa = _get_kappa_ori(ori_pc, normal, k)
+        def fn(adv_pc):
+            ctx = Knn_context(adv_pc, ori_pc)
+            adv_kappa, _ = _get_kappa_adv(adv_pc, ori_pc, normal, k, ctx=ctx)
+            return curvature_loss(adv_pc, ori_pc, adv_kappa, ori_kappa, k, ctx=ctx)
+        return fn, True
+    if name == 'uniform_loss':
+        return lambda adv_pc: uniform_loss(adv_pc), True
+    if name == 'estimate_normal':
+        return lambda adv_pc: estimate_normal(adv_pc, k), False
+    if name == 'estimate_perpendicular':
+        return lambda adv_pc: estimate_perpendicular(adv_pc, k), False
+    if name == 'farthest_points_sample':
+        npoint = min(cfg.fps_npoint, ori_pc.size(2) // 2)
+        return lambda adv_pc: farthest_points_sample(adv_pc, npoint), False
+    if name == 'offset_proj':
+        from geoA3_attack import offset_proj
+        return lambda adv_pc: offset_proj(adv_pc - ori_pc, ori_pc, normal), True
+    if name == 'lp_clip':
+        from geoA3_attack import lp_clip
+        return lambda adv_pc: lp_clip(adv_pc - ori_pc, cfg.cc_linf), True
+    assert False, 'Not support such kernel.'
+
+def _sync(device):
+    if device == 'cuda':
+        torch.cuda.synchronize()
+
+def _time_calls(call, num, device):
+    times = []
+    for _ in range(num):
+        _sync(device)
+        since = time.perf_counter()
+        call()
+        _sync(device)
+        times.append(time.perf_counter() - since)
+    return times
+
+def _summary(times):
+    times = np.array(times) * 1000
+    return {'median_ms': float(np.median(times)), 'mean_ms': float(times.mean()), 'min_ms': float(times.min()), 'max_ms': float(times.max())}
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def run_case(name, n, b, cfg):
+    result = {'kernel': name, 'n': n, 'b': b}
+    rss_since = _peak_rss_mb()
+    if cfg.device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    try:
+        ori_pc, adv_pc, normal = make_clouds(b, n, cfg.seed, cfg.device)
+        fn, is_grad = make_kernel(name, ori_pc, normal, cfg)
+
+        def forward():
+            with torch.no_grad():
+                fn(adv_pc)
+        _time_calls(forward, cfg.warmup, cfg.device)
+        fwd = _summary(_time_calls(forward, cfg.repeat, cfg.device))
+        result['forward'] = fwd
+        result['clouds_per_s'] = b / (fwd['median_ms'] / 1000)
+        result['points_per_s'] = b * n / (fwd['median_ms'] / 1000)
+
+        if is_grad:
+            adv_var = adv_pc.clone().requires_grad_()
+            def forward_backward():
+                adv_var.grad = None
+                fn(adv_var).sum().backward()
+            _time_calls(forward_backward, cfg.warmup, cfg.device)
+            result['forward_backward'] = _summary(_time_calls(forward_backward, cfg.repeat, cfg.device))
+        else:
+            result['forward_backward'] = None
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    result['peak_rss_delta_mb'] = result['peak_rss_mb'] - rss_since
+    if cfg.device == 'cuda':
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 1024. / 1024.
+    return result
+
+def _case_worker(queue, name, n, b, cfg):
+    queue.put(run_case(name, n, b, cfg))
+
+def run_case_isolated(name, n, b, cfg):
+    # a forked child per case, so the resident-set high-water mark is the one of this case only
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    p = ctx.Process(target=_case_worker, args=(queue, name, n, b, cfg))
+    p.start()
+    try:
+        result = queue.get(timeout=cfg.timeout)
+    except Exception:
+        p.terminate()
+        result = {'kernel': name, 'n': n, 'b': b, 'error': 'worker exited with code {0}'.format(p.exitcode)}
+    p.join()
+    return result
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def get_meta(cfg):
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'device': cfg.device,
+        'num_threads': torch.get_num_threads(),
+        'knn_backend': get_knn_backend(),
+        'config': vars(cfg),
+    }
+
+def main(cfg):
+    if cfg.num_threads > 0:
+        torch.set_num_threads(cfg.num_threads)
+    set_knn_backend(cfg.knn_backend, cfg.knn_mem_budget)
+    is_isolate = not cfg.is_no_isolate and cfg.device == 'cpu' and 'fork' in mp.get_all_start_methods()
+    # build the compiled FPS once, before the cases fork
+    fps._load_ext()
+
+    results = []
+    for name in cfg.kernels:
+        for n in cfg.npoints:
+            for b in cfg.batch_sizes:
+                result = run_case_isolated(name, n, b, cfg) if is_isolate else run_case(name, n, b, cfg)
+                results.append(result)
+                if 'error' in result:
+                    print('{0:<24s} n={1:<6d} b={2:<3d} failed: {3}'.format(name, n, b, result['error']))
+                else:
+                    fwd_bwd = result['forward_backward']
+                    print('{0:<24s} n={1:<6d} b={2:<3d} fwd {3:9.2f}ms  fwd+bwd {4:>9s}  {5:10.1f} clouds/s  peak rss +{6:.1f}MB'.format(
+                        name, n, b, result['forward']['median_ms'], '-' if fwd_bwd is None else '{0:.2f}ms'.format(fwd_bwd['median_ms']),
+                        result['clouds_per_s'], result['peak_rss_delta_mb']))
+
+    out_dir = os.path.dirname(cfg.out)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with open(cfg.out, 'w') as f:
+        json.dump({'meta': get_meta(cfg), 'results': results}, f, indent=2)
+    print('==>Results written to {}'.format(cfg.out))
+
+
+if __name__ == '__main__':
+    cfg = get_parser().parse_args()
+    print(cfg)
+    main(cfg)
@@ -0,0 +1,85 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+
+# the modules the workers and the short jobs start from
+MODULES = ['Lib.utility', 'Lib.loss_utils', 'Lib.result_store', 'Lib.spatial_index', 'Attacker.geoA3_attack', 'main_attack', 'defense']
+# none of them may pull these in at import time
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'torchvision', 'open3d', 'ipdb', 'pytorch3d.io', 'pytorch3d.ops']
+
+# run in a fresh interpreter without a terminal; prints the import time of torch and of the module, and the heavy modules loaded
+_PROBE = '''
+import json, sys, time
+since = time.perf_counter()
+import torch
+torch_time = time.perf_counter() - since
+since = time.perf_counter()
+import {module}
+module_time = time.perf_counter() - since
+print(json.dumps({{'torch_time': torch_time, 'module_time': module_time, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Import Time Benchmark')
+    parser.add_argument('--modules', nargs='+', default=MODULES, help='modules to import, relative to the repository root')
+    parser.add_argument('--budget', type=float, default=0.5, help='seconds allowed for a module on top of the import of torch')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per module, the fastest is kept')
+    parser.add_argument('--out', default=None, type=str, help='output JSON')
+    return parser
+
+def probe(module, repeat):
+    # return: the fastest of repeat imports, or the error of the import
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)], cwd=ROOT_DIR,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            return {'module': module, 'error': proc.stderr.decode().strip().splitlines()[-1]}
+        result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        if best is None or result['module_time'] < best['module_time']:
+            best = result
+    best['module'] = module
+    return best
+
+def main(cfg):
+    results = []
+    failures = []
+    for module in cfg.modules:
+        result = probe(module, cfg.repeat)
+        results.append(result)
+        if 'error' in result:
+            failures.append('{0}: {1}'.format(module, result['error']))
+            print('{0:<24s} failed: {1}'.format(module, result['error']))
+            continue
+        is_over = result['module_time'] > cfg.budget
+        if is_over:
+            failures.append('{0}: {1:.3f}s over the budget of {2:.3f}s'.format(module, result['module_time'], cfg.budget))
+        if len(result['heavy']) > 0:
+            failures.append('{0}: imports {1}'.format(module, ', '.join(result['heavy'])))
+        print('{0:<24s} {1:7.3f}s (torch {2:.3f}s){3}{4}'.format(module, result['module_time'], result['torch_time'],
+            '  OVER BUDGET' if is_over else '', '  loads ' + ', '.join(result['heavy']) if len(result['heavy']) > 0 else ''))
+
+    if cfg.out is not None:
+        with open(cfg.out, 'w') as f:
+            json.dump({'budget': cfg.budget, 'results': results}, f, indent=2)
+        print('==>Results written to {}'.format(cfg.out))
+
+    if len(failures) > 0:
+        print('==>{0} failures:\n{1}'.format(len(failures), '\n'.join(failures)))
+    else:
+        print('==>All imports within {0:.3f}s on top of torch'.format(cfg.budget))
+    return failures
+
+
+if __name__ == '__main__':
+    cfg = get_parser().parse_args()
+    print(cfg)
+    failures = main(cfg)
+    sys.exit(1 if len(failures) > 0 else 0)
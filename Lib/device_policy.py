@@ -0,0 +1,53 @@
+from __future__ import absolute_import, division, print_function
+
+import torch
+
+
+class Device_policy(object):
+    """Where the tensors and the model of a run live and in which float type.
+    The entry scripts build one from their cfg and hand it down; the Lib functions allocate on the device of their inputs.
+    On the cpu there is no pinned memory (it only helps copies to cuda) and the intra-op threads can be set."""
+    def __init__(self, device='auto', dtype='float32', num_threads=0):
+        if device == 'auto':
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.dtype = getattr(torch, dtype)
+        self.num_threads = num_threads
+        self.is_cuda = self.device.type == 'cuda'
+        if self.is_cuda:
+            assert torch.cuda.is_available(), 'No cuda device, run with --device cpu.'
+        self.pin_memory = self.is_cuda
+
+    def setup(self):
+        # process-wide settings, once per process before the model is built
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+        if self.is_cuda and self.device.index is not None:
+            # the extensions and the default cuda tensors go to the current device
+            torch.cuda.set_device(self.device)
+
+    def manual_seed(self, seed):
+        torch.manual_seed(seed)
+        if self.is_cuda:
+            torch.cuda.manual_seed_all(seed)
+
+    def to(self, x):
+        # float tensors also take the dtype, index and label tensors keep theirs
+        if x.is_floating_point():
+            return x.to(device=self.device, dtype=self.dtype)
+        return x.to(self.device)
+
+    def model(self, net):
+        return net.to(device=self.device, dtype=self.dtype)
+
+    def __repr__(self):
+        return 'Device_policy(device={0}, dtype={1}, num_threads={2})'.format(self.device, self.dtype, self.num_threads)
+
+
+def get_device_policy(cfg, worker_id=None):
+    # cfg: [device, dtype, num_threads], the defaults when missing
+    # worker_id: with several workers and a bare 'cuda', the workers are spread over the visible devices
+    device = getattr(cfg, 'device', 'auto')
+    if worker_id is not None and device in ['auto', 'cuda'] and torch.cuda.is_available():
+        device = 'cuda:{}'.format(worker_id % torch.cuda.device_count())
+    return Device_policy(device, getattr(cfg, 'dtype', 'float32'), getattr(cfg, 'num_threads', 0))
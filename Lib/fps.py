@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy as np
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the compiled CPU kernel is built on first use; without a compiler the torch loop is used instead
+_ext = None
+_is_ext_failed = False
+
+def _load_ext():
+    global _ext, _is_ext_failed
+    if _ext is None and not _is_ext_failed:
+        try:
+            from torch.utils.cpp_extension import load
+            _ext = load('fps_cpu', sources=[os.path.join(BASE_DIR, 'fps_cpu.cpp')], extra_cflags=['-O3', '-fopenmp'], extra_ldflags=['-fopenmp'])
+        except Exception as e:
+            print('==>Compiled FPS not available ({0}), using the torch one'.format(e))
+            _is_ext_failed = True
+    return _ext
+
+def _farthest_points_index_torch(points, num_points, first):
+    # points: [b, 3, n], first: [b]
+    b,_,n = points.size()
+    batch_idx = torch.arange(b, device=points.device)
+    selected = torch.empty(b, num_points, dtype=torch.long, device=points.device)
+    dists = torch.full([b, n], float('inf'), dtype=points.dtype, device=points.device)
+    diff = torch.empty_like(points)
+    curr_dists = torch.empty_like(dists)
+
+    last = first
+    selected[:, 0] = last
+    for s in range(1, num_points):
+        torch.sub(points, points[batch_idx, :, last].unsqueeze(2), out=diff)
+        diff.mul_(diff)
+        torch.sum(diff, 1, out=curr_dists)
+        torch.min(dists, curr_dists, out=dists)
+        last = torch.argmax(dists, dim=1)
+        selected[:, s] = last
+
+    return selected
+
+def farthest_points_index(points, num_points, first=None):
+    # points: [b, 3, n] tensor, first: [b] indices of the starting points (random by default)
+    # return: [b, num_points] long tensor, on the device of points
+    assert points.size(1) == 3
+    b,_,n = points.size()
+    if first is None:
+        first = torch.randint(n, [b])
+
+    with torch.no_grad():
+        points = points.detach()
+        if not points.is_cuda:
+            ext = _load_ext()
+            if ext is not None:
+                return ext.farthest_points_index(points.permute(0,2,1).contiguous(), first.long().cpu(), num_points)
+        return _farthest_points_index_torch(points, num_points, first.long().to(points.device))
+
+def farthest_points_index_numpy(points, num_points, first=None):
+    # points: [n, 3] or [b, n, 3] array, first: indices of the starting points (random by default)
+    # return: [num_points] or [b, num_points] int64 array
+    is_single = points.ndim == 2
+    if is_single:
+        points = points[np.newaxis]
+    b, n, _ = points.shape
+    if first is None:
+        first = [np.random.randint(n) for _ in range(b)]
+
+    points = torch.from_numpy(np.ascontiguousarray(points, dtype=np.float64)).permute(0,2,1)
+    selected = farthest_points_index(points, num_points, torch.from_numpy(np.asarray(first, dtype=np.int64).reshape(b))).numpy()
+
+    return selected[0] if is_single else selected
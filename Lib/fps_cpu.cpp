@@ -0,0 +1,75 @@
+#include <torch/extension.h>
+#include <ATen/Parallel.h>
+
+#include <limits>
+
+// farthest point sampling of b clouds, parallel across the clouds
+// points: [b, n, 3] contiguous, first: [b] long -> idx: [b, m] long
+template <typename scalar_t>
+void farthest_points_index_kernel(int64_t b, int64_t n, int64_t m,
+                                  const scalar_t *points, const int64_t *first,
+                                  scalar_t *dists, int64_t *idx) {
+  at::parallel_for(0, b, 1, [&](int64_t start, int64_t end) {
+    for (int64_t i = start; i < end; ++i) {
+      const scalar_t *pts = points + i * n * 3;
+      scalar_t *dist = dists + i * n;
+      int64_t *out = idx + i * m;
+
+      for (int64_t j = 0; j < n; ++j) {
+        dist[j] = std::numeric_limits<scalar_t>::infinity();
+      }
+
+      int64_t last = first[i];
+      out[0] = last;
+      for (int64_t s = 1; s < m; ++s) {
+        const scalar_t x = pts[last * 3 + 0];
+        const scalar_t y = pts[last * 3 + 1];
+        const scalar_t z = pts[last * 3 + 2];
+        int64_t best = 0;
+        scalar_t best_dist = -1;
+        for (int64_t j = 0; j < n; ++j) {
+          const scalar_t dx = pts[j * 3 + 0] - x;
+          const scalar_t dy = pts[j * 3 + 1] - y;
+          const scalar_t dz = pts[j * 3 + 2] - z;
+          const scalar_t d = dx * dx + dy * dy + dz * dz;
+          if (d < dist[j]) {
+            dist[j] = d;
+          }
+          // the first maximum, as torch.argmax
+          if (dist[j] > best_dist) {
+            best_dist = dist[j];
+            best = j;
+          }
+        }
+        out[s] = best;
+        last = best;
+      }
+    }
+  });
+}
+
+at::Tensor farthest_points_index(at::Tensor points, at::Tensor first,
+                                 const int64_t m) {
+  TORCH_CHECK(!points.is_cuda(), "points must be a CPU tensor");
+  TORCH_CHECK(points.dim() == 3 && points.size(2) == 3,
+              "points must be of shape [b, n, 3]");
+  points = points.contiguous();
+  first = first.to(at::kLong).contiguous();
+
+  const int64_t b = points.size(0);
+  const int64_t n = points.size(1);
+  at::Tensor idx = torch::empty({b, m}, points.options().dtype(at::kLong));
+  at::Tensor dists = torch::empty({b, n}, points.options());
+
+  AT_DISPATCH_FLOATING_TYPES(points.scalar_type(), "farthest_points_index", [&] {
+    farthest_points_index_kernel<scalar_t>(
+        b, n, m, points.data_ptr<scalar_t>(), first.data_ptr<int64_t>(),
+        dists.data_ptr<scalar_t>(), idx.data_ptr<int64_t>());
+  });
+
+  return idx;
+}
+
+PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+  m.def("farthest_points_index", &farthest_points_index);
+}
@@ -0,0 +1,57 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import os
+
+import numpy as np
+
+
+class Geometry_cache(object):
+    """Content-addressed cache of arrays derived from fixed point clouds (curvatures, normals, kNN distances).
+    An entry is keyed by the sha1 of the input arrays and of the name and parameters of the quantity, and is
+    stored as a .npy file that is read memory-mapped. Entries are never invalidated: a changed cloud or a
+    changed parameter is a different key."""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, name, arrays, params):
+        h = hashlib.sha1()
+        h.update(name.encode())
+        h.update(repr(sorted(params.items())).encode())
+        for a in arrays:
+            a = np.ascontiguousarray(a)
+            h.update((str(a.dtype) + str(a.shape)).encode())
+            h.update(a.tobytes())
+        return os.path.join(self.cache_dir, name + '_' + h.hexdigest() + '.npy')
+
+    def _save(self, fpath, value):
+        # written under a temporary name, concurrent jobs computing the same entry do not clash
+        tmp_path = fpath + '.tmp{}'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(value))
+        os.replace(tmp_path, fpath)
+
+    def get(self, name, arrays, params, compute_fn):
+        # arrays: list of numpy arrays the quantity is derived from, compute_fn() -> numpy array
+        fpath = self._path(name, arrays, params)
+        if os.path.exists(fpath):
+            return np.load(fpath, mmap_mode='r')
+        value = compute_fn()
+        self._save(fpath, value)
+        return value
+
+    def get_batch(self, name, arrays, params, compute_fn):
+        # arrays: list of [b, ...] numpy arrays, one entry per row
+        # compute_fn(rows) -> [len(rows), ...] numpy array for the rows missing from the cache
+        b = arrays[0].shape[0]
+        fpaths = [self._path(name, [a[j] for a in arrays], params) for j in range(b)]
+        missing = [j for j in range(b) if not os.path.exists(fpaths[j])]
+        values = {}
+        if len(missing) > 0:
+            computed = compute_fn(missing)
+            for j, value in zip(missing, computed):
+                self._save(fpaths[j], value)
+                values[j] = value
+        return np.stack([values[j] if j in values else np.load(fpaths[j], mmap_mode='r') for j in range(b)])
@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple
+import importlib.util
+
+import torch
+
+# same fields as the output of pytorch3d.ops.knn_points that the losses use
+KNN = namedtuple('KNN', ['dists', 'idx'])
+
+# the backend is looked up at every call, so that the losses follow set_knn_backend without code changes;
+# import this module by its bare name, as the Lib modules do, so that they all share the one setting
+_backends = {}
+_backend_name = 'auto'
+_backend = None
+_mem_budget = 256 * 1024 * 1024
+
+
+def register_knn_backend(name, fn):
+    # fn(query, points, K) -> KNN, with query: [b, m, D], points: [b, n, D], the neighbours sorted by distance
+    _backends[name] = fn
+
+def set_knn_backend(name='auto', mem_budget=None):
+    # name: a registered backend, or 'auto' for pytorch3d when it is installed and torch otherwise
+    # mem_budget: MB for the distance tiles of the torch backend
+    global _backend_name, _backend, _mem_budget
+    assert name == 'auto' or name in _backends, 'Not support such knn backend.'
+    if name == 'pytorch3d':
+        assert importlib.util.find_spec('pytorch3d') is not None, 'pytorch3d is not installed, use the torch knn backend.'
+    _backend_name = name
+    _backend = None
+    if mem_budget is not None:
+        _mem_budget = int(mem_budget * 1024 * 1024)
+
+def get_knn_backend():
+    # return: the name of the backend in use
+    global _backend
+    if _backend is None:
+        name = _backend_name
+        if name == 'auto':
+            name = 'pytorch3d' if importlib.util.find_spec('pytorch3d') is not None else 'torch'
+        _backend = name
+    return _backend
+
+def knn_points(query, points, K=1):
+    # query: [b, m, D], points: [b, n, D]
+    # return [dists:[b,m,K], idx:[b,m,K]], the squared distances differentiable w.r.t. both point sets
+    return _backends[get_knn_backend()](query, points, K)
+
+def knn_gather(x, idx):
+    # x: [b, n, D], idx: [b, m, K] -> [b, m, K, D], like pytorch3d.ops.knn_gather without lengths
+    # flat indexing keeps the backward pass at the size of x instead of [b, m, n, D]
+    b, n, D = x.size()
+    _, m, K = idx.size()
+    flat_idx = (idx + torch.arange(b, device=idx.device).view(b, 1, 1) * n).view(-1)
+    return x.reshape(b*n, D)[flat_idx].view(b, m, K, D)
+
+def _chunk_sizes(b, m, n, K, elem_size):
+    # the query and point chunks whose distance tile, with the top-k copies, fits in the budget
+    per_query = 2 * elem_size * b * (n + K)
+    if per_query <= _mem_budget:
+        return min(m, _mem_budget // per_query), n
+    # a single query over all points is over the budget, the points are tiled as well
+    q_chunk = min(m, 64)
+    p_chunk = _mem_budget // (2 * elem_size * b * q_chunk) - K
+    return q_chunk, min(n, max(K, p_chunk))
+
+def _knn_points_torch(query, points, K):
+    b, m, _ = query.size()
+    n = points.size(1)
+    assert K <= n, 'K is larger than the number of points.'
+
+    with torch.no_grad():
+        q = query.detach()
+        p = points.detach()
+        q_sq = (q * q).sum(-1, keepdim=True) # [b, m, 1]
+        p_sq = (p * p).sum(-1).unsqueeze(1) # [b, 1, n]
+        q_chunk, p_chunk = _chunk_sizes(b, m, n, K, q.element_size())
+
+        idx = torch.empty(b, m, K, dtype=torch.long, device=q.device)
+        for i in range(0, m, q_chunk):
+            q_i = q[:, i:i+q_chunk]
+            best_dists, best_idx = None, None
+            for j in range(0, n, p_chunk):
+                # |q|^2 - 2 q.p + |p|^2 of the tile, [b, q_chunk, p_chunk]
+                dists = torch.baddbmm(p_sq[:, :, j:j+p_chunk], q_i, p[:, j:j+p_chunk].transpose(1, 2), alpha=-2).add_(q_sq[:, i:i+q_chunk])
+                dists, tile_idx = torch.topk(dists, min(K, dists.size(2)), dim=2, largest=False, sorted=False)
+                tile_idx += j
+                if best_dists is not None:
+                    # running top-k over the point tiles
+                    dists = torch.cat([best_dists, dists], dim=2)
+                    tile_idx = torch.cat([best_idx, tile_idx], dim=2)
+                    dists, sel = torch.topk(dists, K, dim=2, largest=False, sorted=False)
+                    tile_idx = tile_idx.gather(2, sel)
+                best_dists, best_idx = dists, tile_idx
+            idx[:, i:i+q_chunk] = best_idx
+
+    # the distances are recomputed from the coordinates, exact and with the gradients w.r.t. both point sets
+    dists = ((query.unsqueeze(2) - knn_gather(points, idx))**2).sum(-1) # [b, m, K]
+    dists, order = torch.sort(dists, dim=2)
+
+    return KNN(dists=dists, idx=idx.gather(2, order))
+
+def _knn_points_pytorch3d(query, points, K):
+    from pytorch3d.ops import knn_points
+    return knn_points(query, points, K=K)
+
+register_knn_backend('torch', _knn_points_torch)
+register_knn_backend('pytorch3d', _knn_points_pytorch3d)
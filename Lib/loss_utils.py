@@ -7,45 +7,218 @@ import sys
 import time
 
 import numpy as np
-from pytorch3d.ops import knn_points, knn_gather
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.autograd import Variable
-from torch.autograd.gradcheck import zero_gradients
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = BASE_DIR + '/../'
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'Model'))
+# pointnet2_ops, when it is not installed
+sys.path.append(os.path.join(ROOT_DIR, 'Model', 'pointnet2_ops_lib'))
 from utility import _normalize
-
+from knn import knn_points, knn_gather
+from spatial_index import knn_points_kdtree
+from stage_profiler import profiler
+
+
+class Knn_context(object):
+    """Shares the neighbour queries of one optimization step between the loss terms.
+    Each query is computed on first use only, so the disabled loss terms never trigger a search.
+    With an Ori_cloud_index, the adv->ori queries go through its kd-trees and the other ones use per-step kd-trees.
+    With an Ori_nn_tracker, the adv->ori 1-NN is updated from the previous step instead of searched again."""
+    def __init__(self, adv_pc, ori_pc, ori_index=None, nn_tracker=None):
+        # adv_pc, ori_pc: [b, 3, n]
+        self.adv_pc = adv_pc
+        self.ori_pc = ori_pc
+        self.ori_index = ori_index
+        self.nn_tracker = nn_tracker
+        self._knn = knn_points if ori_index is None else knn_points_kdtree
+        self._adv_ori_KNN = None
+        self._ori_adv_KNN = None
+        self._adv_self_KNN = {}
+
+    @property
+    def adv_ori_KNN(self):
+        # 1-NN of each adversarial point in the original cloud, [dists:[b,n,1], idx:[b,n,1]]
+        if self._adv_ori_KNN is None:
+            profiler.count('knn_query')
+            if self.nn_tracker is not None:
+                self._adv_ori_KNN = self.nn_tracker.query(self.adv_pc)
+            elif self.ori_index is None:
+                self._adv_ori_KNN = knn_points(self.adv_pc.permute(0,2,1), self.ori_pc.permute(0,2,1), K=1)
+            else:
+                self._adv_ori_KNN = self.ori_index.knn(self.adv_pc, K=1)
+        return self._adv_ori_KNN
+
+    @property
+    def ori_adv_KNN(self):
+        # 1-NN of each original point in the adversarial cloud, [dists:[b,n,1], idx:[b,n,1]]
+        if self._ori_adv_KNN is None:
+            profiler.count('knn_query')
+            self._ori_adv_KNN = self._knn(self.ori_pc.permute(0,2,1), self.adv_pc.permute(0,2,1), K=1)
+        return self._ori_adv_KNN
+
+    def adv_self_KNN(self, k):
+        # k-NN of the adversarial cloud in itself (the point itself included), [dists:[b,n,k+1], idx:[b,n,k+1]]
+        if k not in self._adv_self_KNN:
+            profiler.count('knn_query')
+            self._adv_self_KNN[k] = self._knn(self.adv_pc.permute(0,2,1), self.adv_pc.permute(0,2,1), K=k+1)
+        return self._adv_self_KNN[k]
+
+def _gather_rows(x, idx):
+    # x: [b, n, c], idx: [b, ...] -> [b, ..., c]
+    b, _, c = x.size()
+    flat_idx = idx.reshape(b, -1)
+    return torch.gather(x, 1, flat_idx.unsqueeze(2).expand(b, flat_idx.size(1), c)).view(idx.size() + (c,))
+
+def _patch_kappa(pts, idx, nbr_idx, nn_idx, ori_normal):
+    # kappa of the points idx:[b, m] as in _get_kappa_adv, with their k-NN nbr_idx:[b, m, k] and the adv->ori 1-NN nn_idx:[b, n] given
+    # pts, ori_normal: [b, n, 3]
+    vectors = _gather_rows(pts, nbr_idx) - _gather_rows(pts, idx).unsqueeze(2) # [b, m, k, 3]
+    vectors = _normalize(vectors, dim=3)
+    normal = _gather_rows(ori_normal, torch.gather(nn_idx, 1, idx)) # [b, m, 3]
+    return torch.abs((vectors*normal.unsqueeze(2)).sum(3)).mean(2) # [b, m]
+
+class Patch_context(object):
+    """Geometric losses of the partial-variable mode, where only the patch points move during a patch period.
+    The contributions of the static points (their adv->ori distances, the ori->static distances, their
+    displacement and their curvature term) are computed once per patch; a step only queries the patch points
+    and reduces with the cached values. The curvature term of a static point changes only when a patch point
+    leaves or enters its k-NN, so a step recomputes, against the current cloud, the k-NN and the curvature of
+    the patch points, of the static points that had a patch point among their k-NN at the start of the
+    period, and of those whose k-th neighbour distance now exceeds the distance to a patch point."""
+    def __init__(self, periodical_pc, patch_idx, ori_pc, ori_normal, ori_kappa=None, k=2, ori_index=None):
+        # periodical_pc, ori_pc, ori_normal: [b, 3, n], patch_idx: [b, p], ori_kappa: [b, n]
+        self.patch_idx = patch_idx
+        self.ori_index = ori_index
+        self.ori_kappa = ori_kappa
+        self.ori = ori_pc.permute(0,2,1).contiguous()
+        self.ori_normal = ori_normal.permute(0,2,1).contiguous()
+
+        with torch.no_grad():
+            b,_,n = periodical_pc.size()
+            self.n = n
+            pts = periodical_pc.permute(0,2,1).contiguous()
+            is_patch = torch.zeros(b, n, dtype=torch.bool, device=pts.device).scatter_(1, patch_idx, True)
+            is_static = (~is_patch).float()
+            static_idx = torch.nonzero(~is_patch)[:, 1].view(b, n - patch_idx.size(1))
+
+            adv_KNN = self._adv_ori_knn(pts) #[dists:[b,n,1], idx:[b,n,1]]
+            self.nn_idx = adv_KNN.idx.squeeze(-1) # [b, n]
+            static_dists = adv_KNN.dists.squeeze(-1) * is_static
+            self.adv_static_sum = static_dists.sum(1) # [b]
+            self.adv_static_max = static_dists.max(1)[0] # [b]
+            self.ori_static_dists = knn_points(self.ori, _gather_rows(pts, static_idx), K=1).dists.squeeze(-1) # [b, n]
+            self.l2_static = (((pts - self.ori)**2).sum(2) * is_static).sum(1) # [b]
+
+            if ori_kappa is not None:
+                self.k = k
+                graph_KNN = knn_points(pts, pts, K=k+1) #[dists:[b,n,k+1], idx:[b,n,k+1]]
+                graph = graph_KNN.idx[:, :, 1:] # [b, n, k]
+                self.is_touched = is_patch | torch.gather(is_patch, 1, graph.reshape(b, -1)).view(b, n, k).any(2)
+                # a patch point closer than this enters the k-NN of a static point
+                self.static_radius = graph_KNN.dists[:, :, k] # [b, n]
+                all_idx = torch.arange(n, device=pts.device).unsqueeze(0).expand(b, n)
+                kappa = _patch_kappa(pts, all_idx, graph, self.nn_idx, self.ori_normal)
+                self.static_curv = (kappa - torch.gather(ori_kappa, 1, self.nn_idx))**2 * is_static # [b, n]
+
+    def _adv_ori_knn(self, pts):
+        profiler.count('knn_query')
+        if self.ori_index is None:
+            return knn_points(pts, self.ori, K=1)
+        return self.ori_index.knn(pts.permute(0,2,1), K=1)
+
+    def update(self, adv_pc):
+        # adv_pc: [b, 3, n], equal to periodical_pc except at the patch points
+        self.pts = adv_pc.permute(0,2,1)
+        self.patch_pts = _gather_rows(self.pts, self.patch_idx) # [b, p, 3]
+        patch_KNN = self._adv_ori_knn(self.patch_pts) #[dists:[b,p,1], idx:[b,p,1]]
+        self.patch_dists = patch_KNN.dists.squeeze(-1) # [b, p]
+        self.cur_nn_idx = self.nn_idx.scatter(1, self.patch_idx, patch_KNN.idx.squeeze(-1)) # [b, n]
+        self._ori_adv_dists = None
+        self._touched = None
+
+    def _touched_knn(self):
+        # return [touched_idx:[b,a], touched_mask:[b,a], nbr_idx:[b,a,k], is_touched:[b,n]],
+        # the touched points first, padded with untouched ones masked out
+        if self._touched is None:
+            with torch.no_grad():
+                pts = self.pts.detach()
+                patch_pts = self.patch_pts.detach()
+                b = pts.size(0)
+                # [b, p, n], the margin only adds points to recompute
+                patch_dists = ((patch_pts.unsqueeze(2) - pts.unsqueeze(1))**2).sum(3)
+                is_reached = (patch_dists <= self.static_radius.unsqueeze(1) * (1 + 1e-4)).any(1)
+                is_touched = self.is_touched | is_reached
+                num_touched = int(is_touched.sum(1).max().item())
+                touched_idx = torch.sort(is_touched.int(), dim=1, descending=True)[1][:, :num_touched] # [b, a]
+                touched_mask = torch.gather(is_touched, 1, touched_idx).float()
+                profiler.count('knn_query')
+                nbr_idx = knn_points(_gather_rows(pts, touched_idx), pts, K=self.k+1).idx[:, :, 1:] # [b, a, k]
+            self._touched = (touched_idx, touched_mask, nbr_idx, is_touched)
+        return self._touched
+
+    def pseudo_chamfer_loss(self):
+        return (self.adv_static_sum + self.patch_dists.sum(1)) / self.n
+
+    def chamfer_loss(self):
+        if self._ori_adv_dists is None:
+            profiler.count('knn_query')
+            ori_patch_dists = knn_points(self.ori, self.patch_pts, K=1).dists.squeeze(-1) # [b, n]
+            self._ori_adv_dists = torch.min(self.ori_static_dists, ori_patch_dists)
+        return self.pseudo_chamfer_loss() + self._ori_adv_dists.mean(1)
+
+    def hausdorff_loss(self):
+        return torch.max(self.adv_static_max, self.patch_dists.max(1)[0])
+
+    def norm_l2_loss(self):
+        return ((self.patch_pts - _gather_rows(self.ori, self.patch_idx))**2).sum(2).sum(1) + self.l2_static
+
+    def curvature_loss(self):
+        touched_idx, touched_mask, nbr_idx, is_touched = self._touched_knn()
+        kappa = _patch_kappa(self.pts, touched_idx, nbr_idx, self.cur_nn_idx, self.ori_normal) # [b, a]
+        ori_kappa = torch.gather(self.ori_kappa, 1, torch.gather(self.cur_nn_idx, 1, touched_idx))
+        curv = (((kappa - ori_kappa)**2) * touched_mask).sum(1)
+        curv_static = (self.static_curv * (~is_touched).float()).sum(1) # [b]
+        return (curv_static + curv) / self.n
+
+    def normal(self):
+        # ori normal at the 1-NN of every point, [b, 3, n]
+        return _gather_rows(self.ori_normal, self.cur_nn_idx).permute(0,2,1).contiguous()
 
 def norm_l2_loss(adv_pc, ori_pc):
     return ((adv_pc - ori_pc)**2).sum(1).sum(1)
 
-def chamfer_loss(adv_pc, ori_pc):
+def chamfer_loss(adv_pc, ori_pc, ctx=None):
     # Chamfer distance (two sides)
     #intra_dis = ((adv_pc.unsqueeze(3) - ori_pc.unsqueeze(2))**2).sum(1)
     #dis_loss = intra_dis.min(2)[0].mean(1) + intra_dis.min(1)[0].mean(1)
-    adv_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
-    ori_KNN = knn_points(ori_pc.permute(0,2,1), adv_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    if ctx is None:
+        ctx = Knn_context(adv_pc, ori_pc)
+    adv_KNN = ctx.adv_ori_KNN #[dists:[b,n,1], idx:[b,n,1]]
+    ori_KNN = ctx.ori_adv_KNN #[dists:[b,n,1], idx:[b,n,1]]
     dis_loss = adv_KNN.dists.contiguous().squeeze(-1).mean(-1) + ori_KNN.dists.contiguous().squeeze(-1).mean(-1) #[b]
     return dis_loss
 
-def pseudo_chamfer_loss(adv_pc, ori_pc):
+def pseudo_chamfer_loss(adv_pc, ori_pc, ctx=None):
     # Chamfer pseudo distance (one side)
     #intra_dis = ((adv_pc.unsqueeze(3) - ori_pc.unsqueeze(2))**2).sum(1) #b*n*n
     #dis_loss = intra_dis.min(2)[0].mean(1)
-    adv_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    if ctx is None:
+        ctx = Knn_context(adv_pc, ori_pc)
+    adv_KNN = ctx.adv_ori_KNN #[dists:[b,n,1], idx:[b,n,1]]
     dis_loss = adv_KNN.dists.contiguous().squeeze(-1).mean(-1) #[b]
     return dis_loss
 
-def hausdorff_loss(adv_pc, ori_pc):
+def hausdorff_loss(adv_pc, ori_pc, ctx=None):
     #dis = ((adv_pc.unsqueeze(3) - ori_pc.unsqueeze(2))**2).sum(1)
     #hd_loss = torch.max(torch.min(dis, dim=2)[0], dim=1)[0]
-    adv_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    if ctx is None:
+        ctx = Knn_context(adv_pc, ori_pc)
+    adv_KNN = ctx.adv_ori_KNN #[dists:[b,n,1], idx:[b,n,1]]
     hd_loss = adv_KNN.dists.contiguous().squeeze(-1).max(-1)[0] #[b]
     return hd_loss
 
@@ -61,35 +234,39 @@ def _get_kappa_ori(pc, normal, k=2):
 
     return torch.abs((vectors*normal.unsqueeze(3)).sum(1)).mean(2) # [b, n]
 
-def _get_kappa_adv(adv_pc, ori_pc, ori_normal, k=2):
+def _get_kappa_adv(adv_pc, ori_pc, ori_normal, k=2, ctx=None):
     b,_,n=adv_pc.size()
+    if ctx is None:
+        ctx = Knn_context(adv_pc, ori_pc)
     # compute knn between advPC and oriPC to get normal n_p
     #intra_dis = ((adv_pc.unsqueeze(3) - ori_pc.unsqueeze(2))**2).sum(1)
     #intra_idx = torch.topk(intra_dis, 1, dim=2, largest=False, sorted=True)[1]
     #normal = torch.gather(ori_normal, 2, intra_idx.view(b,1,n).expand(b,3,n))
-    intra_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    intra_KNN = ctx.adv_ori_KNN #[dists:[b,n,1], idx:[b,n,1]]
     normal = knn_gather(ori_normal.permute(0,2,1), intra_KNN.idx).permute(0,3,1,2).squeeze(3).contiguous() # [b, 3, n]
 
     # compute knn between advPC and itself to get \|q-p\|_2
     #inter_dis = ((adv_pc.unsqueeze(3) - adv_pc.unsqueeze(2))**2).sum(1)
     #inter_idx = torch.topk(inter_dis, k+1, dim=2, largest=False, sorted=True)[1][:, :, 1:].contiguous()
     #nn_pts = torch.gather(adv_pc, 2, inter_idx.view(b,1,n*k).expand(b,3,n*k)).view(b,3,n,k)
-    inter_KNN = knn_points(adv_pc.permute(0,2,1), adv_pc.permute(0,2,1), K=k+1) #[dists:[b,n,k+1], idx:[b,n,k+1]]
+    inter_KNN = ctx.adv_self_KNN(k) #[dists:[b,n,k+1], idx:[b,n,k+1]]
     nn_pts = knn_gather(adv_pc.permute(0,2,1), inter_KNN.idx).permute(0,3,1,2)[:,:,:,1:].contiguous() # [b, 3, n ,k]
     vectors = nn_pts - adv_pc.unsqueeze(3)
     vectors = _normalize(vectors)
 
     return torch.abs((vectors*normal.unsqueeze(3)).sum(1)).mean(2), normal # [b, n], [b, 3, n]
 
-def curvature_loss(adv_pc, ori_pc, adv_kappa, ori_kappa, k=2):
+def curvature_loss(adv_pc, ori_pc, adv_kappa, ori_kappa, k=2, ctx=None):
     b,_,n=adv_pc.size()
+    if ctx is None:
+        ctx = Knn_context(adv_pc, ori_pc)
 
     # intra_dis = ((input_curr_iter.unsqueeze(3) - pc_ori.unsqueeze(2))**2).sum(1)
     # intra_idx = torch.topk(intra_dis, 1, dim=2, largest=False, sorted=True)[1]
     # knn_theta_normal = torch.gather(theta_normal, 1, intra_idx.view(b,n).expand(b,n))
     # curv_loss = ((curv_loss - knn_theta_normal)**2).mean(-1)
 
-    intra_KNN = knn_points(adv_pc.permute(0,2,1), ori_pc.permute(0,2,1), K=1) #[dists:[b,n,1], idx:[b,n,1]]
+    intra_KNN = ctx.adv_ori_KNN #[dists:[b,n,1], idx:[b,n,1]]
     onenn_ori_kappa = torch.gather(ori_kappa, 1, intra_KNN.idx.squeeze(-1)).contiguous() # [b, n]
 
     curv_loss = ((adv_kappa - onenn_ori_kappa)**2).mean(-1)
@@ -149,6 +326,8 @@ def kNN_smoothing_loss(adv_pc, k, threshold_coef=1.05):
     return dis_mean.mean(1) #[b]
 
 def uniform_loss(adv_pc, percentages=[0.004,0.006,0.008,0.010,0.012], radius=1.0, k=2):
+    # its extension is compiled on first use
+    from pointnet2_ops import pointnet2_utils
     if adv_pc.size(1) == 3:
         adv_pc = adv_pc.permute(0,2,1).contiguous()
     b,n,_=adv_pc.size()
@@ -158,7 +337,7 @@ def uniform_loss(adv_pc, percentages=[0.004,0.006,0.008,0.010,0.012], radius=1.0
         nsample = int(n*p)
         r = math.sqrt(p*radius)
         disk_area = math.pi *(radius ** 2) * p/nsample
-        expect_len = torch.sqrt(torch.Tensor([disk_area])).cuda()
+        expect_len = torch.sqrt(torch.Tensor([disk_area])).to(adv_pc)
 
         adv_pc_flipped = adv_pc.transpose(1, 2).contiguous()
         new_xyz = pointnet2_utils.gather_operation(adv_pc_flipped, pointnet2_utils.furthest_point_sample(adv_pc, npoint)).transpose(1, 2).contiguous() # (batch_size, npoint, 3)
@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import sys
+
+import numpy as np
+import scipy.io as sio
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from utility import write_pc_obj
+
+# every append is a shard directory 'shard_<id>' holding one .npy file per field, the shard
+# becomes visible only once all its files are written, so several processes can append to
+# the same store and a reader never sees a partial shard
+fields = ['points', 'est_normal', 'gt_label', 'target_label', 'pred_label', 'instance_idx', 'best_step', 'dist']
+
+
+def is_store(store_dir):
+    return os.path.isdir(store_dir) and any(name.startswith('shard_') and not name.endswith('.tmp') for name in os.listdir(store_dir))
+
+
+class Result_store(object):
+    """Appendable store of the adversarial examples of an experiment, in .npy shards that are read memory-mapped.
+    points:[m, 3, n], est_normal:[m, 3, n] (optional), gt_label/target_label/pred_label/instance_idx/best_step:[m], dist:[m]"""
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir, exist_ok=True)
+        self.shards = None
+
+    def append(self, shard_id, records):
+        # records: dict of the fields, all with the same first dimension
+        shard_dir = os.path.join(self.store_dir, 'shard_{:06d}'.format(shard_id))
+        tmp_dir = shard_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for key, value in records.items():
+            assert key in fields, 'Unknown field {}'.format(key)
+            np.save(os.path.join(tmp_dir, key + '.npy'), np.ascontiguousarray(value))
+        # a shard written again (e.g. after resuming) replaces the previous one
+        if os.path.exists(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.rename(tmp_dir, shard_dir)
+        self.shards = None
+
+    def _load_index(self):
+        if self.shards is not None:
+            return
+        names = sorted(name for name in os.listdir(self.store_dir) if name.startswith('shard_') and not name.endswith('.tmp'))
+        self.shards = []
+        for name in names:
+            shard_dir = os.path.join(self.store_dir, name)
+            shard = {key[:-4]: os.path.join(shard_dir, key) for key in os.listdir(shard_dir) if key.endswith('.npy')}
+            self.shards.append(shard)
+        sizes = [np.load(shard['gt_label'], mmap_mode='r').shape[0] for shard in self.shards]
+        self.offsets = np.cumsum([0] + sizes)
+
+    def __len__(self):
+        self._load_index()
+        return int(self.offsets[-1])
+
+    def has_field(self, key):
+        self._load_index()
+        return len(self.shards) > 0 and all(key in shard for shard in self.shards)
+
+    def get_field(self, key, shard_idx):
+        # memory-mapped array of a field in one shard
+        self._load_index()
+        return np.load(self.shards[shard_idx][key], mmap_mode='r')
+
+    def __getitem__(self, index):
+        # dict of the fields of the index-th example
+        self._load_index()
+        if index < 0:
+            index += len(self)
+        shard_idx = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        k = index - self.offsets[shard_idx]
+        return {key: np.array(self.get_field(key, shard_idx)[k]) for key in self.shards[shard_idx]}
+
+    def load(self, key):
+        # a field of all the examples, concatenated
+        self._load_index()
+        return np.concatenate([self.get_field(key, s) for s in range(len(self.shards))], axis=0)
+
+    def legacy_name(self, record):
+        return 'adv_' + str(int(record['instance_idx'])) + '_gt' + str(int(record['gt_label'])) + '_attack' + str(int(record['pred_label'])) + '_expect' + str(int(record['target_label']))
+
+
+def export_legacy(store_dir, saved_dir):
+    # write the per-example Mat/*.mat and PC/*.obj layout of main_attack.py
+    store = Result_store(store_dir)
+    for sub_dir in ['Mat', 'PC']:
+        if not os.path.exists(os.path.join(saved_dir, sub_dir)):
+            os.makedirs(os.path.join(saved_dir, sub_dir))
+
+    for index in range(len(store)):
+        record = store[index]
+        name = store.legacy_name(record)
+        mat_dict = {"adversary_point_clouds": record['points'], 'gt_label': int(record['gt_label']), 'attack_label': int(record['pred_label'])}
+        if 'est_normal' in record:
+            mat_dict['est_normal'] = record['est_normal']
+        sio.savemat(os.path.join(saved_dir, 'Mat', name+'.mat'), mat_dict)
+        write_pc_obj(os.path.join(saved_dir, 'PC', name+'.obj'), record['points'].T)
+
+    print('==>Exported {} examples to {}'.format(len(store), saved_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a result store to .mat and .obj files')
+    parser.add_argument('--store_dir', type=str, help='e.g. Exps/.../Store')
+    parser.add_argument('--out_dir', default=None, type=str, help='default: the parent of store_dir')
+
+    cfg  = parser.parse_args()
+    if cfg.out_dir is None:
+        cfg.out_dir = os.path.dirname(os.path.abspath(cfg.store_dir))
+
+    export_legacy(cfg.store_dir, cfg.out_dir)
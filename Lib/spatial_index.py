@@ -0,0 +1,195 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from knn import KNN, knn_points, knn_gather
+
+
+def _query_trees(query, points, trees, tree_idx, K):
+    # query: [b, m, 3], points: [b, n, 3], trees[tree_idx[i]] is built over points[i]
+    b, m, _ = query.size()
+    query_np = query.detach().cpu().numpy()
+    idx = np.zeros((b, m, K), dtype=np.int64)
+
+    # rows sharing a tree are answered by a single call
+    for t in set(tree_idx):
+        rows = [i for i in range(b) if tree_idx[i] == t]
+        _, rows_idx = trees[t].query(query_np[rows].reshape(-1, 3), k=K, workers=-1)
+        idx[rows] = rows_idx.reshape(len(rows), m, K)
+
+    idx = torch.from_numpy(idx).to(query.device)
+    # the distances are recomputed in torch to keep the gradients w.r.t. both point sets
+    nn_pts = knn_gather(points, idx)
+    dists = ((query.unsqueeze(2) - nn_pts)**2).sum(-1) # [b, m, K]
+
+    return KNN(dists=dists, idx=idx)
+
+def instance_rows(ins_idx):
+    # ins_idx: [b], rows with the same index hold the same cloud
+    # return [rows:[m], one row per instance, inv:[b], position of the instance of every row in rows]
+    ins_list = ins_idx.tolist()
+    first = {}
+    for row, ins in enumerate(ins_list):
+        first.setdefault(ins, row)
+    pos = {ins: j for j, ins in enumerate(first)}
+    rows = torch.LongTensor(list(first.values())).to(ins_idx.device)
+    inv = torch.LongTensor([pos[ins] for ins in ins_list]).to(ins_idx.device)
+    return rows, inv
+
+def knn_points_kdtree(query, points, K=1):
+    # drop-in for knn_points(query, points, K) on CPU, building the kd-trees on the fly
+    # query: [b, m, 3], points: [b, n, 3]
+    if query.is_cuda:
+        return knn_points(query, points, K=K)
+    points_np = points.detach().cpu().numpy()
+    trees = [cKDTree(points_np[i]) for i in range(points_np.shape[0])]
+    return _query_trees(query, points, trees, list(range(len(trees))), K)
+
+
+class Ori_cloud_index(object):
+    """kd-trees over the original clouds, built once per attack and queried from the adversarial clouds."""
+    def __init__(self, pc_ori, trees=None, tree_idx=None, ins_idx=None):
+        # pc_ori: [b, 3, n], ins_idx: [b], the rows of an instance share one tree
+        self.pc_ori = pc_ori
+        if trees is None:
+            if pc_ori.is_cuda:
+                # brute force search is faster than a host round trip on gpu
+                trees = []
+                tree_idx = list(range(pc_ori.size(0)))
+            else:
+                if ins_idx is None:
+                    ins_idx = torch.arange(pc_ori.size(0))
+                rows, inv = instance_rows(ins_idx)
+                pc_np = pc_ori.detach().permute(0,2,1).cpu().numpy()
+                trees = [cKDTree(pc_np[i]) for i in rows.tolist()]
+                tree_idx = inv.tolist()
+        self.trees = trees
+        self.tree_idx = tree_idx
+
+    def subset(self, idx):
+        # index over the clouds pc_ori[idx], sharing the trees
+        idx_list = idx.tolist()
+        return Ori_cloud_index(self.pc_ori[idx], self.trees, [self.tree_idx[i] for i in idx_list])
+
+    def knn(self, query_pc, K=1):
+        # query_pc: [b, 3, m], [dists:[b,m,K], idx:[b,m,K]]
+        if query_pc.is_cuda or len(self.trees) == 0:
+            return knn_points(query_pc.permute(0,2,1), self.pc_ori.permute(0,2,1), K=K)
+        return _query_trees(query_pc.permute(0,2,1), self.pc_ori.permute(0,2,1), self.trees, self.tree_idx, K)
+
+
+class Ori_nn_tracker(object):
+    """Tracks the 1-NN of every adversarial point in the original cloud across the optimization steps.
+    At the last full search (the anchor) every original point but the 1-NN was at least the 2nd-NN distance
+    away, so after a drift every one of them is still at least that distance minus the drift away. The 1-NN
+    at the anchor and the end of a greedy walk over the kNN graph of the original cloud are the candidates;
+    the closer one is kept when it is within that bound, which makes it the exact 1-NN. The other points,
+    and those that drift farther than max_drift, get a full search again."""
+    def __init__(self, pc_ori, ori_index=None, graph_k=8, max_hops=4, max_drift=None, ins_idx=None):
+        # pc_ori: [b, 3, n], ins_idx: [b], the rows of an instance share one kNN graph
+        self.pc_ori = pc_ori
+        self.ori = pc_ori.detach().permute(0,2,1).contiguous() # [b, n, 3]
+        self.ori_index = ori_index
+        self.max_hops = max_hops
+
+        with torch.no_grad():
+            if ins_idx is None:
+                graph_KNN = self._search(self.ori, graph_k+1)
+            else:
+                rows, inv = instance_rows(ins_idx)
+                if ori_index is None:
+                    graph_KNN = knn_points(self.ori[rows], self.ori[rows], K=graph_k+1)
+                else:
+                    graph_KNN = ori_index.subset(rows).knn(self.ori[rows].permute(0,2,1), K=graph_k+1)
+                graph_KNN = KNN(dists=graph_KNN.dists[inv], idx=graph_KNN.idx[inv])
+        self.graph = graph_KNN.idx # [b, n, graph_k+1], each point is its own first neighbour
+        if max_drift is None:
+            # half of the mean spacing of the original points
+            max_drift = 0.5 * graph_KNN.dists[:, :, 1].sqrt().mean().item()
+        self.max_drift = max_drift
+
+        self.anchor = None # [b, m, 3], positions of the last full search
+        self.anchor_d2 = None # [b, m], distance to the 2nd-NN at the anchor
+        self.anchor_idx = None # [b, m], 1-NN at the anchor
+        self.idx = None # [b, m]
+
+    def _search(self, query, K):
+        # exact search, query: [b, m, 3]
+        if self.ori_index is None:
+            return knn_points(query, self.ori, K=K)
+        return self.ori_index.knn(query.permute(0,2,1), K=K)
+
+    def _reset(self, query, mask=None):
+        # full search for the points in mask (all the points if None), query: [b, m, 3]
+        if mask is None:
+            KNN_2 = self._search(query, 2)
+            self.anchor = query.clone()
+            self.anchor_d2 = KNN_2.dists[:, :, 1].sqrt()
+            self.anchor_idx = KNN_2.idx[:, :, 0].clone()
+            self.idx = self.anchor_idx.clone()
+            return
+
+        for i in torch.nonzero(mask.any(1)).view(-1).tolist():
+            pts = torch.nonzero(mask[i]).view(-1)
+            if self.ori_index is None:
+                KNN_2 = knn_points(query[i, pts].unsqueeze(0), self.ori[i].unsqueeze(0), K=2)
+            else:
+                KNN_2 = self.ori_index.subset(torch.LongTensor([i])).knn(query[i, pts].t().unsqueeze(0), K=2)
+            self.anchor[i, pts] = query[i, pts]
+            self.anchor_d2[i, pts] = KNN_2.dists[0, :, 1].sqrt()
+            self.anchor_idx[i, pts] = KNN_2.idx[0, :, 0]
+            self.idx[i, pts] = KNN_2.idx[0, :, 0]
+
+    def _walk(self, query, idx):
+        # greedy descent over the kNN graph of the original cloud, query: [b, m, 3], idx: [b, m]
+        b, m, _ = query.size()
+        K = self.graph.size(2)
+        for _ in range(self.max_hops):
+            nbr_idx = torch.gather(self.graph, 1, idx.unsqueeze(2).expand(b, m, K)) # [b, m, K]
+            nbr_dists = ((query.unsqueeze(2) - knn_gather(self.ori, nbr_idx))**2).sum(-1) # [b, m, K]
+            next_idx = torch.gather(nbr_idx, 2, nbr_dists.argmin(2, keepdim=True)).squeeze(2)
+            if (next_idx == idx).all():
+                break
+            idx = next_idx
+        return idx
+
+    def _dist(self, query, idx):
+        # query: [b, m, 3], idx: [b, m] -> [b, m]
+        return (query - knn_gather(self.ori, idx.unsqueeze(2)).squeeze(2)).norm(dim=2)
+
+    def query(self, adv_pc):
+        # adv_pc: [b, 3, m], the same points as in the previous call, slightly moved
+        # return [dists:[b,m,1], idx:[b,m,1]] like knn_points(adv, ori, K=1)
+        query = adv_pc.detach().permute(0,2,1).contiguous()
+        with torch.no_grad():
+            if self.anchor is None or self.anchor.size() != query.size():
+                self._reset(query)
+            else:
+                drift = (query - self.anchor).norm(dim=2) # [b, m]
+                anchor_dist = self._dist(query, self.anchor_idx)
+                # the points other than anchor_idx are at least anchor_d2 - drift away
+                bound = self.anchor_d2 - drift
+                is_certified = anchor_dist < bound
+                if is_certified.all():
+                    self.idx = self.anchor_idx.clone()
+                else:
+                    walked = self._walk(query, self.idx)
+                    walked_dist = self._dist(query, walked)
+                    is_walked = walked_dist < anchor_dist
+                    self.idx = torch.where(is_walked, walked, self.anchor_idx)
+                    is_certified = torch.where(is_walked, walked_dist, anchor_dist) < bound
+                is_reset = ~is_certified | (drift > self.max_drift)
+                if is_reset.any():
+                    self._reset(query, is_reset)
+
+        idx = self.idx.unsqueeze(2)
+        nn_pts = knn_gather(self.pc_ori.permute(0,2,1), idx)
+        dists = ((adv_pc.permute(0,2,1).unsqueeze(2) - nn_pts)**2).sum(-1) # [b, m, 1]
+        return KNN(dists=dists, idx=idx)
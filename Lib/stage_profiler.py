@@ -0,0 +1,133 @@
+from __future__ import absolute_import, division, print_function
+
+import collections
+import contextlib
+import json
+import time
+
+import torch
+
+
+class Stage_profiler(object):
+    """Wall time and number of calls of the named stages of the attack, and event counters
+    (kNN queries, model forwards and backwards), in total and per batch.
+    The modules share the instance 'profiler' below; when it is disabled, stage() returns a shared
+    no-op context and count() returns at once, so the hooks can stay in the hot loops.
+    With cuda, the device is synchronized around each stage so the kernels are charged to their stage."""
+    def __init__(self):
+        self.is_enabled = False
+        self.is_trace = False
+        self._null = contextlib.nullcontext()
+        self.reset()
+
+    def reset(self):
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self.batches = []
+        self._batch_start = None
+
+    def enable(self, is_trace=False):
+        self.is_enabled = True
+        self.is_trace = is_trace
+
+    def disable(self):
+        self.is_enabled = False
+        self.is_trace = False
+
+    def _sync(self):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        self._sync()
+        since = time.perf_counter()
+        if self.is_trace:
+            with torch.profiler.record_function(name):
+                yield
+        else:
+            yield
+        self._sync()
+        self.times[name] += time.perf_counter() - since
+        self.calls[name] += 1
+
+    def stage(self, name):
+        # with profiler.stage('backward'): ...
+        if not self.is_enabled:
+            return self._null
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _trace(self, fpath):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities) as prof:
+            yield
+        prof.export_chrome_trace(fpath)
+
+    def trace(self, fpath):
+        # Chrome trace (chrome://tracing) of the block into fpath, with the stages as named ranges
+        if not self.is_trace or fpath is None:
+            return self._null
+        return self._trace(fpath)
+
+    def count(self, name, num=1):
+        if self.is_enabled:
+            self.counters[name] += num
+
+    def add_time(self, name, seconds):
+        # a stage timed by the caller, e.g. the wait for the data loader
+        if self.is_enabled:
+            self.times[name] += seconds
+            self.calls[name] += 1
+
+    def begin_batch(self):
+        if self.is_enabled:
+            self._batch_start = (time.perf_counter(), dict(self.times), dict(self.calls), dict(self.counters))
+
+    def end_batch(self, batch_idx, num_ins=None):
+        if not self.is_enabled or self._batch_start is None:
+            return
+        since, times, calls, counters = self._batch_start
+        self.batches.append({
+            'batch_idx': batch_idx,
+            'num_ins': num_ins,
+            'time': time.perf_counter() - since,
+            'stages': {name: {'time': t - times.get(name, 0), 'calls': self.calls[name] - calls.get(name, 0)}
+                for name, t in self.times.items() if self.calls[name] > calls.get(name, 0)},
+            'counters': {name: c - counters.get(name, 0) for name, c in self.counters.items() if c > counters.get(name, 0)},
+        })
+        self._batch_start = None
+
+    def state_dict(self):
+        return {
+            'stages': {name: {'time': self.times[name], 'calls': self.calls[name]} for name in self.times},
+            'counters': dict(self.counters),
+            'batches': self.batches,
+        }
+
+    def load_state_dict(self, state):
+        # adds a summary (e.g. of a campaign worker) to this one
+        for name, stage in state['stages'].items():
+            self.times[name] += stage['time']
+            self.calls[name] += stage['calls']
+        for name, c in state['counters'].items():
+            self.counters[name] += c
+        self.batches = sorted(self.batches + state['batches'], key=lambda batch: batch['batch_idx'])
+
+    def save(self, fpath):
+        with open(fpath, 'w') as f:
+            json.dump(self.state_dict(), f, indent=2)
+
+    def print_summary(self):
+        total = sum(batch['time'] for batch in self.batches)
+        print('==>Profile of {} batches, {:.2f}s'.format(len(self.batches), total))
+        for name in sorted(self.times, key=lambda name: -self.times[name]):
+            print('{0:<20s} {1:10.3f}s {2:10d} calls'.format(name, self.times[name], self.calls[name]))
+        for name in sorted(self.counters):
+            print('{0:<20s} {1:10d}'.format(name, self.counters[name]))
+
+
+profiler = Stage_profiler()
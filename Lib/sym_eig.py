@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, print_function
+
+import torch
+
+# the (p, q) planes of one cyclic Jacobi sweep
+_jacobi_pairs = [(0, 1), (0, 2), (1, 2)]
+
+def _key(p, q):
+    return (p, q) if p <= q else (q, p)
+
+def sym_eig3(mat, num_sweeps=4):
+    # batched eigen-decomposition of symmetric 3x3 matrices by cyclic Jacobi rotations
+    # mat: [..., 3, 3] -> eigenvalue: [..., 3] in ascending order, eigenvector: [..., 3, 3] with eigenvector[..., :, i] for eigenvalue[..., i]
+    # the entries are kept as [m] tensors, so a rotation is a few elementwise ops over the whole batch;
+    # a 3x3 Jacobi sweep converges quadratically, a few sweeps reach the float precision
+    shape = mat.shape[:-2]
+    mat = mat.reshape(-1, 3, 3)
+    zeros = torch.zeros_like(mat[:, 0, 0])
+    ones = torch.ones_like(zeros)
+
+    a = {(p, q): mat[:, p, q].clone() for p in range(3) for q in range(p, 3)} # the upper triangle
+    v = [[ones if r == c else zeros for c in range(3)] for r in range(3)]
+
+    for _ in range(num_sweeps):
+        for p, q in _jacobi_pairs:
+            r = 3 - p - q
+            apq = a[(p, q)]
+            # the rotation in the (p, q) plane that zeroes a[p, q] (Numerical Recipes, jacobi)
+            theta = (a[(q, q)] - a[(p, p)]) / (2 * apq)
+            t = torch.where(theta >= 0, ones, -ones) / (theta.abs() + torch.sqrt(theta * theta + 1))
+            t = torch.where(apq == 0, zeros, t)
+            c = 1 / torch.sqrt(t * t + 1)
+            s = t * c
+
+            a[(p, p)] = a[(p, p)] - t * apq
+            a[(q, q)] = a[(q, q)] + t * apq
+            a[(p, q)] = zeros
+            arp, arq = a[_key(r, p)], a[_key(r, q)]
+            a[_key(r, p)] = c * arp - s * arq
+            a[_key(r, q)] = s * arp + c * arq
+            for i in range(3):
+                vip, viq = v[i][p], v[i][q]
+                v[i][p] = c * vip - s * viq
+                v[i][q] = s * vip + c * viq
+
+    eigenvalue = torch.stack([a[(0, 0)], a[(1, 1)], a[(2, 2)]], 1) # [m, 3]
+    eigenvector = torch.stack([torch.stack(row, 1) for row in v], 1) # [m, 3, 3]
+    eigenvalue, order = torch.sort(eigenvalue, dim=1)
+    eigenvector = torch.gather(eigenvector, 2, order.unsqueeze(1).expand(-1, 3, 3))
+
+    return eigenvalue.view(shape + (3,)), eigenvector.view(shape + (3, 3))
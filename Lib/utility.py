@@ -1,25 +1,26 @@
+import atexit
 import copy
 import math
 import os
+import pickle
+import queue
 import re
 import shutil
 import sys
+import threading
 import time
 
 import numpy as np
 import scipy.io as sio
-from pytorch3d.ops import knn_points, knn_gather
 import torch
 from torch.autograd import Variable
-import torchvision
-import torchvision.transforms as transforms
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn
-seaborn.set()
-seaborn.set(rc={'figure.figsize':(11.7000,8.27000)})
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+from fps import farthest_points_index, farthest_points_index_numpy
+from knn import knn_points, knn_gather
+from sym_eig import sym_eig3
+
 linewidth = 4.0
 fontsize = 15.0 + 11.0
 markersize = 10.0
@@ -27,6 +28,21 @@ fixpoint_markersize = 15.0
 bins=20
 color_list = ['r','b','g']
 
+# matplotlib and seaborn are only imported (and seaborn styled) by the first plot
+_plotting = None
+
+def _get_plotting():
+    global _plotting
+    if _plotting is None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn
+        seaborn.set()
+        seaborn.set(rc={'figure.figsize':(11.7000,8.27000)})
+        _plotting = (plt, seaborn)
+    return _plotting
+
 def _normalize(input, p=2, dim=1, eps=1e-12):
     return input / input.norm(p, dim, keepdim=True).clamp(min=eps).expand_as(input)
 
@@ -34,7 +50,7 @@ def jitter_input(data, sigma=0.01, clip=0.05):
     assert data.size(1) == 3
     assert(clip > 0)
     B, _, N = data.size()
-    jittered_data = torch.clamp(sigma * torch.randn(B, 3, N), -1*clip, clip).cuda()
+    jittered_data = torch.clamp(sigma * torch.randn(B, 3, N), -1*clip, clip).to(data)
     return jittered_data
 
 def estimate_normal(pc, k):
@@ -45,53 +61,29 @@ def estimate_normal(pc, k):
         inter_KNN = knn_points(pc.permute(0,2,1), pc.permute(0,2,1), K=k+1) #[dists:[b,n,k+1], idx:[b,n,k+1]]
         nn_pts = knn_gather(pc.permute(0,2,1), inter_KNN.idx).permute(0,3,1,2)[:,:,:,1:].contiguous() # [b, 3, n ,k]
 
-        # get covariance matrix and smallest eig-vector of individual point
-        normal_vector = []
-        for i in range(b):
-            if int(torch.__version__.split('.')[1])>=4:
-                curr_point_set = nn_pts[i].detach().permute(1,0,2) #curr_point_set:[n, 3, k]
-                curr_point_set_mean = torch.mean(curr_point_set, dim=2, keepdim=True) #curr_point_set_mean:[n, 3, 1]
-                curr_point_set = curr_point_set - curr_point_set_mean #curr_point_set:[n, 3, k]
-                curr_point_set_t = curr_point_set.permute(0,2,1) #curr_point_set_t:[n, k, 3]
-                fact = 1.0 / (k-1)
-                cov_mat = fact * torch.bmm(curr_point_set, curr_point_set_t) #curr_point_set_t:[n, 3, 3]
-                eigenvalue, eigenvector=torch.symeig(cov_mat, eigenvectors=True)    # eigenvalue:[n, 3], eigenvector:[n, 3, 3]
-                persample_normal_vector = torch.gather(eigenvector, 2, torch.argmin(eigenvalue, dim=1).unsqueeze(1).unsqueeze(2).expand(n, 3, 1)).squeeze() #persample_normal_vector:[n, 3]
-
-                #recorrect the direction via neighbour direction
-                nbr_sum = curr_point_set.sum(dim=2)  #curr_point_set:[n, 3]
-                sign = -torch.sign(torch.bmm(persample_normal_vector.view(n, 1, 3), nbr_sum.view(n, 3, 1))).squeeze(2)
-                persample_normal_vector = sign * persample_normal_vector
-
-                normal_vector.append(persample_normal_vector.permute(1,0))
-
-            else:
-                persample_normal_vector = []
-                for j in range(n):
-                    curr_point_set = nn_pts[i,:,j,:].cpu()
-                    curr_point_set_np = curr_point_set.detach().numpy()#curr_point_set_np:[3,k]
-                    cov_mat_np = np.cov(curr_point_set_np)   #cov_mat:[3,3]
-                    eigenvalue_np, eigenvector_np=np.linalg.eig(cov_mat_np)   #eigenvalue:[3], eigenvector:[3,3]; note that v[:,i] is the eigenvector corresponding to the eigenvalue w[i].
-                    curr_normal_vector_np = torch.from_numpy(eigenvector_np[:,np.argmin(eigenvalue_np)]) #curr_normal_vector:[3]
-                    persample_normal_vector.append(curr_normal_vector_np)
-                persample_normal_vector = torch.stack(persample_normal_vector, 1)
-
-                #recorrect the direction via neighbour direction
-                nbr_sum = curr_point_set.sum(dim=1)  #curr_point_set:[3]
-                sign = -torch.sign(torch.bmm(persample_normal_vector.view(1, 3), nbr_sum.view(3, 1))).squeeze(1)
-                persample_normal_vector = sign * persample_normal_vector
-
-                normal_vector.append(persample_normal_vector.permute(1,0))
-
-                normal_vector.append(persample_normal_vector)
-
-        normal_vector = torch.stack(normal_vector, 0) #normal_vector:[b, 3, n]
-    return normal_vector.float()
-
-def estimate_normal_via_ori_normal(pc_adv, pc_ori, normal_ori, k):
+        # get covariance matrix and smallest eig-vector of every point, for the whole batch at once
+        curr_point_set = nn_pts.detach().permute(0,2,1,3) #curr_point_set:[b, n, 3, k]
+        curr_point_set_mean = torch.mean(curr_point_set, dim=3, keepdim=True) #curr_point_set_mean:[b, n, 3, 1]
+        curr_point_set = curr_point_set - curr_point_set_mean #curr_point_set:[b, n, 3, k]
+        fact = 1.0 / (k-1)
+        cov_mat = fact * torch.matmul(curr_point_set, curr_point_set.transpose(2,3)) #cov_mat:[b, n, 3, 3]
+        eigenvalue, eigenvector = sym_eig3(cov_mat)    # eigenvalue:[b, n, 3] in ascending order, eigenvector:[b, n, 3, 3]
+        normal_vector = eigenvector[:, :, :, 0] #normal_vector:[b, n, 3]
+
+        #recorrect the direction via neighbour direction
+        nbr_sum = curr_point_set.sum(dim=3)  #nbr_sum:[b, n, 3]
+        sign = -torch.sign((normal_vector * nbr_sum).sum(2, keepdim=True))
+        normal_vector = (sign * normal_vector).permute(0,2,1) #normal_vector:[b, 3, n]
+    return normal_vector.to(pc.dtype)
+
+def estimate_normal_via_ori_normal(pc_adv, pc_ori, normal_ori, k, ori_index=None):
     # pc_adv, pc_ori, normal_ori : [b,3,n]
+    # ori_index: optional Ori_cloud_index over pc_ori
     b,_,n=pc_adv.size()
-    intra_KNN = knn_points(pc_adv.permute(0,2,1), pc_ori.permute(0,2,1), K=k) #[dists:[b,n,k], idx:[b,n,k]]
+    if ori_index is None:
+        intra_KNN = knn_points(pc_adv.permute(0,2,1), pc_ori.permute(0,2,1), K=k) #[dists:[b,n,k], idx:[b,n,k]]
+    else:
+        intra_KNN = ori_index.knn(pc_adv, K=k)
     inter_value = intra_KNN.dists[:, :, 0].contiguous()
     inter_idx = intra_KNN.idx.permute(0,2,1).contiguous()
     normal_pts = knn_gather(normal_ori.permute(0,2,1), intra_KNN.idx).permute(0,3,1,2).contiguous() # [b, 3, n ,k]
@@ -109,8 +101,8 @@ def estimate_normal_via_ori_normal(pc_adv, pc_ori, normal_ori, k):
 
 def get_perpendicular_jitter(vector, sigma=0.01, clip=0.05):
     b,_,n=vector.size()
-    aux_vector1 = sigma * torch.randn(b,3,n).cuda()
-    aux_vector2 = sigma * torch.randn(b,3,n).cuda()
+    aux_vector1 = sigma * torch.randn(b,3,n).to(vector)
+    aux_vector2 = sigma * torch.randn(b,3,n).to(vector)
     return torch.clamp(torch.cross(vector, aux_vector1), -1*clip, clip) + torch.clamp(torch.cross(vector, aux_vector2), -1*clip, clip)
 
 def estimate_perpendicular(pc, k, sigma=0.01, clip=0.05):
@@ -120,31 +112,19 @@ def estimate_perpendicular(pc, k, sigma=0.01, clip=0.05):
         inter_KNN = knn_points(pc.permute(0,2,1), pc.permute(0,2,1), K=k+1) #[dists:[b,n,k+1], idx:[b,n,k+1]]
         nn_pts = knn_gather(pc.permute(0,2,1), inter_KNN.idx).permute(0,3,1,2)[:,:,:,1:].contiguous() # [b, 3, n ,k]
 
-        # get covariance matrix and smallest eig-vector of individual point
-        perpendi_vector_1 = []
-        perpendi_vector_2 = []
-        for i in range(b):
-            curr_point_set = nn_pts[i].detach().permute(1,0,2) #curr_point_set:[n, 3, k]
-            curr_point_set_mean = torch.mean(curr_point_set, dim=2, keepdim=True) #curr_point_set_mean:[n, 3, 1]
-            curr_point_set = curr_point_set - curr_point_set_mean #curr_point_set:[n, 3, k]
-            curr_point_set_t = curr_point_set.permute(0,2,1) #curr_point_set_t:[n, k, 3]
-            fact = 1.0 / (k-1)
-            cov_mat = fact * torch.bmm(curr_point_set, curr_point_set_t) #curr_point_set_t:[n, 3, 3]
-            eigenvalue, eigenvector=torch.symeig(cov_mat, eigenvectors=True)    # eigenvalue:[n, 3], eigenvector:[n, 3, 3]
-
-            larger_dim_idx = torch.topk(eigenvalue, 2, dim=1, largest=True, sorted=False, out=None)[1] # eigenvalue:[n, 2]
-
-            persample_perpendi_vector_1 = torch.gather(eigenvector, 2, larger_dim_idx[:,0].unsqueeze(1).unsqueeze(2).expand(n, 3, 1)).squeeze() #persample_perpendi_vector_1:[n, 3]
-            persample_perpendi_vector_2 = torch.gather(eigenvector, 2, larger_dim_idx[:,1].unsqueeze(1).unsqueeze(2).expand(n, 3, 1)).squeeze() #persample_perpendi_vector_2:[n, 3]
-
-            perpendi_vector_1.append(persample_perpendi_vector_1.permute(1,0))
-            perpendi_vector_2.append(persample_perpendi_vector_2.permute(1,0))
+        # get covariance matrix and the two largest eig-vectors of every point, for the whole batch at once
+        curr_point_set = nn_pts.detach().permute(0,2,1,3) #curr_point_set:[b, n, 3, k]
+        curr_point_set_mean = torch.mean(curr_point_set, dim=3, keepdim=True) #curr_point_set_mean:[b, n, 3, 1]
+        curr_point_set = curr_point_set - curr_point_set_mean #curr_point_set:[b, n, 3, k]
+        fact = 1.0 / (k-1)
+        cov_mat = fact * torch.matmul(curr_point_set, curr_point_set.transpose(2,3)) #cov_mat:[b, n, 3, 3]
+        eigenvalue, eigenvector = sym_eig3(cov_mat)    # eigenvalue:[b, n, 3] in ascending order, eigenvector:[b, n, 3, 3]
 
-        perpendi_vector_1 = torch.stack(perpendi_vector_1, 0) #perpendi_vector_1:[b, 3, n]
-        perpendi_vector_2 = torch.stack(perpendi_vector_2, 0) #perpendi_vector_1:[b, 3, n]
+        perpendi_vector_1 = eigenvector[:, :, :, 2].permute(0,2,1) #perpendi_vector_1:[b, 3, n]
+        perpendi_vector_2 = eigenvector[:, :, :, 1].permute(0,2,1) #perpendi_vector_2:[b, 3, n]
 
-        aux_vector1 = sigma * torch.randn(b,n).unsqueeze(1).cuda() #aux_vector1:[b, 1, n]
-        aux_vector2 = sigma * torch.randn(b,n).unsqueeze(1).cuda() #aux_vector2:[b, 1, n]
+        aux_vector1 = sigma * torch.randn(b,n).unsqueeze(1).to(pc) #aux_vector1:[b, 1, n]
+        aux_vector2 = sigma * torch.randn(b,n).unsqueeze(1).to(pc) #aux_vector2:[b, 1, n]
 
     return torch.clamp(perpendi_vector_1*aux_vector1, -1*clip, clip) + torch.clamp(perpendi_vector_2*aux_vector2, -1*clip, clip)
 
@@ -155,13 +135,7 @@ def _compare(output, target, gt, targeted):
         return output != gt
 
 def farthest_points_normalized_single_numpy(obj_points, num_points):
-    first = np.random.randint(len(obj_points))
-    selected = [first]
-    dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-    for _ in range(num_points - 1):
-        dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-        selected.append(np.argmax(dists))
+    selected = farthest_points_index_numpy(obj_points, num_points)
     res_points = np.array(obj_points[selected])
 
     # normalize the points
@@ -176,12 +150,7 @@ def farthest_points_sample(obj_points, num_points):
     assert obj_points.size(1) == 3
     b,_,n = obj_points.size()
 
-    selected = torch.randint(obj_points.size(2), [obj_points.size(0),1]).cuda()
-    dists = torch.full([obj_points.size(0), obj_points.size(2)], fill_value = np.inf).cuda()
-
-    for _ in range(num_points - 1):
-        dists = torch.min(dists, torch.norm(obj_points - torch.gather(obj_points, 2, selected[:,-1].unsqueeze(1).unsqueeze(2).expand(b,3,1)), dim = 1))
-        selected = torch.cat([selected, torch.argmax(dists, dim=1, keepdim=True)], dim = 1)
+    selected = farthest_points_index(obj_points, num_points).to(obj_points.device)
     res_points = torch.gather(obj_points, 2, selected.unsqueeze(1).expand(b, 3, num_points))
 
     return res_points
@@ -191,12 +160,7 @@ def farthest_points_normal_sample(obj_points, obj_normal, num_points):
     assert obj_points.size(2) == obj_normal.size(2)
     b,_,n = obj_points.size()
 
-    selected = torch.randint(obj_points.size(2), [obj_points.size(0),1]).cuda()
-    dists = torch.full([obj_points.size(0), obj_points.size(2)], fill_value = np.inf).cuda()
-
-    for _ in range(num_points - 1):
-        dists = torch.min(dists, torch.norm(obj_points - torch.gather(obj_points, 2, selected[:,-1].unsqueeze(1).unsqueeze(2).expand(b,3,1)), dim = 1))
-        selected = torch.cat([selected, torch.argmax(dists, dim=1, keepdim=True)], dim = 1)
+    selected = farthest_points_index(obj_points, num_points).to(obj_points.device)
     res_points = torch.gather(obj_points, 2, selected.unsqueeze(1).expand(b, 3, num_points))
     res_normal = torch.gather(obj_normal, 2, selected.unsqueeze(1).expand(b, 3, num_points))
 
@@ -204,17 +168,23 @@ def farthest_points_normal_sample(obj_points, obj_normal, num_points):
 
 
 def pad_larger_tensor_with_index(small_verts, small_in_larger_idx_list, larger_tensor_shape):
-    full_deform_verts = torch.zeros(larger_tensor_shape,3).cuda()
+    full_deform_verts = torch.zeros(larger_tensor_shape, 3, dtype=small_verts.dtype, device=small_verts.device)
     full_deform_verts[small_in_larger_idx_list] = small_verts
     return full_deform_verts
 
 def pad_larger_tensor_with_index_batch(small_verts, small_in_larger_idx_list, larger_tensor_shape):
     b, _, n = small_verts.size()
-    full_deform_verts = torch.zeros(b, 3, larger_tensor_shape).cuda()
+    full_deform_verts = torch.zeros(b, 3, larger_tensor_shape, dtype=small_verts.dtype, device=small_verts.device)
     for i in range(b):
         full_deform_verts[i, :, small_in_larger_idx_list[i][0][1:]] = small_verts[i]
     return full_deform_verts
 
+def add_with_index_batch(larger_verts, small_verts, small_in_larger_idx):
+    # larger_verts: [b, 3, n], small_verts: [b, 3, k], small_in_larger_idx: [b, k] distinct indices per row
+    # same as larger_verts + pad_larger_tensor_with_index_batch(small_verts, ...), without the dense padded tensor
+    b, _, k = small_verts.size()
+    return larger_verts.scatter_add(2, small_in_larger_idx.unsqueeze(1).expand(b, 3, k), small_verts)
+
 def read_lines_from_xyz(path, num_points):
     with open(path) as file:
         vertices = []
@@ -264,6 +234,13 @@ def write_obj(file, vertices, faces):
         # add empty line to be sure
         fp.write('\n')
 
+def write_pc_obj(file, points):
+    # points: [n, 3], written as 'v x y z 0 0 0' lines
+    points = np.asarray(points, dtype=np.float64)
+    with open(file, 'w') as fp:
+        # a single formatting call for the whole cloud
+        fp.write(('v %f %f %f 0 0 0\n' * points.shape[0]) % tuple(points.ravel()))
+
 def read_obj(file):
     """
     Reads vertices and faces from an obj file.
@@ -463,14 +440,16 @@ def pc_normalize_torch(point):
         normed_point = normed_point / scale[np.newaxis, np.newaxis]
     return normed_point
 
-_, term_width = os.popen('stty size', 'r').read().split()
-term_width = int(term_width)
+# the terminal width is read by the first progress bar, 80 columns without a terminal
+term_width = None
 TOTAL_BAR_LENGTH = 30.
 last_time = time.time()
 begin_time = last_time
 
 def progress_bar(current, total, msg=None):
-    global last_time, begin_time
+    global last_time, begin_time, term_width
+    if term_width is None:
+        term_width = shutil.get_terminal_size(fallback=(80, 24)).columns
     step_time = Average_meter()
     if current == 0:
         begin_time = time.time()  # Reset for new bar.
@@ -651,6 +630,82 @@ class Training_aux(object):
         file.close()
         return
 
+def get_rng_state():
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    if ('cuda' in state) and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def save_checkpoint(state, fpath):
+    # the previous checkpoint is only replaced once the new one is completely written
+    with open(fpath + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fpath + '.tmp', fpath)
+
+def load_checkpoint(fpath):
+    with open(fpath, 'rb') as f:
+        return pickle.load(f)
+
+
+class Async_writer(object):
+    """Runs file writing jobs in background threads. The jobs wait in a bounded queue, so that
+    submit() blocks when the writers fall behind. The first error of a job is raised by the next
+    submit(), flush() or close()."""
+    def __init__(self, num_threads=1, max_queue=64):
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.errors = []
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for t in self.threads:
+            t.start()
+        self.closed = False
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            fn, args, kwargs = job
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.errors.append(e)
+            self.jobs.task_done()
+
+    def _raise_errors(self):
+        if len(self.errors) > 0:
+            error = self.errors[0]
+            self.errors = []
+            raise RuntimeError('Background writing failed: {}'.format(repr(error))) from error
+
+    def submit(self, fn, *args, **kwargs):
+        # the arguments must not be modified afterwards, pass copies of the results
+        self._raise_errors()
+        self.jobs.put((fn, args, kwargs))
+
+    def flush(self):
+        # wait until all the submitted jobs are written
+        self.jobs.join()
+        self._raise_errors()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        self._raise_errors()
+
+
 class Count_converge_iter(object):
     def __init__(self, fsave):
         self.fsave = fsave
@@ -663,11 +718,18 @@ class Count_converge_iter(object):
             attack_step_list.remove(-1)
         self.attack_step_list += attack_step_list
 
+    def state_dict(self):
+        return {'attack_step_list': list(self.attack_step_list)}
+
+    def load_state_dict(self, state):
+        self.attack_step_list = list(state['attack_step_list'])
+
     def save_converge_iter(self):
         fpath = os.path.join(self.fsave, 'converge_iter.mat')
         sio.savemat(fpath, {"attack_step_list": self.attack_step_list})
 
     def plot_converge_iter_hist(self):
+        plt, seaborn = _get_plotting()
         fpath = os.path.join(self.fsave, 'converge_iter.png')
         used_bins=np.histogram(np.hstack((self.attack_step_list)), bins=bins)[1]
         fig = plt.figure()
@@ -690,11 +752,19 @@ class Count_loss_iter(object):
         except:
             self.loss_numpy = np.array(loss_list)
 
+    def state_dict(self):
+        return {'loss_numpy': getattr(self, 'loss_numpy', None)}
+
+    def load_state_dict(self, state):
+        if state['loss_numpy'] is not None:
+            self.loss_numpy = state['loss_numpy']
+
     def save_loss_iter(self):
         fpath = os.path.join(self.fsave, 'loss_iter.mat')
         sio.savemat(fpath, {"loss": self.loss_numpy})
 
     def plot_loss_iter_hist(self):
+        plt, _ = _get_plotting()
         fpath = os.path.join(self.fsave, 'loss_iter.png')
         num_iter, num_sample = self.loss_numpy.shape
 
@@ -2,6 +2,7 @@ from __future__ import absolute_import, division, print_function
 
 import argparse
 import os
+import sys
 
 import numpy as np
 import scipy.io as sio
@@ -13,6 +14,8 @@ parser.add_argument('--k', type=int, default=16, help='')
 parser.add_argument('--k2', type=int, default=16, help='')
 parser.add_argument('--print_freq', default=50, type=int, help='')
 parser.add_argument('--is_not_mat', action='store_true', default=False, help='')
+parser.add_argument('--geo_cache_dir', default=None, type=str, help='cache of the estimated normals kept across runs')
+parser.add_argument('--is_store', action='store_true', default=False, help='read the adversarial examples from the Store dir of datadir')
 cfg  = parser.parse_args()
 print(cfg)
 
@@ -27,7 +30,34 @@ def read_off_lines_from_xyz(path, num_points):
 
     return vertices
 
-if cfg.is_not_mat:
+def estimate_eig_normal(pc, dis, k2):
+    # pc: [n, 3], dis: [n, n]
+    n = pc.size(0)
+
+    idx = dis.topk(k2+1,  dim=-1, largest=False, sorted=True)[1][:, 1:].contiguous()
+    pts = torch.gather(pc, 0, idx.view(n*k2, 1).expand(n*k2, 3)).view(n, k2, 3)
+    pts = pts - pc.unsqueeze(1)
+
+    # covariance of the neighbours of every point (as np.cov), and its smallest eig-vector
+    pts = pts - pts.mean(1, keepdim=True)
+    C = torch.bmm(pts.transpose(1, 2), pts) / (k2 - 1) # [n, 3, 3]
+    normal = sym_eig3(C)[1][:, :, 0].float()
+
+    return normal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Lib'))
+from sym_eig import sym_eig3
+if cfg.geo_cache_dir is not None:
+    from geo_cache import Geometry_cache
+    geo_cache = Geometry_cache(cfg.geo_cache_dir)
+else:
+    geo_cache = None
+
+if cfg.is_store:
+    from result_store import Result_store
+    store = Result_store(os.path.join(cfg.datadir, 'Store'))
+    filenames = list(range(len(store)))
+elif cfg.is_not_mat:
     filenames = os.listdir(os.path.join(cfg.datadir))
 else:
     filenames = os.listdir(os.path.join(cfg.datadir, 'Mat'))
@@ -35,28 +65,23 @@ k = cfg.k
 
 smoothness = []
 for i, filename in enumerate(filenames):
-    if cfg.is_not_mat:
+    if cfg.is_store:
+        pc = torch.FloatTensor(store[filename]['points'])
+        pc = pc.t()
+    elif cfg.is_not_mat:
         pc = read_off_lines_from_xyz(os.path.join(cfg.datadir, filename), -1)
         pc = torch.FloatTensor(pc[:])
     else:
         pc = torch.FloatTensor(sio.loadmat(os.path.join(cfg.datadir, 'Mat', filename))['adversary_point_clouds'])
         pc = pc.t()
 
-    normal = torch.FloatTensor(pc.size())
     n = pc.size(0)
 
     dis = ((pc.unsqueeze(1) - pc.unsqueeze(0))**2).sum(2) # n*n
-    idx = dis.topk(cfg.k2+1,  dim=-1, largest=False, sorted=True)[1][:, 1:].contiguous()
-    pts = torch.gather(pc, 0, idx.view(n*cfg.k2, 1).expand(n*cfg.k2, 3)).view(n, cfg.k2, 3)
-    pts = pts - pc.unsqueeze(1)
-    pts_ = pts.permute(2, 0, 1).numpy()
-
-    for j in range(n):
-        pts_single = pts_[:, j, :]
-        C = np.cov(pts_single)
-        v, t = np.linalg.eig(C)
-        t = t[:, np.argsort(v)][:, 0]
-        normal[j] = torch.FloatTensor(t).view(3)
+    if geo_cache is not None:
+        normal = torch.FloatTensor(np.array(geo_cache.get('eig_normal', [pc.numpy()], {'k': cfg.k2}, lambda: estimate_eig_normal(pc, dis, cfg.k2).numpy())))
+    else:
+        normal = estimate_eig_normal(pc, dis, cfg.k2)
 
     idx = dis.topk(k+1,  dim=-1, largest=False, sorted=True)[1][:, 1:].contiguous()
     pts = torch.gather(pc, 0, idx.view(n*k, 1).expand(n*k, 3)).view(n, k, 3)
@@ -7,7 +7,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-import torchvision.models as models
 
 def _get_indices_knn_T(points, k):
 	r_a = torch.sum(points * points, dim=1, keepdim=True)
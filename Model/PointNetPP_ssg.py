@@ -4,7 +4,6 @@ import torch.nn.functional as F
 import torch.optim.lr_scheduler as lr_sched
 from pointnet2_ops.pointnet2_modules import PointnetFPModule, PointnetSAModule
 from torch.utils.data import DataLoader, DistributedSampler
-from torchvision import transforms
 
 
 def set_bn_momentum_default(bn_momentum):
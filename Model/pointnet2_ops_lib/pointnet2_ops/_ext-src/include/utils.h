@@ -1,5 +1,7 @@
 #pragma once
+#ifdef WITH_CUDA
 #include <ATen/cuda/CUDAContext.h>
+#endif
 #include <torch/extension.h>
 
 #define CHECK_CUDA(x)                                    \
@@ -5,6 +5,9 @@ void query_ball_point_kernel_wrapper(int b, int n, int m, float radius,
                                      int nsample, const float *new_xyz,
                                      const float *xyz, int *idx);
 
+void query_ball_point_cpu(int b, int n, int m, float radius, int nsample,
+                          const float *new_xyz, const float *xyz, int *idx);
+
 at::Tensor ball_query(at::Tensor new_xyz, at::Tensor xyz, const float radius,
                       const int nsample) {
   CHECK_CONTIGUOUS(new_xyz);
@@ -21,11 +24,17 @@ at::Tensor ball_query(at::Tensor new_xyz, at::Tensor xyz, const float radius,
                    at::device(new_xyz.device()).dtype(at::ScalarType::Int));
 
   if (new_xyz.is_cuda()) {
+#ifdef WITH_CUDA
     query_ball_point_kernel_wrapper(xyz.size(0), xyz.size(1), new_xyz.size(1),
                                     radius, nsample, new_xyz.data_ptr<float>(),
                                     xyz.data_ptr<float>(), idx.data_ptr<int>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    query_ball_point_cpu(xyz.size(0), xyz.size(1), new_xyz.size(1), radius,
+                         nsample, new_xyz.data_ptr<float>(),
+                         xyz.data_ptr<float>(), idx.data_ptr<int>());
   }
 
   return idx;
@@ -0,0 +1,37 @@
+#include <ATen/Parallel.h>
+
+// input: new_xyz(b, m, 3) xyz(b, n, 3)
+// output: idx(b, m, nsample)
+// same neighbours as the cuda kernel: the first nsample points of xyz within
+// radius, the remaining slots filled with the first of them
+void query_ball_point_cpu(int b, int n, int m, float radius, int nsample,
+                          const float *new_xyz, const float *xyz, int *idx) {
+  float radius2 = radius * radius;
+  at::parallel_for(0, (int64_t)b * m, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / m;
+      const float *cur_xyz = xyz + batch_index * n * 3;
+      int *cur_idx = idx + i * nsample;
+
+      float new_x = new_xyz[i * 3 + 0];
+      float new_y = new_xyz[i * 3 + 1];
+      float new_z = new_xyz[i * 3 + 2];
+      for (int k = 0, cnt = 0; k < n && cnt < nsample; ++k) {
+        float x = cur_xyz[k * 3 + 0];
+        float y = cur_xyz[k * 3 + 1];
+        float z = cur_xyz[k * 3 + 2];
+        float d2 = (new_x - x) * (new_x - x) + (new_y - y) * (new_y - y) +
+                   (new_z - z) * (new_z - z);
+        if (d2 < radius2) {
+          if (cnt == 0) {
+            for (int l = 0; l < nsample; ++l) {
+              cur_idx[l] = k;
+            }
+          }
+          cur_idx[cnt] = k;
+          ++cnt;
+        }
+      }
+    }
+  });
+}
@@ -9,6 +9,13 @@ void group_points_grad_kernel_wrapper(int b, int c, int n, int npoints,
                                       int nsample, const float *grad_out,
                                       const int *idx, float *grad_points);
 
+void group_points_cpu(int b, int c, int n, int npoints, int nsample,
+                      const float *points, const int *idx, float *out);
+
+void group_points_grad_cpu(int b, int c, int n, int npoints, int nsample,
+                           const float *grad_out, const int *idx,
+                           float *grad_points);
+
 at::Tensor group_points(at::Tensor points, at::Tensor idx) {
   CHECK_CONTIGUOUS(points);
   CHECK_CONTIGUOUS(idx);
@@ -24,12 +31,18 @@ at::Tensor group_points(at::Tensor points, at::Tensor idx) {
                    at::device(points.device()).dtype(at::ScalarType::Float));
 
   if (points.is_cuda()) {
+#ifdef WITH_CUDA
     group_points_kernel_wrapper(points.size(0), points.size(1), points.size(2),
                                 idx.size(1), idx.size(2),
                                 points.data_ptr<float>(), idx.data_ptr<int>(),
                                 output.data_ptr<float>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    group_points_cpu(points.size(0), points.size(1), points.size(2),
+                     idx.size(1), idx.size(2), points.data_ptr<float>(),
+                     idx.data_ptr<int>(), output.data_ptr<float>());
   }
 
   return output;
@@ -50,12 +63,18 @@ at::Tensor group_points_grad(at::Tensor grad_out, at::Tensor idx, const int n) {
                    at::device(grad_out.device()).dtype(at::ScalarType::Float));
 
   if (grad_out.is_cuda()) {
+#ifdef WITH_CUDA
     group_points_grad_kernel_wrapper(
         grad_out.size(0), grad_out.size(1), n, idx.size(1), idx.size(2),
         grad_out.data_ptr<float>(), idx.data_ptr<int>(),
         output.data_ptr<float>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    group_points_grad_cpu(grad_out.size(0), grad_out.size(1), n, idx.size(1),
+                          idx.size(2), grad_out.data_ptr<float>(),
+                          idx.data_ptr<int>(), output.data_ptr<float>());
   }
 
   return output;
@@ -0,0 +1,37 @@
+#include <ATen/Parallel.h>
+
+// input: points(b, c, n) idx(b, npoints, nsample)
+// output: out(b, c, npoints, nsample)
+void group_points_cpu(int b, int c, int n, int npoints, int nsample,
+                      const float *points, const int *idx, float *out) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_points = points + i * n;
+      const int *cur_idx = idx + batch_index * npoints * nsample;
+      float *cur_out = out + i * npoints * nsample;
+      for (int j = 0; j < npoints * nsample; ++j) {
+        cur_out[j] = cur_points[cur_idx[j]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, npoints, nsample), idx(b, npoints, nsample)
+// output: grad_points(b, c, n)
+// one channel of a cloud per task, so the scatter-add needs no atomics
+void group_points_grad_cpu(int b, int c, int n, int npoints, int nsample,
+                           const float *grad_out, const int *idx,
+                           float *grad_points) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_grad_out = grad_out + i * npoints * nsample;
+      const int *cur_idx = idx + batch_index * npoints * nsample;
+      float *cur_grad_points = grad_points + i * n;
+      for (int j = 0; j < npoints * nsample; ++j) {
+        cur_grad_points[cur_idx[j]] += cur_grad_out[j];
+      }
+    }
+  });
+}
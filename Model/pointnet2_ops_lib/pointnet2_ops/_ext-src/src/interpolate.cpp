@@ -11,6 +11,14 @@ void three_interpolate_grad_kernel_wrapper(int b, int c, int n, int m,
                                            const int *idx, const float *weight,
                                            float *grad_points);
 
+void three_nn_cpu(int b, int n, int m, const float *unknown,
+                  const float *known, float *dist2, int *idx);
+void three_interpolate_cpu(int b, int c, int m, int n, const float *points,
+                           const int *idx, const float *weight, float *out);
+void three_interpolate_grad_cpu(int b, int c, int n, int m,
+                                const float *grad_out, const int *idx,
+                                const float *weight, float *grad_points);
+
 std::vector<at::Tensor> three_nn(at::Tensor unknowns, at::Tensor knows) {
   CHECK_CONTIGUOUS(unknowns);
   CHECK_CONTIGUOUS(knows);
@@ -29,11 +37,17 @@ std::vector<at::Tensor> three_nn(at::Tensor unknowns, at::Tensor knows) {
                    at::device(unknowns.device()).dtype(at::ScalarType::Float));
 
   if (unknowns.is_cuda()) {
+#ifdef WITH_CUDA
     three_nn_kernel_wrapper(unknowns.size(0), unknowns.size(1), knows.size(1),
                             unknowns.data_ptr<float>(), knows.data_ptr<float>(),
                             dist2.data_ptr<float>(), idx.data_ptr<int>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    three_nn_cpu(unknowns.size(0), unknowns.size(1), knows.size(1),
+                 unknowns.data_ptr<float>(), knows.data_ptr<float>(),
+                 dist2.data_ptr<float>(), idx.data_ptr<int>());
   }
 
   return {dist2, idx};
@@ -58,12 +72,19 @@ at::Tensor three_interpolate(at::Tensor points, at::Tensor idx,
                    at::device(points.device()).dtype(at::ScalarType::Float));
 
   if (points.is_cuda()) {
+#ifdef WITH_CUDA
     three_interpolate_kernel_wrapper(
         points.size(0), points.size(1), points.size(2), idx.size(1),
         points.data_ptr<float>(), idx.data_ptr<int>(), weight.data_ptr<float>(),
         output.data_ptr<float>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    three_interpolate_cpu(points.size(0), points.size(1), points.size(2),
+                          idx.size(1), points.data_ptr<float>(),
+                          idx.data_ptr<int>(), weight.data_ptr<float>(),
+                          output.data_ptr<float>());
   }
 
   return output;
@@ -87,12 +108,19 @@ at::Tensor three_interpolate_grad(at::Tensor grad_out, at::Tensor idx,
                    at::device(grad_out.device()).dtype(at::ScalarType::Float));
 
   if (grad_out.is_cuda()) {
+#ifdef WITH_CUDA
     three_interpolate_grad_kernel_wrapper(
         grad_out.size(0), grad_out.size(1), grad_out.size(2), m,
         grad_out.data_ptr<float>(), idx.data_ptr<int>(),
         weight.data_ptr<float>(), output.data_ptr<float>());
+#else
+    AT_ASSERT(false, "Not compiled with CUDA support");
+#endif
   } else {
-    AT_ASSERT(false, "CPU not supported");
+    three_interpolate_grad_cpu(grad_out.size(0), grad_out.size(1),
+                               grad_out.size(2), m, grad_out.data_ptr<float>(),
+                               idx.data_ptr<int>(), weight.data_ptr<float>(),
+                               output.data_ptr<float>());
   }
 
   return output;
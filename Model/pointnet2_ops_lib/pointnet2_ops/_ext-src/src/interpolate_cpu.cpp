@@ -0,0 +1,93 @@
+#include <ATen/Parallel.h>
+
+// input: unknown(b, n, 3) known(b, m, 3)
+// output: dist2(b, n, 3), idx(b, n, 3)
+void three_nn_cpu(int b, int n, int m, const float *unknown,
+                  const float *known, float *dist2, int *idx) {
+  at::parallel_for(0, (int64_t)b * n, 16, [&](int64_t begin, int64_t end) {
+    for (int64_t j = begin; j < end; ++j) {
+      const float *cur_known = known + (j / n) * m * 3;
+      float ux = unknown[j * 3 + 0];
+      float uy = unknown[j * 3 + 1];
+      float uz = unknown[j * 3 + 2];
+
+      double best1 = 1e40, best2 = 1e40, best3 = 1e40;
+      int besti1 = 0, besti2 = 0, besti3 = 0;
+      for (int k = 0; k < m; ++k) {
+        float x = cur_known[k * 3 + 0];
+        float y = cur_known[k * 3 + 1];
+        float z = cur_known[k * 3 + 2];
+        float d =
+            (ux - x) * (ux - x) + (uy - y) * (uy - y) + (uz - z) * (uz - z);
+        if (d < best1) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = best1;
+          besti2 = besti1;
+          best1 = d;
+          besti1 = k;
+        } else if (d < best2) {
+          best3 = best2;
+          besti3 = besti2;
+          best2 = d;
+          besti2 = k;
+        } else if (d < best3) {
+          best3 = d;
+          besti3 = k;
+        }
+      }
+      dist2[j * 3 + 0] = best1;
+      dist2[j * 3 + 1] = best2;
+      dist2[j * 3 + 2] = best3;
+
+      idx[j * 3 + 0] = besti1;
+      idx[j * 3 + 1] = besti2;
+      idx[j * 3 + 2] = besti3;
+    }
+  });
+}
+
+// input: points(b, c, m), idx(b, n, 3), weight(b, n, 3)
+// output: out(b, c, n)
+void three_interpolate_cpu(int b, int c, int m, int n, const float *points,
+                           const int *idx, const float *weight, float *out) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_points = points + i * m;
+      const int *cur_idx = idx + batch_index * n * 3;
+      const float *cur_weight = weight + batch_index * n * 3;
+      float *cur_out = out + i * n;
+      for (int j = 0; j < n; ++j) {
+        cur_out[j] = cur_points[cur_idx[j * 3 + 0]] * cur_weight[j * 3 + 0] +
+                     cur_points[cur_idx[j * 3 + 1]] * cur_weight[j * 3 + 1] +
+                     cur_points[cur_idx[j * 3 + 2]] * cur_weight[j * 3 + 2];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, n), idx(b, n, 3), weight(b, n, 3)
+// output: grad_points(b, c, m)
+// one channel of a cloud per task, so the scatter-add needs no atomics
+void three_interpolate_grad_cpu(int b, int c, int n, int m,
+                                const float *grad_out, const int *idx,
+                                const float *weight, float *grad_points) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_grad_out = grad_out + i * n;
+      const int *cur_idx = idx + batch_index * n * 3;
+      const float *cur_weight = weight + batch_index * n * 3;
+      float *cur_grad_points = grad_points + i * m;
+      for (int j = 0; j < n; ++j) {
+        cur_grad_points[cur_idx[j * 3 + 0]] +=
+            cur_grad_out[j] * cur_weight[j * 3 + 0];
+        cur_grad_points[cur_idx[j * 3 + 1]] +=
+            cur_grad_out[j] * cur_weight[j * 3 + 1];
+        cur_grad_points[cur_idx[j * 3 + 2]] +=
+            cur_grad_out[j] * cur_weight[j * 3 + 2];
+      }
+    }
+  });
+}
@@ -0,0 +1,84 @@
+#include <ATen/Parallel.h>
+
+#include <algorithm>
+
+// input: points(b, c, n) idx(b, m)
+// output: out(b, c, m)
+void gather_points_cpu(int b, int c, int n, int npoints, const float *points,
+                       const int *idx, float *out) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_points = points + i * n;
+      const int *cur_idx = idx + batch_index * npoints;
+      float *cur_out = out + i * npoints;
+      for (int j = 0; j < npoints; ++j) {
+        cur_out[j] = cur_points[cur_idx[j]];
+      }
+    }
+  });
+}
+
+// input: grad_out(b, c, m) idx(b, m)
+// output: grad_points(b, c, n)
+// one channel of a cloud per task, so the scatter-add needs no atomics
+void gather_points_grad_cpu(int b, int c, int n, int npoints,
+                            const float *grad_out, const int *idx,
+                            float *grad_points) {
+  at::parallel_for(0, (int64_t)b * c, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t i = begin; i < end; ++i) {
+      const int64_t batch_index = i / c;
+      const float *cur_grad_out = grad_out + i * npoints;
+      const int *cur_idx = idx + batch_index * npoints;
+      float *cur_grad_points = grad_points + i * n;
+      for (int j = 0; j < npoints; ++j) {
+        cur_grad_points[cur_idx[j]] += cur_grad_out[j];
+      }
+    }
+  });
+}
+
+// Input dataset: (b, n, 3), tmp: (b, n)
+// Output idxs (b, m)
+// same selection as the cuda kernel: starts at point 0, skips the points at
+// the origin and takes the first of equally far points
+void furthest_point_sampling_cpu(int b, int n, int m, const float *dataset,
+                                 float *temp, int *idxs) {
+  if (m <= 0) return;
+  at::parallel_for(0, b, 1, [&](int64_t begin, int64_t end) {
+    for (int64_t batch_index = begin; batch_index < end; ++batch_index) {
+      const float *cur_dataset = dataset + batch_index * n * 3;
+      float *cur_temp = temp + batch_index * n;
+      int *cur_idxs = idxs + batch_index * m;
+
+      int old = 0;
+      cur_idxs[0] = old;
+      for (int j = 1; j < m; j++) {
+        int besti = 0;
+        float best = -1;
+        float x1 = cur_dataset[old * 3 + 0];
+        float y1 = cur_dataset[old * 3 + 1];
+        float z1 = cur_dataset[old * 3 + 2];
+        for (int k = 0; k < n; ++k) {
+          float x2 = cur_dataset[k * 3 + 0];
+          float y2 = cur_dataset[k * 3 + 1];
+          float z2 = cur_dataset[k * 3 + 2];
+          float mag = (x2 * x2) + (y2 * y2) + (z2 * z2);
+          if (mag <= 1e-3) continue;
+
+          float d = (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1) +
+                    (z2 - z1) * (z2 - z1);
+
+          float d2 = std::min(d, cur_temp[k]);
+          cur_temp[k] = d2;
+          if (d2 > best) {
+            best = d2;
+            besti = k;
+          }
+        }
+        old = besti;
+        cur_idxs[j] = old;
+      }
+    }
+  });
+}
@@ -7,27 +7,30 @@ from typing import *
 try:
     import pointnet2_ops._ext as _ext
 except ImportError:
-    from torch.utils.cpp_extension import load
+    from torch.utils.cpp_extension import CUDA_HOME, load
     import glob
     import os.path as osp
     import os
 
     warnings.warn("Unable to load pointnet2_ops cpp extension. JIT Compiling.")
 
+    # without nvcc or a cuda build of torch only the cpu kernels are built
+    _with_cuda = CUDA_HOME is not None and torch.version.cuda is not None
     _ext_src_root = osp.join(osp.dirname(__file__), "_ext-src")
-    _ext_sources = glob.glob(osp.join(_ext_src_root, "src", "*.cpp")) + glob.glob(
-        osp.join(_ext_src_root, "src", "*.cu")
-    )
+    _ext_sources = glob.glob(osp.join(_ext_src_root, "src", "*.cpp"))
+    if _with_cuda:
+        _ext_sources += glob.glob(osp.join(_ext_src_root, "src", "*.cu"))
     _ext_headers = glob.glob(osp.join(_ext_src_root, "include", "*"))
 
     os.environ["TORCH_CUDA_ARCH_LIST"] = "3.7+PTX;5.0;6.0;6.1;6.2;7.0;7.5"
     _ext = load(
-        "_ext",
+        "_ext" if _with_cuda else "_ext_cpu",
         sources=_ext_sources,
         extra_include_paths=[osp.join(_ext_src_root, "include")],
-        extra_cflags=["-O3"],
-        extra_cuda_cflags=["-O3", "-Xfatbin", "-compress-all"],
-        with_cuda=True,
+        extra_cflags=["-O3", "-fopenmp"] + (["-DWITH_CUDA"] if _with_cuda else []),
+        extra_cuda_cflags=["-O3", "-Xfatbin", "-compress-all", "-DWITH_CUDA"],
+        extra_ldflags=["-fopenmp"],
+        with_cuda=_with_cuda,
     )
 
 
@@ -3,37 +3,53 @@ import os
 import os.path as osp
 
 from setuptools import find_packages, setup
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+import torch
+from torch.utils.cpp_extension import (CUDA_HOME, BuildExtension, CppExtension,
+                                       CUDAExtension)
 
 this_dir = osp.dirname(osp.abspath(__file__))
 _ext_src_root = osp.join("pointnet2_ops", "_ext-src")
-_ext_sources = glob.glob(osp.join(_ext_src_root, "src", "*.cpp")) + glob.glob(
-    osp.join(_ext_src_root, "src", "*.cu")
-)
+# the cuda kernels need nvcc and a cuda build of torch, the cpu kernels only a
+# c++ compiler
+_with_cuda = CUDA_HOME is not None and torch.version.cuda is not None
+_ext_sources = glob.glob(osp.join(_ext_src_root, "src", "*.cpp"))
+if _with_cuda:
+    _ext_sources += glob.glob(osp.join(_ext_src_root, "src", "*.cu"))
 _ext_headers = glob.glob(osp.join(_ext_src_root, "include", "*"))
 
 requirements = ["torch>=1.4"]
 
 exec(open(osp.join("pointnet2_ops", "_version.py")).read())
 
-os.environ["TORCH_CUDA_ARCH_LIST"] = "3.7+PTX;5.0;6.0;6.1;6.2;7.0;7.5"
+if _with_cuda:
+    os.environ["TORCH_CUDA_ARCH_LIST"] = "3.7+PTX;5.0;6.0;6.1;6.2;7.0;7.5"
+    _ext_module = CUDAExtension(
+        name="pointnet2_ops._ext",
+        sources=_ext_sources,
+        define_macros=[("WITH_CUDA", None)],
+        extra_compile_args={
+            "cxx": ["-O3", "-fopenmp"],
+            "nvcc": ["-O3", "-Xfatbin", "-compress-all"],
+        },
+        extra_link_args=["-fopenmp"],
+        include_dirs=[osp.join(this_dir, _ext_src_root, "include")],
+    )
+else:
+    _ext_module = CppExtension(
+        name="pointnet2_ops._ext",
+        sources=_ext_sources,
+        extra_compile_args={"cxx": ["-O3", "-fopenmp"]},
+        extra_link_args=["-fopenmp"],
+        include_dirs=[osp.join(this_dir, _ext_src_root, "include")],
+    )
+
 setup(
     name="pointnet2_ops",
     version=__version__,
     author="Erik Wijmans",
     packages=find_packages(),
     install_requires=requirements,
-    ext_modules=[
-        CUDAExtension(
-            name="pointnet2_ops._ext",
-            sources=_ext_sources,
-            extra_compile_args={
-                "cxx": ["-O3"],
-                "nvcc": ["-O3", "-Xfatbin", "-compress-all"],
-            },
-            include_dirs=[osp.join(this_dir, _ext_src_root, "include")],
-        )
-    ],
+    ext_modules=[_ext_module],
     cmdclass={"build_ext": BuildExtension},
     include_package_data=True,
 )
@@ -29,3 +29,22 @@ class ModelNet40():
 		attack_label = data['attack_label']
 
 		return [pc, gt_label, attack_label]
+
+
+class ModelNet40_store():
+	# the same items as ModelNet40, read from the Store/ shards of an experiment
+	def __init__(self, store_dir):
+		from Lib.result_store import Result_store
+		self.store = Result_store(store_dir)
+
+	def __len__(self):
+		return len(self.store)
+
+	def __getitem__(self, index):
+		data = self.store[index]
+
+		pc = torch.FloatTensor(data['points'])
+		gt_label = data['gt_label'].reshape(1, 1)
+		attack_label = data['pred_label'].reshape(1, 1)
+
+		return [pc, gt_label, attack_label]
@@ -16,12 +16,13 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.autograd import Variable
-from torch.autograd.gradcheck import zero_gradients
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ROOT_DIR = os.path.split(BASE_DIR)[0]
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(ROOT_DIR, 'Model'))
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+from fps import farthest_points_index_numpy
 
 
 parser = argparse.ArgumentParser(description='Point Cloud Attacking')
@@ -119,13 +120,7 @@ def sample_points(obj, num_points, normal):
     return points, normal
 
 def farthest_points_normalized_wfaces(obj_points, faces, num_points, normal):
-    first = np.random.randint(len(obj_points))
-    selected = [first]
-    dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-    for _ in range(num_points - 1):
-        dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-        selected.append(np.argmax(dists))
+    selected = farthest_points_index_numpy(obj_points, num_points)
     res_points = np.array(obj_points[selected])
     res_normal = np.array(normal[selected])
 
@@ -140,13 +135,7 @@ def farthest_points_normalized_wfaces(obj_points, faces, num_points, normal):
     return res_points, faces, res_normal
 
 def farthest_points_normalized(obj_points, num_points, normal):
-    first = np.random.randint(len(obj_points))
-    selected = [first]
-    dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-    for _ in range(num_points - 1):
-        dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-        selected.append(np.argmax(dists))
+    selected = farthest_points_index_numpy(obj_points, num_points)
     res_points = np.array(obj_points[selected])
     res_normal = np.array(normal[selected])
 
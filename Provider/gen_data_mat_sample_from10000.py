@@ -4,14 +4,14 @@ import sys
 import numpy as np
 from scipy.io import loadmat, savemat
 
-def __farthest_points_normalized(obj_points, num_points, normal):
-    first = np.random.randint(len(obj_points))
-    selected = [first]
-    dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-    for _ in range(num_points - 1):
-        dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-        selected.append(np.argmax(dists))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.split(BASE_DIR)[0]
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+from fps import farthest_points_index_numpy
+
+def __farthest_points_normalized(obj_points, num_points, normal, selected=None):
+    if selected is None:
+        selected = farthest_points_index_numpy(obj_points, num_points)
     res_points = np.array(obj_points[selected])
     res_normal = np.array(normal[selected])
 
@@ -37,8 +37,10 @@ saved_label = dataset['label']
 
 tmp_data_set = []
 tmp_normal_set = []
+# the samples of all the clouds in one call
+selected = farthest_points_index_numpy(data.transpose(0,2,1), resample_num)
 for j in range(data.shape[0]):
-    tmp_data, tmp_normal  = __farthest_points_normalized(data[j].T, resample_num, normal[j].T)
+    tmp_data, tmp_normal  = __farthest_points_normalized(data[j].T, resample_num, normal[j].T, selected[j])
     tmp_data_set.append(tmp_data.T)
     tmp_normal_set.append(tmp_normal.T)
 saved_dense_data = np.stack(tmp_data_set)
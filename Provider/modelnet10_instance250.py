@@ -7,6 +7,11 @@ from scipy.io import loadmat
 import torch
 from torch.utils.data.dataloader import default_collate
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.split(BASE_DIR)[0]
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+from fps import farthest_points_index_numpy
+
 ten_label_indexes = [17, 9, 36, 20, 3, 16, 34, 38, 23, 15]
 ten_label_names = ['airplane', 'bed', 'bookshelf', 'bottle', 'chair', 'monitor', 'sofa', 'table', 'toilet', 'vase']
 
@@ -28,8 +33,10 @@ class ModelNet40():
         if resample_num>0:
             tmp_data_set = []
             tmp_normal_set = []
+            # the samples of all the clouds in one call
+            selected = farthest_points_index_numpy(data.permute(0,2,1).numpy(), resample_num)
             for j in range(data.size(0)):
-                tmp_data, tmp_normal  = self.__farthest_points_normalized(data[j].t(), resample_num, normal[j].t())
+                tmp_data, tmp_normal  = self.__farthest_points_normalized(data[j].t(), resample_num, normal[j].t(), selected[j])
                 tmp_data_set.append(torch.from_numpy(tmp_data).t().float())
                 tmp_normal_set.append(torch.from_numpy(tmp_normal).t().float())
             data = torch.stack(tmp_data_set)
@@ -106,14 +113,9 @@ class ModelNet40():
 
             return [pcs, normals, gt_labels, target_labels]
 
-    def __farthest_points_normalized(self, obj_points, num_points, normal):
-        first = np.random.randint(len(obj_points))
-        selected = [first]
-        dists = np.full(shape = len(obj_points), fill_value = np.inf)
-
-        for _ in range(num_points - 1):
-            dists = np.minimum(dists, np.linalg.norm(obj_points - obj_points[selected[-1]][np.newaxis, :], axis = 1))
-            selected.append(np.argmax(dists))
+    def __farthest_points_normalized(self, obj_points, num_points, normal, selected=None):
+        if selected is None:
+            selected = farthest_points_index_numpy(obj_points, num_points)
         res_points = np.array(obj_points[selected])
         res_normal = np.array(normal[selected])
 
@@ -18,7 +18,6 @@ import torch
 from torch.autograd import Variable
 import torch.nn as nn
 import torch.optim as optim
-from torch.autograd.gradcheck import zero_gradients
 from pytorch3d.structures import Meshes
 from pytorch3d.io import load_obj, save_obj
 
@@ -10,21 +10,29 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.autograd import Variable
-from torch.autograd.gradcheck import zero_gradients
 
-from Lib.utility import farthest_points_sample
+from Lib.device_policy import get_device_policy
+from Lib.utility import farthest_points_sample, write_pc_obj
 
 
 def random_drop_fn(pc, drop_num):
     n = pc.size(2)
-    idx = torch.randperm(n)[drop_num:].long().cuda()
+    idx = torch.randperm(n)[drop_num:].long().to(pc.device)
     idx = torch.sort(idx, dim=0,descending=False)[0]
     # pdb.set_trace()
     return pc.clone()[:, :, idx].contiguous(), drop_num
 
-def outlier_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn):
+def _knn_mean_dis(pc, outlier_knn):
     dis = (pc.unsqueeze(2)-pc.unsqueeze(3)+1e-10).pow(2).sum(dim=1).sqrt()
-    dis = dis.topk(outlier_knn+1,dim=2,largest=False, sorted=True)[0][:, :, 1:].contiguous().mean(dim=-1)
+    return dis.topk(outlier_knn+1,dim=2,largest=False, sorted=True)[0][:, :, 1:].contiguous().mean(dim=-1)
+
+def outlier_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn, geo_cache=None):
+    if geo_cache is not None:
+        # the adversarial clouds are fixed, the distances are shared by all the drop_num/alpha settings
+        dis = geo_cache.get('knn_mean_dis', [pc.cpu().numpy()], {'k': outlier_knn}, lambda: _knn_mean_dis(pc, outlier_knn).cpu().numpy())
+        dis = torch.from_numpy(np.array(dis)).to(pc.device)
+    else:
+        dis = _knn_mean_dis(pc, outlier_knn)
     n = pc.size(2)
 
     if defense_type == 'outliers_variance':
@@ -39,11 +47,11 @@ def outlier_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn):
         idx = torch.sort(idx, dim=0,descending=False)[0]
         return pc.clone()[:, :, idx].contiguous(), n-idx.size(0)
 
-def point_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn):
+def point_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn, geo_cache=None):
     if defense_type == 'rand_drop':
         output_pc, num = random_drop_fn(pc, drop_num)
     elif defense_type == 'outliers_variance' or defense_type == 'outliers_fixNum':
-        output_pc, num = outlier_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn)
+        output_pc, num = outlier_removal_fn(pc, defense_type, drop_num, alpha, outlier_knn, geo_cache)
     else:
         assert False, 'Wrong defense type!'
 
@@ -55,32 +63,39 @@ def main():
     else:
         seed = time.time()
 
+    policy = get_device_policy(cfg)
+    policy.setup()
     np.random.seed(seed)
-    torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
+    policy.manual_seed(seed)
 
     #data
-    test_dataset = ModelNet40(cfg.datadir)
+    if is_store(cfg.datadir):
+        test_dataset = ModelNet40_store(cfg.datadir)
+    else:
+        test_dataset = ModelNet40(cfg.datadir)
     test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=1, shuffle=False, drop_last=False,
-        num_workers=cfg.num_workers, pin_memory=True)
+        num_workers=cfg.num_workers, pin_memory=policy.pin_memory)
     test_size = test_dataset.__len__()
 
     # model
     model_path = os.path.join('Pretrained', cfg.arch, str(cfg.npoint), 'model_best.pth.tar')
     if cfg.arch == 'PointNet':
         from Model.PointNet import PointNet
-        net = PointNet(cfg.classes, npoint=cfg.npoint).cuda()
+        net = PointNet(cfg.classes, npoint=cfg.npoint)
     elif cfg.arch == 'PointNetPP':
         from Model.PointNetPP_ssg import PointNet2ClassificationSSG
-        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False).cuda()
+        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False)
     else:
         assert False, 'Not support such arch.'
 
-    checkpoint = torch.load(model_path)
+    checkpoint = torch.load(model_path, map_location='cpu')
     net.load_state_dict(checkpoint['state_dict'])
+    net = policy.model(net)
     net.eval()
     print('\nSuccessfully load pretrained-model from {}\n'.format(model_path))
 
+    geo_cache = Geometry_cache(cfg.geo_cache_dir) if cfg.geo_cache_dir is not None else None
+
     cnt = 0
     num_defense_success =0
     num_attack_still_success =0
@@ -93,10 +108,10 @@ def main():
 
         if adv_pc.size(2) > cfg.npoint:
             #adv_pc = adv_pc[:,:,:cfg.npoint]
-            adv_pc = farthest_points_sample(adv_pc.cuda(), cfg.npoint)
+            adv_pc = farthest_points_sample(policy.to(adv_pc), cfg.npoint)
 
         with torch.no_grad():
-            defense_pc, num = point_removal_fn(adv_pc.cuda(), cfg.defense_type, cfg.drop_num, cfg.alpha, cfg.outlier_knn)
+            defense_pc, num = point_removal_fn(policy.to(adv_pc), cfg.defense_type, cfg.drop_num, cfg.alpha, cfg.outlier_knn, geo_cache)
             defense_pc_var = Variable(defense_pc)
             defense_output = net(defense_pc)
 
@@ -113,16 +128,10 @@ def main():
         saved_pc = defense_pc_var.data[0].clone().cpu().permute(1, 0).clone().numpy()
 
         if cfg.is_record_all:
-            fout = open(os.path.join(os.path.split(cfg.datadir)[0], 'Defensed', 'Gt' + str(gt_label[0].item()) + '_record_' + str(i) + '_attack' + str(attack_label[0].item()) + '_defensedGT' + str(torch.max(defense_output,1)[1].data.item())+'.obj'), 'w')
-            for m in range(saved_pc.shape[0]):
-                fout.write('v %f %f %f 0 0 0\n' % (saved_pc[m, 0], saved_pc[m, 1], saved_pc[m, 2]))
-            fout.close()
+            write_pc_obj(os.path.join(os.path.split(cfg.datadir)[0], 'Defensed', 'Gt' + str(gt_label[0].item()) + '_record_' + str(i) + '_attack' + str(attack_label[0].item()) + '_defensedGT' + str(torch.max(defense_output,1)[1].data.item())+'.obj'), saved_pc)
         elif cfg.is_record_wrong:
             if gt_label[0].item() != torch.max(defense_output,1)[1].data.item():
-                fout = open(os.path.join(os.path.split(cfg.datadir)[0], 'Defensed', 'Gt' + str(gt_label[0].item()) + '_record_' + str(i) + '_attack' + str(attack_label[0].item()) + '_defensedGT' + str(torch.max(defense_output,1)[1].data.item())+'.obj'), 'w')
-                for m in range(saved_pc.shape[0]):
-                    fout.write('v %f %f %f 0 0 0\n' % (saved_pc[m, 0], saved_pc[m, 1], saved_pc[m, 2]))
-                fout.close()
+                write_pc_obj(os.path.join(os.path.split(cfg.datadir)[0], 'Defensed', 'Gt' + str(gt_label[0].item()) + '_record_' + str(i) + '_attack' + str(attack_label[0].item()) + '_defensedGT' + str(torch.max(defense_output,1)[1].data.item())+'.obj'), saved_pc)
 
         if (i+1) % cfg.print_freq == 0:
             print('[{0}/{1}]  attack success: {2:.2f} still attack success: {3:.2f} avg drop num: {4:.2f}'.format(
@@ -157,11 +166,13 @@ if __name__ == '__main__':
     sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
     sys.path.append(os.path.join(ROOT_DIR, 'Provider'))
     from Lib.loss_utils import *
-    from Provider.defense_modelnet10_instance250 import ModelNet40
+    from Provider.defense_modelnet10_instance250 import ModelNet40, ModelNet40_store
+    from Lib.result_store import is_store
+    from Lib.geo_cache import Geometry_cache
 
     parser = argparse.ArgumentParser(description='Point Cloud Defense')
     #------------Dataset-----------------------
-    parser.add_argument('--datadir', default='Data/modelnet40_1024_processed', type=str, metavar='DIR', help='path to dataset')
+    parser.add_argument('--datadir', default='Data/modelnet40_1024_processed', type=str, metavar='DIR', help='path to the Mat or the Store dir of the adversarial examples')
     parser.add_argument('--npoint', default=1024, type=int, help='')
     parser.add_argument('-c', '--classes', default=40, type=int, metavar='N', help='num of classes (default: 40)')
     #------------Model-----------------------
@@ -172,11 +183,14 @@ if __name__ == '__main__':
     parser.add_argument('--outlier_knn', type=int, default=2, help='')
     parser.add_argument('--alpha', type=float, default=1.1, help='')
     parser.add_argument('--drop_num', type=int, default=128, help='')
+    parser.add_argument('--geo_cache_dir', default=None, type=str, help='cache of the kNN distances of the adversarial clouds kept across runs')
     parser.add_argument('--is_record_all', action='store_true', default=False, help='')
     parser.add_argument('--is_record_wrong', action='store_true', default=False, help='')
     #------------OS-----------------------
     parser.add_argument('-j', '--num_workers', default=8, type=int, metavar='N', help='number of data loading workers (default: 8)')
     parser.add_argument('--random_seed', default=0, type=int, help='')
+    parser.add_argument('--device', default='auto', type=str, help='cpu | cuda | cuda:k | auto (cuda when available)')
+    parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads, 0 for the torch default')
     parser.add_argument('--print_freq', default=50, type=int, help='')
 
     cfg  = parser.parse_args()
@@ -11,33 +11,31 @@ import scipy.io as sio
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from pytorch3d.io import load_obj, save_obj
-from pytorch3d.ops import sample_points_from_meshes
-from pytorch3d.structures import Meshes
-from torch.autograd import Variable
-from torch.autograd.gradcheck import zero_gradients
-
-from Attacker import geoA3_attack
-from Lib.utility import (Average_meter, Count_converge_iter, Count_loss_iter,
-                         _compare, accuracy, estimate_normal_via_ori_normal,
-                         farthest_points_sample)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = BASE_DIR
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
 
-def main(cfg):
-    if cfg.attack == 'GeoA3_mesh':
-        assert False, 'Not uploaded yet.'
-
-    if cfg.attack_label == 'Untarget':
-        targeted = False
-    else:
-        targeted = True
-
+from Attacker import geoA3_attack
+from Lib.utility import (Async_writer, Average_meter, Count_converge_iter,
+                         Count_loss_iter, _compare, accuracy,
+                         estimate_normal_via_ori_normal, farthest_points_sample,
+                         get_rng_state, load_checkpoint, save_checkpoint,
+                         set_rng_state, write_pc_obj)
+from Lib.result_store import Result_store
+from Lib.spatial_index import Ori_cloud_index
+from Lib.device_policy import get_device_policy
+# by their bare names, as the Attacker and Lib modules import them
+from stage_profiler import profiler
+from knn import get_knn_backend, set_knn_backend
+
+
+def get_saved_dir(cfg):
     print('=>Creating dir')
     saved_root = os.path.join('Exps', cfg.arch + '_npoint' + str(cfg.npoint))
 
     if cfg.attack == 'GeoA3' or cfg.attack == 'GeoA3_mesh':
         saved_dir = str(cfg.attack) + '_' +  str(cfg.id) +  '_BiStep' + str(cfg.binary_max_steps) + '_IterStep' + str(cfg.iter_max_steps) + '_Opt' + cfg.optim  +  '_Lr' + str(cfg.lr) + '_Initcons' + str(cfg.initial_const) + '_' + cfg.cls_loss_type + '_' + str(cfg.dis_loss_type) + 'Loss' + str(cfg.dis_loss_weight)
-
         if cfg.hd_loss_weight != 0:
             saved_dir = saved_dir + '_HDLoss' + str(cfg.hd_loss_weight)
 
@@ -95,15 +93,20 @@ def main(cfg):
     if not os.path.exists(trg_dir):
         os.makedirs(trg_dir)
 
-    if cfg.id == 0:
-        seed = 0
+    return saved_dir
+
+
+def get_attack_classes(cfg):
+    # [targeted, number of attacked copies per instance]
+    if cfg.attack_label == 'Untarget':
+        return False, 1
+    elif cfg.attack_label == 'Random':
+        return True, 1
     else:
-        seed = int(time.time())
-    np.random.seed(seed)
-    torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
+        return True, 9
 
-    #data
+
+def get_test_dataset(cfg):
     if cfg.attack == 'GeoA3_mesh':
         from Provider.modelnet10_instance250_mesh import \
             ModelNet10_250instance_mesh
@@ -118,34 +121,173 @@ def main(cfg):
 
         from Provider.modelnet10_instance250 import ModelNet40
         test_dataset = ModelNet40(data_mat_file=cfg.data_dir_file, attack_label=cfg.attack_label, resample_num=resample_num)
-    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=True)
-    test_size = test_dataset.__len__()
 
     if (cfg.is_save_normal) & (cfg.dense_data_dir_file is not None):
+        from Provider.modelnet10_instance250 import ModelNet40
         dense_test_dataset = ModelNet40(data_mat_file=cfg.dense_data_dir_file, attack_label=cfg.attack_label, resample_num=-1)
-        dense_test_loader = torch.utils.data.DataLoader(dense_test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=True)
-        dense_test_size = dense_test_dataset.__len__()
-        dense_iter = iter(dense_test_loader)
     else:
-        dense_iter = None
+        dense_test_dataset = None
 
-    # model
+    return test_dataset, dense_test_dataset
+
+
+def load_model(cfg, policy=None):
     print('=>Loading model')
+    if policy is None:
+        policy = get_device_policy(cfg)
     model_path = os.path.join('Pretrained', cfg.arch, str(cfg.npoint), 'model_best.pth.tar')
     if cfg.arch == 'PointNet':
         from Model.PointNet import PointNet
-        net = PointNet(cfg.classes, npoint=cfg.npoint).cuda()
+        net = PointNet(cfg.classes, npoint=cfg.npoint)
     elif cfg.arch == 'PointNetPP':
         from Model.PointNetPP_ssg import PointNet2ClassificationSSG
-        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False).cuda()
+        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False)
     else:
         assert False, 'Not support such arch.'
 
-    checkpoint = torch.load(model_path)
+    # the weights saved from cuda are loaded on any device
+    checkpoint = torch.load(model_path, map_location='cpu')
     net.load_state_dict(checkpoint['state_dict'])
+    net = policy.model(net)
     net.eval()
     print('==>Successfully load pretrained-model from {}'.format(model_path))
 
+    return net
+
+
+def attack_batch(net, data, dense_data, cfg, i, loader_len, saved_dir, cnt_ins, resume_state=None, ckpt_fn=None, writer=None, policy=None):
+    # attack one batch of the loader and save the successful adversarial examples, in the background if writer is given
+    # return [num_attack_success, b, best_attack_step, loss]
+    targeted, num_attack_classes = get_attack_classes(cfg)
+    if policy is None:
+        policy = get_device_policy(cfg)
+
+    gt_target = data[2].view(-1).to(policy.device)
+    b = gt_target.size(0)
+
+    if dense_data is not None:
+        dense_point = dense_data[0]
+        dense_normal = dense_data[1]
+
+        if dense_point.size(3) == 3:
+            dense_point = dense_point.permute(0,1,3,2)
+        if dense_normal.size(3) == 3:
+            dense_normal = dense_normal.permute(0,1,3,2)
+
+        bs, l, _, n = dense_point.size()
+        b = bs*l
+
+        dense_point = policy.to(dense_point.view(b, 3, n))
+        dense_normal = policy.to(dense_normal.view(b, 3, n))
+
+    with profiler.stage('attack'):
+        adv_pc, targeted_label, attack_success_indicator, best_attack_step, loss, best_dist = geoA3_attack.attack(net, data, cfg, i, loader_len, saved_dir, resume_state, ckpt_fn, policy)
+    eval_num = 1
+
+    if cfg.is_save_normal:
+        with torch.no_grad(), profiler.stage('estimate_normal'):
+            # the loop here is for memory save
+            knn_normal = torch.zeros_like(adv_pc)
+            for idx in range(b):
+                dense_index = Ori_cloud_index(dense_point[idx].unsqueeze(0)) if cfg.is_ori_kdtree else None
+                knn_normal[idx] = estimate_normal_via_ori_normal(adv_pc[idx].unsqueeze(0), dense_point[idx].unsqueeze(0), dense_normal[idx].unsqueeze(0), k=3, ori_index=dense_index)
+        saved_normal = knn_normal.cpu().numpy()
+
+    for _ in range(0,eval_num):
+        with torch.no_grad(), profiler.stage('evaluation'):
+            if adv_pc.size(2) > cfg.npoint:
+                eval_points = farthest_points_sample(adv_pc, cfg.npoint)
+            else:
+                eval_points = adv_pc
+            test_adv_output = net(eval_points)
+        attack_success_iter = _compare(torch.max(test_adv_output,1)[1].data, targeted_label, gt_target, targeted)
+
+        try:
+            attack_success += attack_success_iter
+        except:
+            attack_success = attack_success_iter
+    saved_pc = adv_pc.cpu().clone().numpy()
+
+    if cfg.is_result_store:
+        # one shard per batch, with the successful examples as in the per-file layout
+        pred_label = torch.max(test_adv_output,1)[1].data.cpu().numpy()
+        success_idx = np.nonzero(attack_success_indicator)[0]
+        records = {
+            'points': saved_pc[success_idx],
+            'gt_label': gt_target.cpu().numpy()[success_idx],
+            'target_label': targeted_label.cpu().numpy()[success_idx],
+            'pred_label': pred_label[success_idx],
+            'instance_idx': cnt_ins + success_idx // num_attack_classes,
+            'best_step': np.array(best_attack_step)[success_idx],
+            'dist': best_dist[success_idx],
+        }
+        if cfg.is_save_normal:
+            records['est_normal'] = saved_normal[success_idx]
+
+        store = Result_store(os.path.join(saved_dir, 'Store'))
+        with profiler.stage('save'):
+            if writer is not None:
+                writer.submit(store.append, i, records)
+            else:
+                store.append(i, records)
+        return len(success_idx), b, best_attack_step, loss
+
+    num_attack_success = 0
+    for k in range(b):
+        if attack_success_indicator[k].item():
+            num_attack_success += 1
+            name = 'adv_' + str(cnt_ins+k//num_attack_classes) + '_gt' + str(gt_target[k].item()) + '_attack' + str(torch.max(test_adv_output,1)[1].data[k].item()) + '_expect' + str(targeted_label[k].item())
+
+            if cfg.is_save_normal:
+                mat_dict = {"adversary_point_clouds": saved_pc[k], 'gt_label': gt_target[k].item(), 'attack_label': torch.max(test_adv_output,1)[1].data[k].item(), 'est_normal':saved_normal[k]}
+            else:
+                mat_dict = {"adversary_point_clouds": saved_pc[k], 'gt_label': gt_target[k].item(), 'attack_label': torch.max(test_adv_output,1)[1].data[k].item()}
+
+            with profiler.stage('save'):
+                if writer is not None:
+                    writer.submit(sio.savemat, os.path.join(saved_dir, 'Mat', name+'.mat'), mat_dict)
+                    writer.submit(write_pc_obj, os.path.join(saved_dir, 'PC', name+'.obj'), saved_pc[k].T)
+                else:
+                    sio.savemat(os.path.join(saved_dir, 'Mat', name+'.mat'), mat_dict)
+                    write_pc_obj(os.path.join(saved_dir, 'PC', name+'.obj'), saved_pc[k].T)
+
+    return num_attack_success, b, best_attack_step, loss
+
+
+def main(cfg):
+    if cfg.attack == 'GeoA3_mesh':
+        assert False, 'Not uploaded yet.'
+
+    saved_dir = get_saved_dir(cfg)
+    policy = get_device_policy(cfg)
+    policy.setup()
+    set_knn_backend(cfg.knn_backend, cfg.knn_mem_budget)
+    print('==>{0}, {1} knn'.format(policy, get_knn_backend()))
+    if cfg.is_profile:
+        profiler.enable(cfg.is_profile_trace)
+
+    if cfg.id == 0:
+        seed = 0
+    else:
+        seed = int(time.time())
+    np.random.seed(seed)
+    policy.manual_seed(seed)
+
+    #data
+    test_dataset, dense_test_dataset = get_test_dataset(cfg)
+    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=policy.pin_memory)
+    test_size = test_dataset.__len__()
+
+    if dense_test_dataset is not None:
+        dense_test_loader = torch.utils.data.DataLoader(dense_test_dataset, batch_size=cfg.batch_size, shuffle=False, drop_last=False, num_workers=cfg.num_workers, pin_memory=policy.pin_memory)
+        dense_test_size = dense_test_dataset.__len__()
+        dense_iter = iter(dense_test_loader)
+    else:
+        dense_iter = None
+
+    # model
+    net = load_model(cfg, policy)
+
     # recording settings
     if cfg.is_record_converged_steps:
         cci = Count_converge_iter(os.path.join(saved_dir, 'Records'))
@@ -161,53 +303,79 @@ def main(cfg):
     cnt_ins = test_dataset.start_index
     cnt_all = 0
 
-    if cfg.attack_label == 'Untarget':
-        targeted = False
-        num_attack_classes = 1
-    elif cfg.attack_label == 'Random':
-        targeted = True
-        num_attack_classes = 1
+    targeted, num_attack_classes = get_attack_classes(cfg)
+
+    # checkpoint of the campaign, taken between the batches and optionally between the search steps of a batch
+    ckpt_file = os.path.join(saved_dir, 'Records', 'checkpoint.pkl')
+    def _save_ckpt(batch_idx, attack_state=None):
+        # only the outputs that are on disk may be counted as done
+        if writer is not None:
+            writer.flush()
+        state = {
+            'batch_idx': batch_idx,
+            'batch_size': cfg.batch_size,
+            'cnt_ins': cnt_ins,
+            'cnt_all': cnt_all,
+            'num_attack_success': num_attack_success,
+            'cci': cci.state_dict() if cfg.is_record_converged_steps else None,
+            'cli': cli.state_dict() if cfg.is_record_loss else None,
+            'rng': get_rng_state(),
+            'attack_state': attack_state,
+        }
+        save_checkpoint(state, ckpt_file)
+
+    if cfg.num_writer_threads > 0:
+        writer = Async_writer(cfg.num_writer_threads, cfg.writer_queue_size)
     else:
-        targeted = True
-        num_attack_classes = 9
-
+        writer = None
+
+    start_batch = 0
+    attack_state = None
+    resume_rng = None
+    if cfg.resume:
+        assert os.path.exists(ckpt_file), 'No checkpoint in {}'.format(ckpt_file)
+        ckpt = load_checkpoint(ckpt_file)
+        assert ckpt['batch_size'] == cfg.batch_size, 'The checkpoint was taken with batch_size {}'.format(ckpt['batch_size'])
+        start_batch = ckpt['batch_idx']
+        cnt_ins = ckpt['cnt_ins']
+        cnt_all = ckpt['cnt_all']
+        num_attack_success = ckpt['num_attack_success']
+        if cfg.is_record_converged_steps and ckpt['cci'] is not None:
+            cci.load_state_dict(ckpt['cci'])
+        if cfg.is_record_loss and ckpt['cli'] is not None:
+            cli.load_state_dict(ckpt['cli'])
+        resume_rng = ckpt['rng']
+        attack_state = ckpt['attack_state']
+        print('==>Resume from batch {} of {}'.format(start_batch, ckpt_file))
+
+    load_since = time.perf_counter()
     for i, data in enumerate(test_loader):
+        if i < start_batch:
+            if dense_iter is not None:
+                next(dense_iter)
+            continue
+        profiler.add_time('data_loading', time.perf_counter() - load_since)
+        if resume_rng is not None:
+            # restored only here, since creating the loader iterator draws from the generator
+            set_rng_state(resume_rng)
+            resume_rng = None
+
         if cfg.attack == 'GeoA3_mesh':
             vertex, _, gt_label = data[0], data[1], data[2]
-            gt_target = gt_label.view(-1).cuda()
+            gt_target = gt_label.view(-1).to(policy.device)
             bs, l, _, _ = vertex.size()
             b = bs*l
         else:
             pc = data[0]
-            normal = data[1]
             gt_labels = data[2]
             if pc.size(3) == 3:
                 pc = pc.permute(0,1,3,2)
-            if normal.size(3) == 3:
-                normal = normal.permute(0,1,3,2)
 
             bs, l, _, n = pc.size()
             b = bs*l
 
-            pc = pc.view(b, 3, n).cuda()
-            normal = normal.view(b, 3, n).cuda()
-            gt_target = gt_labels.view(-1).cuda()
-
-            if dense_iter is not None:
-                dense_data = dense_iter.next()
-                dense_point = dense_data[0]
-                dense_normal = dense_data[1]
-
-                if dense_point.size(3) == 3:
-                    dense_point = dense_point.permute(0,1,3,2)
-                if dense_normal.size(3) == 3:
-                    dense_normal = dense_normal.permute(0,1,3,2)
-
-                bs, l, _, n = dense_point.size()
-                b = bs*l
-
-                dense_point = dense_point.view(b, 3, n).cuda()
-                dense_normal = dense_normal.view(b, 3, n).cuda()
+            pc = policy.to(pc.view(b, 3, n))
+            gt_target = gt_labels.view(-1).to(policy.device)
 
         if cfg.attack is None:
             if n == 10000:
@@ -224,8 +392,18 @@ def main(cfg):
             print("Prec@1 {top1.avg:.3f}".format(top1=test_acc))
 
         elif cfg.attack == 'GeoA3':
-            adv_pc, targeted_label, attack_success_indicator, best_attack_step, loss = geoA3_attack.attack(net, data, cfg, i, len(test_loader), saved_dir)
-            eval_num = 1
+            dense_data = next(dense_iter) if dense_iter is not None else None
+            if cfg.is_search_step_ckpt:
+                ckpt_fn = lambda state, i=i: _save_ckpt(i, state)
+            else:
+                ckpt_fn = None
+            # the first attacked batch is the one traced
+            trace_file = os.path.join(saved_dir, 'Records', 'trace_batch{}.json'.format(i)) if i == start_batch else None
+            profiler.begin_batch()
+            with profiler.trace(trace_file):
+                num_success, b, best_attack_step, loss = attack_batch(net, data, dense_data, cfg, i, len(test_loader), saved_dir, cnt_ins, attack_state, ckpt_fn, writer, policy)
+            profiler.end_batch(i, b)
+            attack_state = None
         elif cfg.attack == 'GeoA3_mesh':
             adv_mesh, targeted_label, attack_success_indicator, best_attack_step, best_score = geoA3_mesh_attack.attack(net, data, cfg, i, len(test_loader), saved_dir)
             eval_num = 1
@@ -238,48 +416,13 @@ def main(cfg):
             if cfg.is_record_loss:
                 cli.record_loss_iter(loss)
 
-            if cfg.is_save_normal:
-                with torch.no_grad():
-                    # the loop here is for memory save
-                    knn_normal = torch.zeros_like(adv_pc)
-                    for idx in range(b):
-                        knn_normal[idx] = estimate_normal_via_ori_normal(adv_pc[idx].unsqueeze(0), dense_point[idx].unsqueeze(0), dense_normal[idx].unsqueeze(0), k=3)
-                saved_normal = knn_normal.cpu().numpy()
-
-            for _ in range(0,eval_num):
-                with torch.no_grad():
-                    if adv_pc.size(2) > cfg.npoint:
-                        eval_points = farthest_points_sample(adv_pc, cfg.npoint)
-                    else:
-                        eval_points = adv_pc
-                    test_adv_output = net(eval_points)
-                attack_success_iter = _compare(torch.max(test_adv_output,1)[1].data, targeted_label, gt_target.cuda(), targeted)
-
-                try:
-                    attack_success += attack_success_iter
-                except:
-                    attack_success = attack_success_iter
-            saved_pc = adv_pc.cpu().clone().numpy()
-
-            for k in range(b):
-                if attack_success_indicator[k].item():
-                    num_attack_success += 1
-                    name = 'adv_' + str(cnt_ins+k//num_attack_classes) + '_gt' + str(gt_target[k].item()) + '_attack' + str(torch.max(test_adv_output,1)[1].data[k].item()) + '_expect' + str(targeted_label[k].item())
-
-                    if cfg.is_save_normal:
-                        sio.savemat(os.path.join(saved_dir, 'Mat', name+'.mat'),
-                        {"adversary_point_clouds": saved_pc[k], 'gt_label': gt_target[k].item(), 'attack_label': torch.max(test_adv_output,1)[1].data[k].item(), 'est_normal':saved_normal[k]})
-                    else:
-                        sio.savemat(os.path.join(saved_dir, 'Mat', name+'.mat'),
-                        {"adversary_point_clouds": saved_pc[k], 'gt_label': gt_target[k].item(), 'attack_label': torch.max(test_adv_output,1)[1].data[k].item()})
-
-                    fout = open(os.path.join(saved_dir, 'PC', name+'.obj'), 'w')
-                    for m in range(saved_pc.shape[2]):
-                        fout.write('v %f %f %f 0 0 0\n' % (saved_pc[k, 0, m], saved_pc[k, 1, m], saved_pc[k, 2, m]))
-                    fout.close()
-
+            num_attack_success += num_success
             cnt_ins = cnt_ins + bs
             cnt_all = cnt_all + b
+
+            if (cfg.ckpt_freq > 0) and ((i+1) % cfg.ckpt_freq == 0 or cfg.is_search_step_ckpt):
+                _save_ckpt(i+1)
+            load_since = time.perf_counter()
         elif cfg.attack == 'GeoA3_mesh':
             for k in range(b):
                 if attack_success_indicator[k].item() and best_score[k] != -1:
@@ -290,11 +433,19 @@ def main(cfg):
                     sio.savemat(os.path.join(saved_dir, 'Mat', name+'.mat'), {"vert": final_verts, "faces":final_faces})
                     #save .obj mesh
                     file_name = os.path.join(saved_dir, 'Mesh', name+'.obj')
+                    from pytorch3d.io import save_obj
                     save_obj(file_name, final_verts, final_faces)
 
             cnt_ins = cnt_ins + bs
             cnt_all = cnt_all + b
 
+    if writer is not None:
+        writer.close()
+
+    if cfg.is_profile:
+        profiler.save(os.path.join(saved_dir, 'Records', 'profile.json'))
+        profiler.print_summary()
+
     if cfg.is_record_converged_steps:
         cci.save_converge_iter()
         cci.plot_converge_iter_hist()
@@ -314,7 +465,7 @@ def main(cfg):
     return saved_dir
 
 
-if __name__ == '__main__':
+def get_parser():
     parser = argparse.ArgumentParser(description='Point Cloud Attacking')
     #------------Model-----------------------
     parser.add_argument('--id', type=int, default=0, help='')
@@ -329,11 +480,20 @@ if __name__ == '__main__':
     parser.add_argument('--attack', default=None, type=str, help='GeoA3 | GeoA3_mesh')
     parser.add_argument('--attack_label', default='All', type=str, help='[All; ...; Untarget]')
     parser.add_argument('--binary_max_steps', type=int, default=10, help='')
+    parser.add_argument('--is_active_set', action='store_true', default=False, help='stop optimizing the samples whose scale_const bounds have converged')
+    parser.add_argument('--active_set_tol', type=float, default=0.1, help='relative gap of the scale_const bounds for convergence')
+    parser.add_argument('--num_parallel_const', type=int, default=0, help='number of scale_const candidates optimized at once per sample, 0 for the binary search')
+    parser.add_argument('--parallel_const_decades', type=float, default=2, help='the first candidate grid spans initial_const*10^[-decades, decades]')
     parser.add_argument('--initial_const', type=float, default=10, help='')
     parser.add_argument('--iter_max_steps',  default=500, type=int, metavar='M', help='max steps')
     parser.add_argument('--optim', default='adam', type=str, help='adam| sgd')
     parser.add_argument('--lr', type=float, default=0.01, help='')
     parser.add_argument('--eval_num', type=int, default=1, help='')
+    parser.add_argument('--eval_max_batch', type=int, default=256, help='max number of subsampled clouds in one forward of the eval_num check')
+    parser.add_argument('--is_ori_kdtree', action='store_true', default=False, help='serve the queries into the original clouds with kd-trees built once per batch')
+    parser.add_argument('--is_nn_tracker', action='store_true', default=False, help='update the adv->ori nearest neighbours from the previous step')
+    parser.add_argument('--geo_cache_dir', default=None, type=str, help='cache of the geometry of the original clouds kept across runs, e.g. Data/GeoCache')
+    parser.add_argument('--is_reuse_step_logits', action='store_true', default=False, help='check attack success with the logits of the optimization step')
     ## cls loss
     parser.add_argument('--cls_loss_type', default='CE', type=str, help='Margin | CE')
     parser.add_argument('--confidence', type=float, default=0, help='confidence for margin based attack method')
@@ -358,7 +518,10 @@ if __name__ == '__main__':
     ## Mesh opt
     parser.add_argument('--is_partial_var', dest='is_partial_var', action='store_true', default=False, help='')
     parser.add_argument('--knn_range', type=int, default=3, help='')
+    parser.add_argument('--is_patch_local', action='store_true', default=False, help='with is_partial_var, cache the loss terms of the static points once per patch and evaluate only the patch at each step')
     parser.add_argument('--is_subsample_opt', dest='is_subsample_opt', action='store_true', default=False, help='')
+    parser.add_argument('--fps_refresh_freq', type=int, default=1, help='with is_subsample_opt, steps between two farthest point samplings, the sampled indices are reused in between')
+    parser.add_argument('--fps_refresh_drift', type=float, default=0, help='with is_subsample_opt, also resample a cloud once a point moved this far since its last sampling, 0 to disable')
     parser.add_argument('--is_use_lr_scheduler', dest='is_use_lr_scheduler', action='store_true', default=False, help='')
     ## perturbation clip setting
     parser.add_argument('--cc_linf', type=float, default=0.0, help='Coefficient for infinity norm')
@@ -382,7 +545,28 @@ if __name__ == '__main__':
     parser.add_argument('--is_save_normal', action='store_true', default=False, help='')
     parser.add_argument('--is_debug', action='store_true', default=False, help='')
     parser.add_argument('--is_low_memory', action='store_true', default=False, help='')
+    parser.add_argument('--device', default='auto', type=str, help='cpu | cuda | cuda:k | auto (cuda when available)')
+    parser.add_argument('--dtype', default='float32', type=str, help='float32 | float64, of the clouds and the model')
+    parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads, 0 for the torch default')
+    parser.add_argument('--knn_backend', default='auto', type=str, choices=['auto', 'torch', 'pytorch3d'], help='nearest neighbour search of the losses, auto: pytorch3d when installed')
+    parser.add_argument('--knn_mem_budget', type=float, default=256, help='MB of the distance tiles of the torch knn backend')
+    parser.add_argument('--is_result_store', action='store_true', default=False, help='save the adversarial examples in Store/ shards instead of one .mat and .obj file each')
+    parser.add_argument('--num_writer_threads', type=int, default=1, help='threads saving the adversarial examples in the background, 0 to save them in the attack loop')
+    parser.add_argument('--writer_queue_size', type=int, default=64, help='max number of files waiting to be saved')
+    #------------Checkpoint-----------------------
+    parser.add_argument('--ckpt_freq', type=int, default=1, help='save a checkpoint every ckpt_freq batches, 0 to disable')
+    parser.add_argument('--is_search_step_ckpt', action='store_true', default=False, help='also save a checkpoint after every search step of a batch')
+    parser.add_argument('--resume', action='store_true', default=False, help='continue from Records/checkpoint.pkl of the same saved_dir')
+    #------------Profile-----------------------
+    parser.add_argument('--is_profile', action='store_true', default=False, help='time the stages of the attack, summary in Records/profile.json')
+    parser.add_argument('--is_profile_trace', action='store_true', default=False, help='with is_profile, also write a torch.profiler Chrome trace of the first batch in Records')
+
+
+    return parser
+
 
+if __name__ == '__main__':
+    parser = get_parser()
     cfg  = parser.parse_args()
     print(cfg, '\n')
 
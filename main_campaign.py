@@ -0,0 +1,189 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = BASE_DIR
+# the Lib modules share stage_profiler and knn by their bare names
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+
+import main_attack
+from Lib.device_policy import get_device_policy
+from Lib.utility import Async_writer, Count_converge_iter, Count_loss_iter
+from stage_profiler import Stage_profiler, profiler
+from knn import set_knn_backend
+
+
+# every batch of the test loader is a task; a worker claims the first 'todo' task inside a write
+# transaction, so that two workers never get the same batch
+def _connect(db_file):
+    return sqlite3.connect(db_file, timeout=600, isolation_level=None)
+
+def _init_queue(db_file, num_batch):
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = _connect(db_file)
+    conn.execute('CREATE TABLE tasks (batch_idx INTEGER PRIMARY KEY, status TEXT, worker INTEGER, num_success INTEGER, num_all INTEGER, result BLOB)')
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany('INSERT INTO tasks (batch_idx, status) VALUES (?, ?)', [(i, 'todo') for i in range(num_batch)])
+    conn.execute('COMMIT')
+    conn.close()
+
+def _claim_task(conn, worker_id):
+    conn.execute('BEGIN IMMEDIATE')
+    row = conn.execute("SELECT batch_idx FROM tasks WHERE status = 'todo' ORDER BY batch_idx LIMIT 1").fetchone()
+    if row is not None:
+        conn.execute("UPDATE tasks SET status = 'running', worker = ? WHERE batch_idx = ?", (worker_id, row[0]))
+    conn.execute('COMMIT')
+    return None if row is None else row[0]
+
+def _finish_task(conn, batch_idx, num_success, num_all, result):
+    conn.execute("UPDATE tasks SET status = 'done', num_success = ?, num_all = ?, result = ? WHERE batch_idx = ?",
+        (num_success, num_all, sqlite3.Binary(pickle.dumps(result)), batch_idx))
+
+def _get_batch(dataset, batch_idx, batch_size):
+    # the same batch as the batch_idx-th iteration of the (unshuffled) test loader
+    start = batch_idx * batch_size
+    end = min(start + batch_size, len(dataset))
+    return torch.utils.data.dataloader.default_collate([dataset[k] for k in range(start, end)])
+
+
+def worker(worker_id, cfg, saved_dir, db_file, seed):
+    # with cuda, the workers are spread over the visible devices
+    policy = get_device_policy(cfg, worker_id)
+    policy.setup()
+    set_knn_backend(cfg.knn_backend, cfg.knn_mem_budget)
+
+    test_dataset, dense_test_dataset = main_attack.get_test_dataset(cfg)
+    num_batch = int(np.ceil(len(test_dataset) / float(cfg.batch_size)))
+    net = main_attack.load_model(cfg, policy)
+    if cfg.is_profile:
+        profiler.enable()
+    writer = Async_writer(cfg.num_writer_threads, cfg.writer_queue_size) if cfg.num_writer_threads > 0 else None
+
+    conn = _connect(db_file)
+    while True:
+        i = _claim_task(conn, worker_id)
+        if i is None:
+            break
+
+        # seeded per batch, the results do not depend on which worker gets the batch
+        np.random.seed(seed + i)
+        policy.manual_seed(seed + i)
+
+        data = _get_batch(test_dataset, i, cfg.batch_size)
+        dense_data = _get_batch(dense_test_dataset, i, cfg.batch_size) if dense_test_dataset is not None else None
+        cnt_ins = test_dataset.start_index + i * cfg.batch_size
+
+        since = time.time()
+        profiler.begin_batch()
+        num_success, b, best_attack_step, loss = main_attack.attack_batch(net, data, dense_data, cfg, i, num_batch, saved_dir, cnt_ins, writer=writer, policy=policy)
+        profiler.end_batch(i, b)
+        # a batch is done only once its files are written; a failed write makes the worker exit with an error
+        if writer is not None:
+            writer.flush()
+        _finish_task(conn, i, num_success, b, [best_attack_step, loss])
+        print('[worker {0}] batch [{1}/{2}] done in {3:.1f}s'.format(worker_id, i+1, num_batch, time.time()-since))
+    conn.close()
+    if writer is not None:
+        writer.close()
+    if cfg.is_profile:
+        profiler.save(os.path.join(saved_dir, 'Records', 'profile_worker{}.json'.format(worker_id)))
+
+
+def main(cfg):
+    assert cfg.attack == 'GeoA3', 'The campaign runner only supports GeoA3.'
+
+    saved_dir = main_attack.get_saved_dir(cfg)
+    db_file = os.path.join(saved_dir, 'Records', 'campaign_queue.db')
+
+    if cfg.id == 0:
+        seed = 0
+    else:
+        seed = int(time.time())
+
+    test_dataset, _ = main_attack.get_test_dataset(cfg)
+    num_batch = int(np.ceil(len(test_dataset) / float(cfg.batch_size)))
+    _init_queue(db_file, num_batch)
+
+    # spawn, so that every worker gets its own cuda context and victim model
+    ctx = mp.get_context('spawn')
+    procs = [ctx.Process(target=worker, args=(k, cfg, saved_dir, db_file, seed)) for k in range(cfg.num_procs)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [k for k, p in enumerate(procs) if p.exitcode != 0]
+    if len(failed) > 0:
+        assert False, 'Workers {} failed, exit codes: {}'.format(failed, [procs[k].exitcode for k in failed])
+
+    conn = _connect(db_file)
+    rows = conn.execute('SELECT batch_idx, status, num_success, num_all, result FROM tasks ORDER BY batch_idx').fetchall()
+    conn.close()
+    unfinished = [row[0] for row in rows if row[1] != 'done']
+    if len(unfinished) > 0:
+        assert False, 'Batches {} are not finished, exit codes of the workers: {}'.format(unfinished, [p.exitcode for p in procs])
+
+    # merge in the batch order, as main_attack.main records them
+    if cfg.is_record_converged_steps:
+        cci = Count_converge_iter(os.path.join(saved_dir, 'Records'))
+    if cfg.is_record_loss:
+        cli = Count_loss_iter(os.path.join(saved_dir, 'Records'))
+
+    num_attack_success = 0
+    cnt_all = 0
+    for _, _, num_success, num_all, result in rows:
+        best_attack_step, loss = pickle.loads(result)
+        if cfg.is_record_converged_steps:
+            cci.record_converge_iter(best_attack_step)
+        if cfg.is_record_loss:
+            cli.record_loss_iter(loss)
+        num_attack_success += num_success
+        cnt_all += num_all
+
+    if cfg.is_record_converged_steps:
+        cci.save_converge_iter()
+        cci.plot_converge_iter_hist()
+    if cfg.is_record_loss:
+        cli.save_loss_iter()
+        cli.plot_loss_iter_hist()
+
+    # the summary of the campaign is the sum of the ones of the workers
+    if cfg.is_profile:
+        campaign_profiler = Stage_profiler()
+        for k in range(cfg.num_procs):
+            with open(os.path.join(saved_dir, 'Records', 'profile_worker{}.json'.format(k))) as f:
+                campaign_profiler.load_state_dict(json.load(f))
+        campaign_profiler.save(os.path.join(saved_dir, 'Records', 'profile.json'))
+        campaign_profiler.print_summary()
+
+    print('attack success: {0:.2f}\n'.format(num_attack_success/float(cnt_all)*100))
+    with open(os.path.join(saved_dir, 'attack_result.txt'), 'at') as f:
+        f.write('attack success: {0:.2f}\n'.format(num_attack_success/float(cnt_all)*100))
+    print('saved_dir: {0}'.format(os.path.join(saved_dir)))
+
+    print('Finish!')
+
+    return saved_dir
+
+
+if __name__ == '__main__':
+    parser = main_attack.get_parser()
+    #------------Campaign-----------------------
+    parser.add_argument('--num_procs', type=int, default=4, help='number of worker processes, each with its own copy of the victim model')
+    # intra-op threads of every worker
+    parser.set_defaults(num_threads=1)
+
+    cfg  = parser.parse_args()
+    print(cfg, '\n')
+
+    main(cfg)
@@ -9,7 +9,6 @@ import shutil
 import sys
 import time
 
-import ipdb
 import numpy as np
 import torch
 import torch.nn as nn
@@ -19,6 +18,7 @@ from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 import Provider.provider
+from Lib.device_policy import get_device_policy
 from Lib.utility import Average_meter, progress_bar
 from Provider.modelnet_trn_test import ModelNetDataset
 
@@ -43,6 +43,8 @@ parser.add_argument('--is_aug_data', dest='is_aug_data', action='store_true', de
 parser.add_argument('--arch', default='PointNet', type=str, metavar='ARCH', help='')
 # ========================= Training Configs ==========================
 parser.add_argument('-g', '--mGPU', default=1, type=int, metavar='N', help='num of GPUs (default: 1)')
+parser.add_argument('--device', default='auto', type=str, help='cpu | cuda | cuda:k | auto (cuda when available)')
+parser.add_argument('--num_threads', type=int, default=0, help='intra-op threads, 0 for the torch default')
 parser.add_argument('-j', '--num_workers', default=8, type=int, metavar='N', help='number of data loading workers (default: 8)')
 parser.add_argument('-b', '--batch_size', default=32, type=int, metavar='N', help='mini-batch size (default: 32)')
 parser.add_argument('--epochs', default=250, type=int, metavar='N',  help='number of total epochs to run')
@@ -93,7 +95,7 @@ class softmax_with_smoothing_label_loss(nn.Module):
 
     def forward(self, output, target):
         if self.ones is None:
-            self.ones = Variable(torch.eye(self.num_classes).to(output).cuda())
+            self.ones = Variable(torch.eye(self.num_classes).to(output))
         output = -1*self.log_softmax(output)
         one_hot = self.ones.index_select(0,target)
         one_hot = one_hot*(1 - self.label_smoothing) + self.label_smoothing / self.num_classes
@@ -137,9 +139,10 @@ def main():
         seed = cfg.random_seed
     else:
         seed = int(time.time())
+    policy = get_device_policy(cfg)
+    policy.setup()
     np.random.seed(seed)
-    torch.manual_seed(seed)
-    torch.cuda.manual_seed_all(seed)
+    policy.manual_seed(seed)
 
     # dataset
     TRAIN_DATASET = ModelNetDataset(root=DATA_PATH, batch_size=cfg.batch_size, npoints=cfg.npoint, split='train', normal_channel=False)
@@ -148,13 +151,14 @@ def main():
     # model
     if cfg.arch == 'PointNet':
         from Model.PointNet import PointNet
-        net = PointNet(cfg.classes).cuda()
+        net = PointNet(cfg.classes)
     elif cfg.arch == 'PointNetPP':
         from Model.PointNetPP_ssg import PointNet2ClassificationSSG
-        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False).cuda()
+        net = PointNet2ClassificationSSG(use_xyz=True, use_normal=False)
     else:
         assert False
-    criterion = softmax_with_smoothing_label_loss().cuda()
+    net = policy.model(net)
+    criterion = softmax_with_smoothing_label_loss()
 
     params = []
     for key, value in dict(net.named_parameters()).items():
@@ -167,7 +171,7 @@ def main():
     if cfg.resume:
         if os.path.isfile(cfg.resume):
             print("=> loading checkpoint '{}'".format(cfg.resume))
-            checkpoint = torch.load(cfg.resume)
+            checkpoint = torch.load(cfg.resume, map_location=policy.device)
             start_epoch = checkpoint['epoch']+1
             best_prec = checkpoint['best_prec']
             class_prec = checkpoint['class_prec']
@@ -182,7 +186,8 @@ def main():
         class_prec = 0
 
     if cfg.mGPU>1:
-        net = torch.nn.DataParallel(net,device_ids=range(0, cfg.mGPU)).cuda()
+        assert policy.is_cuda, 'Multi-GPU training needs a cuda device.'
+        net = torch.nn.DataParallel(net,device_ids=range(0, cfg.mGPU))
 
     # train & test
     for epoch in range(start_epoch, cfg.epochs+1):
@@ -205,12 +210,12 @@ def main():
             target = torch.Tensor(target).long()
 
             points = points.transpose(2, 1)
-            points, target = points.cuda(), target.cuda()
+            points, target = policy.to(points), target.to(policy.device)
             optimizer.zero_grad()
 
             points = points[:,[0,2,1],:]
-            pc_var = Variable(points).cuda()
-            label_var = Variable(target.long()).cuda()
+            pc_var = Variable(points)
+            label_var = Variable(target.long())
 
             trn_output, transform = net(pc_var)
 
@@ -218,7 +223,7 @@ def main():
 
             K = transform.size(1)
             mat_diff = torch.bmm(transform, transform.permute(0, 2, 1))
-            mat_diff -= Variable(torch.eye(K).float().cuda().unsqueeze(0))
+            mat_diff -= Variable(torch.eye(K).to(mat_diff).unsqueeze(0))
             mat_diff_loss = torch.sum(mat_diff**2)/2
             trn_loss = trn_loss + mat_diff_loss * 0.001
 
@@ -273,13 +278,13 @@ def main():
                 target = torch.Tensor(target).long()
 
                 points = points.transpose(2, 1)
-                points, target = points.cuda(), target.cuda()
+                points, target = policy.to(points), target.to(policy.device)
                 optimizer.zero_grad()
 
                 points = points[:,[0,2,1],:]
 
-                pc_var = Variable(points).cuda()
-                label_var = Variable(target.long()).cuda()
+                pc_var = Variable(points)
+                label_var = Variable(target.long())
 
                 test_output = net(pc_var)
                 test_loss = criterion(test_output, label_var)
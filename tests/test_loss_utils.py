@@ -0,0 +1,50 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import unittest
+
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+
+from knn import knn_points
+from loss_utils import Patch_context, curvature_loss, _get_kappa_ori, _get_kappa_adv
+from utility import _normalize
+
+
+class Test_patch_context(unittest.TestCase):
+    def test_curvature_matches_dense(self):
+        # the patch points move far enough to enter and leave the neighbourhoods of static points
+        torch.manual_seed(0)
+        b, n, p, k = 2, 512, 32, 8
+        normal = _normalize(torch.randn(b, 3, n))
+        ori_pc = normal * (1 + 0.05 * torch.rand(b, 1, n))
+        ori_kappa = _get_kappa_ori(ori_pc, normal, k)
+        periodical_pc = ori_pc + 0.01 * torch.randn(b, 3, n)
+        patch_idx = knn_points(periodical_pc[:, :, :1].permute(0,2,1), periodical_pc.permute(0,2,1), K=p+1).idx[:, 0, 1:] # [b, p]
+        ctx = Patch_context(periodical_pc, patch_idx, ori_pc, normal, ori_kappa, k)
+
+        part_offset = torch.zeros(b, 3, p)
+        for _ in range(5):
+            part_offset = part_offset + 0.05 * torch.randn(b, 3, p)
+            offset_var = part_offset.clone().requires_grad_()
+            offset = torch.zeros(b, 3, n).scatter(2, patch_idx.unsqueeze(1).expand(b, 3, p), offset_var)
+            adv_pc = periodical_pc + offset
+
+            ctx.update(adv_pc)
+            patch_loss = ctx.curvature_loss()
+            patch_grad, = torch.autograd.grad(patch_loss.sum(), offset_var, retain_graph=True)
+
+            adv_kappa, _ = _get_kappa_adv(adv_pc, ori_pc, normal, k)
+            dense_loss = curvature_loss(adv_pc, ori_pc, adv_kappa, ori_kappa, k)
+            dense_grad, = torch.autograd.grad(dense_loss.sum(), offset_var)
+
+            self.assertTrue(torch.allclose(patch_loss, dense_loss, rtol=1e-5, atol=1e-7))
+            self.assertTrue(torch.allclose(patch_grad, dense_grad, rtol=1e-4, atol=1e-7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import unittest
+
+import torch
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'Lib'))
+
+from knn import knn_points
+from spatial_index import Ori_nn_tracker
+
+
+def _cloud(xs):
+    # points on the x axis, [1, 3, n]
+    pc = torch.zeros(1, 3, len(xs))
+    pc[0, 0] = torch.Tensor(xs)
+    return pc
+
+class Test_ori_nn_tracker(unittest.TestCase):
+    def test_move_away_and_back(self):
+        # the point is walked to another neighbour and comes back within the gap of its anchor
+        pc_ori = _cloud([0, 1, 10])
+        tracker = Ori_nn_tracker(pc_ori, graph_k=2)
+        for x in [0.1, 0.9, 0.1]:
+            adv_pc = _cloud([x])
+            expected = knn_points(adv_pc.permute(0,2,1), pc_ori.permute(0,2,1), K=1)
+            result = tracker.query(adv_pc)
+            self.assertEqual(result.idx.view(-1).tolist(), expected.idx.view(-1).tolist())
+            self.assertTrue(torch.allclose(result.dists, expected.dists))
+
+    def test_random_steps(self):
+        torch.manual_seed(0)
+        pc_ori = torch.randn(2, 3, 256)
+        for scale in [0.002, 0.02, 0.2]:
+            adv_pc = pc_ori.clone()
+            tracker = Ori_nn_tracker(pc_ori)
+            for _ in range(20):
+                adv_pc = adv_pc + scale * torch.randn_like(adv_pc)
+                expected = knn_points(adv_pc.permute(0,2,1), pc_ori.permute(0,2,1), K=1)
+                result = tracker.query(adv_pc)
+                self.assertTrue(torch.equal(result.idx, expected.idx))
+                self.assertTrue(torch.allclose(result.dists, expected.dists))
+
+if __name__ == '__main__':
+    unittest.main()